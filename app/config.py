@@ -15,11 +15,76 @@ PORT = int(os.getenv("RAG_APP_PORT", "8001"))
 
 ENVIRONMENT = os.getenv("ENVIRONMENT", "prod")
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+# The event loop lag is sampled every EVENT_LOOP_LAG_INTERVAL_MS for /metrics
+EVENT_LOOP_LAG_INTERVAL_MS = float(os.getenv("EVENT_LOOP_LAG_INTERVAL_MS", "250"))
+# Log the callbacks blocking the event loop for longer than this, in asyncio
+# debug mode (0 disables it, the debug mode slows the server down)
+EVENT_LOOP_SLOW_CALLBACK_MS = float(os.getenv("EVENT_LOOP_SLOW_CALLBACK_MS", "0"))
 
 
 ROOT_PATH = os.getcwd()
 
 CHROMA_DB_PATH = "/database/vector_store"
+FAISS_DB_PATH = "/database/faiss"
+
+# Vector store of the projects that don't select one: chroma or faiss
+VECTOR_STORE_BACKEND = os.getenv("VECTOR_STORE_BACKEND", "chroma")
+# FAISS index type of the projects that don't select one: flat, ivf or hnsw
+FAISS_INDEX_TYPE = os.getenv("FAISS_INDEX_TYPE", "flat")
+# Inverted lists of IVF indexes (0 picks about 4 * sqrt(vectors))
+FAISS_IVF_NLIST = int(os.getenv("FAISS_IVF_NLIST", "0"))
+FAISS_IVF_NPROBE = int(os.getenv("FAISS_IVF_NPROBE", "16"))
+FAISS_HNSW_M = int(os.getenv("FAISS_HNSW_M", "32"))
+FAISS_HNSW_EF_CONSTRUCTION = int(os.getenv("FAISS_HNSW_EF_CONSTRUCTION", "80"))
+FAISS_HNSW_EF_SEARCH = int(os.getenv("FAISS_HNSW_EF_SEARCH", "64"))
+# Vector compression of the projects that don't select one: int8 or pq
+FAISS_COMPRESSION = os.getenv("FAISS_COMPRESSION") or None
+# Sub-quantizers of product quantization (0 picks one per 8 dimensions)
+FAISS_PQ_M = int(os.getenv("FAISS_PQ_M", "0"))
+# Candidates per result re-scored with the exact vectors of compressed indexes
+FAISS_RESCORE_FACTOR = int(os.getenv("FAISS_RESCORE_FACTOR", "4"))
+
+# Vector indexes kept open for queries, least recently used first evicted
+# (0 opens the index on every query)
+VECTOR_INDEX_CACHE_SIZE = int(os.getenv("VECTOR_INDEX_CACHE_SIZE", "16"))
+
+# Chat answers reused for queries whose embedding is at least
+# ANSWER_CACHE_SIMILARITY (cosine) close to a cached one
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.95"))
+ANSWER_CACHE_TTL_SECONDS = float(os.getenv("ANSWER_CACHE_TTL_SECONDS", "86400"))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "1000"))
+
+LEXICAL_INDEX_PATH = "/database/lexical"
+# Fuse BM25 results with the vector search results
+HYBRID_SEARCH_ENABLED = os.getenv("HYBRID_SEARCH_ENABLED", "true").lower() == "true"
+# Candidates retrieved by each retriever and passed on to the reranker
+RETRIEVER_TOP_K = int(os.getenv("RETRIEVER_TOP_K", "10"))
+# Reciprocal rank fusion constant, higher values flatten the rank weights
+RRF_K = int(os.getenv("RRF_K", "60"))
+# Questions over several projects search them concurrently, a project not
+# answering within FEDERATED_SHARD_TIMEOUT_SECONDS is left out. The best
+# FEDERATED_TOP_K candidates of all projects are passed to the reranker.
+FEDERATED_SHARD_TIMEOUT_SECONDS = float(
+	os.getenv("FEDERATED_SHARD_TIMEOUT_SECONDS", "5")
+)
+FEDERATED_TOP_K = int(os.getenv("FEDERATED_TOP_K", "20"))
+
+EMBEDDING_CACHE_PATH = "/database/embedding_cache.db"
+EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() == "true"
+EMBEDDING_CACHE_SIZE_MB = int(os.getenv("EMBEDDING_CACHE_SIZE_MB", "1024"))
+
+# Embedding requests in flight at once, per embedding model
+EMBEDDING_CONCURRENCY = int(os.getenv("EMBEDDING_CONCURRENCY", "4"))
+# Inputs and tokens of a single request (0 uses the limits of the provider)
+EMBEDDING_MAX_BATCH_SIZE = int(os.getenv("EMBEDDING_MAX_BATCH_SIZE", "0"))
+EMBEDDING_MAX_BATCH_TOKENS = int(os.getenv("EMBEDDING_MAX_BATCH_TOKENS", "0"))
+# Requests and tokens per minute budget (0 for no limit)
+EMBEDDING_RPM = int(os.getenv("EMBEDDING_RPM", "0"))
+EMBEDDING_TPM = int(os.getenv("EMBEDDING_TPM", "0"))
+EMBEDDING_MAX_RETRIES = int(os.getenv("EMBEDDING_MAX_RETRIES", "6"))
+# Seconds before the first retry, doubled on every following attempt
+EMBEDDING_RETRY_BACKOFF = float(os.getenv("EMBEDDING_RETRY_BACKOFF", "1"))
 
 # ======================= LLM_CONFIGURATIONS ========================
 # LLM_PROVIDER = os.getenv("RAG_PROVIDER", "openai")
@@ -30,6 +95,42 @@ LLM_PROVIDER = "openai"
 # LLM_MODEL = "gpt-3.5-turbo"
 LLM_MODEL = "gpt-4o-mini"
 EMBEDDING_MODEL = "text-embedding-3-small"
+# openai, ollama or local (in-process sentence-transformers model)
+EMBEDDING_PROVIDER = os.getenv("EMBEDDING_PROVIDER", LLM_PROVIDER)
+
+LOCAL_MODELS_PATH = "/database/models"
+LOCAL_EMBEDDING_MODEL = os.getenv("LOCAL_EMBEDDING_MODEL", "BAAI/bge-small-en-v1.5")
+# torch or onnx (requires optimum[onnxruntime])
+LOCAL_EMBEDDING_BACKEND = os.getenv("LOCAL_EMBEDDING_BACKEND", "torch")
+LOCAL_EMBEDDING_QUANTIZE = (
+	os.getenv("LOCAL_EMBEDDING_QUANTIZE", "false").lower() == "true"
+)
+LOCAL_EMBEDDING_DEVICE = os.getenv("LOCAL_EMBEDDING_DEVICE", "cpu")
+LOCAL_EMBEDDING_THREADS = int(
+	os.getenv("LOCAL_EMBEDDING_THREADS", str(os.cpu_count() or 1))
+)
+LOCAL_EMBEDDING_BATCH_SIZE = int(os.getenv("LOCAL_EMBEDDING_BATCH_SIZE", "64"))
+
+# Cross-encoder reranking the retrieved chunks, loaded once at startup
+RERANKER_MODEL = os.getenv("RERANKER_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+RERANKER_DEVICE = os.getenv("RERANKER_DEVICE", "cpu")
+RERANKER_MAX_LENGTH = int(os.getenv("RERANKER_MAX_LENGTH", "512"))
+RERANKER_TOP_N = int(os.getenv("RERANKER_TOP_N", "10"))
+# Concurrent requests are scored together, up to RERANKER_BATCH_SIZE pairs
+# arriving within RERANKER_BATCH_WAIT_MS of the first one
+RERANKER_BATCH_SIZE = int(os.getenv("RERANKER_BATCH_SIZE", "64"))
+RERANKER_BATCH_WAIT_MS = float(os.getenv("RERANKER_BATCH_WAIT_MS", "5"))
+
+# Tokens of retrieved code sent to the LLM with a question. Overlapping and
+# adjacent chunks of a file are merged, the best scored spans go first
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "6000"))
+
+# Questions of a single /chat/batch request, and LLM calls it makes at once
+BATCH_MAX_QUERIES = int(os.getenv("BATCH_MAX_QUERIES", "1000"))
+BATCH_LLM_CONCURRENCY = int(os.getenv("BATCH_LLM_CONCURRENCY", "8"))
+
+# Answer program compiled by `python cli.py compile`, loaded at startup
+ANSWER_PROGRAM_PATH = "/database/answer_program.json"
 
 LLM_PROVIDER_BASE_URL = os.getenv("RAG_BASE_URL")
 LLM_PROVIDER_API_KEY = os.getenv("RAG_API_KEY")
@@ -37,5 +138,30 @@ LLM_PROVIDER_API_KEY = os.getenv("RAG_API_KEY")
 LLM_MAX_TOKENS = os.getenv("RAG_LLM_MAX_TOKENS")
 LLM_TEMPERATURE = float(os.getenv("RAG_LLM_TEMPERATURE", 0.5))
 
+INDEX_BATCH_SIZE = int(os.getenv("INDEX_BATCH_SIZE", "200"))
+# Processes used to parse and chunk files (0 parses on the reader threads)
+INDEX_PARSE_WORKERS = int(os.getenv("INDEX_PARSE_WORKERS", str(os.cpu_count() or 1)))
+# Threads used to read and decode files
+INDEX_READ_WORKERS = int(os.getenv("INDEX_READ_WORKERS", "8"))
+# Parsed batches waiting for the embedding stage
+INDEX_QUEUE_SIZE = int(os.getenv("INDEX_QUEUE_SIZE", "4"))
+
+# Projects indexed concurrently
+INDEX_JOB_WORKERS = int(os.getenv("INDEX_JOB_WORKERS", "2"))
+INDEX_JOB_MAX_ATTEMPTS = int(os.getenv("INDEX_JOB_MAX_ATTEMPTS", "3"))
+# Seconds before the first retry, doubled on every following attempt
+INDEX_JOB_RETRY_BACKOFF = float(os.getenv("INDEX_JOB_RETRY_BACKOFF", "30"))
+INDEX_JOB_POLL_INTERVAL = float(os.getenv("INDEX_JOB_POLL_INTERVAL", "5"))
+
+# Watched projects: changes are grouped until no new change happens for
+# INDEX_WATCH_STEP_MS, or for at most INDEX_WATCH_DEBOUNCE_MS
+INDEX_WATCH_DEBOUNCE_MS = int(os.getenv("INDEX_WATCH_DEBOUNCE_MS", "5000"))
+INDEX_WATCH_STEP_MS = int(os.getenv("INDEX_WATCH_STEP_MS", "500"))
+# Poll the file system instead of using native notifications (inotify)
+INDEX_WATCH_FORCE_POLLING = (
+	os.getenv("INDEX_WATCH_FORCE_POLLING", "false").lower() == "true"
+)
+INDEX_WATCH_POLL_DELAY_MS = int(os.getenv("INDEX_WATCH_POLL_DELAY_MS", "1000"))
+
 CHUNK_SIZE = os.getenv("CHUNK_SIZE")
 CHUNK_OVERLAP = os.getenv("CHUNK_OVERLAP")
@@ -1,8 +1,11 @@
 from typing import Annotated
 
 from fastapi import Depends
+from sqlalchemy import inspect, literal, text
 from sqlmodel import Session, SQLModel, create_engine
 
+from app.utils import logger
+
 sqlite_file_name = "database.db"
 sqlite_url = f"sqlite:///{sqlite_file_name}"
 
@@ -10,8 +13,37 @@ connect_args = {"check_same_thread": False}
 engine = create_engine(sqlite_url, connect_args=connect_args)
 
 
+def _add_missing_columns():
+	"""
+	`create_all` only creates the missing tables. Add the columns added to
+	the models since a table was created, existing rows get the default of
+	the column.
+	"""
+	inspector = inspect(engine)
+	with engine.begin() as connection:
+		for table in SQLModel.metadata.sorted_tables:
+			if not inspector.has_table(table.name):
+				continue
+			existing = {column["name"] for column in inspector.get_columns(table.name)}
+			for column in table.columns:
+				if column.name in existing:
+					continue
+				statement = (
+					f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" '
+					f"{column.type.compile(dialect=engine.dialect)}"
+				)
+				if column.default is not None and column.default.is_scalar:
+					default = literal(column.default.arg, column.type).compile(
+						dialect=engine.dialect, compile_kwargs={"literal_binds": True}
+					)
+					statement += f" DEFAULT {default}"
+				logger.info(f"Adding column {column.name} to table {table.name}")
+				connection.execute(text(statement))
+
+
 def create_db_and_tables():
 	SQLModel.metadata.create_all(engine)
+	_add_missing_columns()
 
 
 def get_session():
@@ -1,3 +1,4 @@
 from .controller import chat_router
+from .program import load_answer_program, set_answer_lm
 
-__all__ = ["chat_router"]
+__all__ = ["chat_router", "load_answer_program", "set_answer_lm"]
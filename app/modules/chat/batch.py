@@ -0,0 +1,212 @@
+import asyncio
+import time
+from collections.abc import AsyncIterator
+from dataclasses import dataclass, field
+
+from llama_index.core import QueryBundle, Settings
+from llama_index.core.retrievers import VectorIndexRetriever
+from llama_index.core.schema import NodeWithScore
+from llama_index.core.vector_stores.types import VectorStoreQuery
+
+from app.config import (
+	ANSWER_CACHE_ENABLED,
+	BATCH_LLM_CONCURRENCY,
+	HYBRID_SEARCH_ENABLED,
+	RETRIEVER_TOP_K,
+)
+from app.modules.projects import ProjectStatusService
+from app.shared.answer_cache import answer_cache
+from app.shared.embedding_dispatcher import aget_query_embeddings
+from app.shared.hybrid_retriever import reciprocal_rank_fusion
+from app.shared.lexical_index import get_search_lexical_index
+from app.shared.metrics import (
+	ANSWER_CACHE_LOOKUPS,
+	BATCH_ANSWERS,
+	RETRIEVER_SECONDS,
+	timed,
+)
+from app.shared.reranker import get_reranker
+from app.shared.vector_db import get_project_vector_index
+from app.utils import logger
+
+from .context import pack_context
+from .program import answer_question
+from .workflow import answer_definition_lookup
+
+
+@dataclass
+class BatchAnswer:
+	index: int
+	query: str
+	response: str | None = None
+	nodes: list[NodeWithScore] = field(default_factory=list)
+	# definition, cache or llm
+	source: str | None = None
+	error: str | None = None
+
+
+async def retrieve_many(
+	project, bundles: list[QueryBundle]
+) -> list[list[NodeWithScore]]:
+	"""
+	Retrieve the candidates of several embedded queries. FAISS collections
+	search all the vectors at once, other stores search them concurrently on
+	threads.
+	"""
+	index = await asyncio.to_thread(get_project_vector_index, project)
+	if index is None:
+		logger.warning("Index is empty, load some documents before querying!")
+		return [[] for _ in bundles]
+
+	vector_store = index.vector_store
+	with timed(RETRIEVER_SECONDS, retriever="BatchVectorSearch"):
+		if hasattr(vector_store, "aquery_many"):
+			results = await vector_store.aquery_many(
+				[
+					VectorStoreQuery(
+						query_embedding=bundle.embedding,
+						similarity_top_k=RETRIEVER_TOP_K,
+					)
+					for bundle in bundles
+				]
+			)
+			dense = [
+				[
+					NodeWithScore(node=node, score=score)
+					for node, score in zip(
+						result.nodes, result.similarities, strict=True
+					)
+				]
+				for result in results
+			]
+		else:
+			# The Chroma store only queries synchronously, one query per
+			# call, the searches run on the threads of the default executor
+			retriever = VectorIndexRetriever(
+				index=index, similarity_top_k=RETRIEVER_TOP_K
+			)
+			dense = await asyncio.gather(
+				*(asyncio.to_thread(retriever.retrieve, bundle) for bundle in bundles)
+			)
+	if not HYBRID_SEARCH_ENABLED:
+		return dense
+
+	# The lexical index serves one search at a time, run them in one thread
+	lexical_index = get_search_lexical_index(project.name)
+	with timed(RETRIEVER_SECONDS, retriever="BatchLexicalSearch"):
+		lexical = await asyncio.to_thread(
+			lambda: [
+				lexical_index.search(bundle.query_str, RETRIEVER_TOP_K)
+				for bundle in bundles
+			]
+		)
+	return [
+		reciprocal_rank_fusion([dense_nodes, lexical_nodes])
+		for dense_nodes, lexical_nodes in zip(dense, lexical, strict=True)
+	]
+
+
+def _answer_from_nodes(nodes: list[NodeWithScore], question: str):
+	# Packing tokenizes every candidate, it runs on the thread of the LM call
+	return answer_question(context=pack_context(nodes).text, question=question)
+
+
+async def answer_batch(
+	project, queries: list[str], concurrency: int = BATCH_LLM_CONCURRENCY
+) -> AsyncIterator[BatchAnswer]:
+	"""
+	Answer many questions about a project, yielding every answer as soon as
+	it is ready, in any order.
+
+	Definition lookups and cached answers come first. The other questions
+	are embedded in a single call, searched together and reranked in full
+	batches, then answered by up to `concurrency` LLM calls at a time.
+	"""
+	started_at = time.perf_counter()
+	pending = []
+	# A symbol index query per question, off the event loop
+	lookups = await asyncio.to_thread(
+		lambda: [answer_definition_lookup([project], query) for query in queries]
+	)
+	for i, (query, answer) in enumerate(zip(queries, lookups, strict=True)):
+		if answer:
+			BATCH_ANSWERS.labels(source="definition").inc()
+			yield BatchAnswer(i, query, response=answer, source="definition")
+		else:
+			pending.append(i)
+	if not pending:
+		return
+
+	embeddings = await aget_query_embeddings(
+		Settings.embed_model, [queries[i] for i in pending]
+	)
+
+	version = None
+	if ANSWER_CACHE_ENABLED:
+		version = await asyncio.to_thread(
+			ProjectStatusService().get_index_version, project_id=project.id
+		)
+	if version is not None:
+		misses = []
+		for i, embedding in zip(pending, embeddings, strict=True):
+			cached = answer_cache.get(project.id, version, embedding)
+			ANSWER_CACHE_LOOKUPS.labels(
+				result="miss" if cached is None else "hit"
+			).inc()
+			if cached is None:
+				misses.append((i, embedding))
+				continue
+			BATCH_ANSWERS.labels(source="cache").inc()
+			yield BatchAnswer(i, queries[i], response=cached.answer, source="cache")
+		if not misses:
+			return
+		pending, embeddings = map(list, zip(*misses, strict=True))
+
+	candidates = await retrieve_many(
+		project,
+		[
+			QueryBundle(queries[i], embedding=embedding)
+			for i, embedding in zip(pending, embeddings, strict=True)
+		],
+	)
+	reranked = await get_reranker().arerank_many(
+		[(queries[i], nodes) for i, nodes in zip(pending, candidates, strict=True)]
+	)
+	logger.info(
+		f"Batch of {len(queries)} questions, {len(pending)} retrieved and "
+		f"reranked in {time.perf_counter() - started_at:.2f}s"
+	)
+
+	semaphore = asyncio.Semaphore(max(concurrency, 1))
+
+	async def answer(i: int, nodes: list[NodeWithScore], embedding) -> BatchAnswer:
+		async with semaphore:
+			try:
+				output = await asyncio.to_thread(_answer_from_nodes, nodes, queries[i])
+			except Exception as e:
+				logger.error(f"Batch question {i} failed: {e}")
+				BATCH_ANSWERS.labels(source="error").inc()
+				return BatchAnswer(i, queries[i], nodes=nodes, error=str(e))
+		if version is not None:
+			answer_cache.put(
+				project.id, version, queries[i], embedding, output.response
+			)
+		BATCH_ANSWERS.labels(source="llm").inc()
+		return BatchAnswer(
+			i, queries[i], response=output.response, nodes=nodes, source="llm"
+		)
+
+	tasks = [
+		asyncio.create_task(answer(i, nodes, embedding))
+		for i, nodes, embedding in zip(pending, reranked, embeddings, strict=True)
+	]
+	try:
+		for task in asyncio.as_completed(tasks):
+			yield await task
+	finally:
+		# The client went away, don't answer the remaining questions
+		for task in tasks:
+			task.cancel()
+
+
+__all__ = ["BatchAnswer", "answer_batch", "retrieve_many"]
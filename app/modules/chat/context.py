@@ -0,0 +1,195 @@
+from dataclasses import dataclass, field
+
+from llama_index.core.schema import NodeWithScore
+from llama_index.core.utils import get_tokenizer
+
+from app.config import CONTEXT_TOKEN_BUDGET
+from app.shared.metrics import CONTEXT_TOKENS
+from app.utils import logger
+
+# Spans smaller than this are not worth truncating into the remaining budget
+_MIN_TRUNCATED_TOKENS = 32
+
+
+@dataclass
+class ContextSpan:
+	"""
+	Lines of a file covered by one or more retrieved chunks.
+	"""
+
+	file_path: str | None
+	start_line: int | None
+	end_line: int | None
+	lines: list[str]
+	score: float
+	chunks: int = 1
+	# Set on the chunks of questions over several projects
+	project: str | None = None
+
+	@property
+	def header(self) -> str:
+		location = self.file_path or "unknown"
+		if self.start_line is not None:
+			location += f":{self.start_line}-{self.end_line}"
+		return f"# {self.project}: {location}" if self.project else f"# {location}"
+
+	@property
+	def body(self) -> str:
+		return "\n".join(self.lines)
+
+	@property
+	def text(self) -> str:
+		return f"{self.header}\n{self.body}"
+
+
+@dataclass
+class PackedContext:
+	text: str
+	spans: list[ContextSpan] = field(default_factory=list)
+	# Tokens of the retrieved chunks joined as they are, and once packed
+	retrieved_tokens: int = 0
+	tokens: int = 0
+	# Tokens of the span headers, which the retrieved chunks don't have
+	header_tokens: int = 0
+	# Chunks merged into other spans, and spans left out of the budget
+	merged_chunks: int = 0
+	dropped_spans: int = 0
+
+	@property
+	def saved_tokens(self) -> int:
+		"""
+		Tokens saved by merging, deduplicating and the budget, the headers
+		aside.
+		"""
+		return self.retrieved_tokens - (self.tokens - self.header_tokens)
+
+
+def _span(node: NodeWithScore) -> ContextSpan:
+	metadata = node.node.metadata
+	lines = node.node.get_content().splitlines()
+	start_line, end_line = metadata.get("start_line"), metadata.get("end_line")
+	# Only chunks whose text matches their line range can be merged by line
+	if (
+		start_line is None
+		or end_line is None
+		or end_line - start_line + 1 != len(lines)
+	):
+		start_line = end_line = None
+	return ContextSpan(
+		file_path=metadata.get("file_path"),
+		start_line=start_line,
+		end_line=end_line,
+		lines=lines,
+		score=node.score or 0.0,
+		project=metadata.get("project"),
+	)
+
+
+def merge_spans(nodes: list[NodeWithScore]) -> tuple[list[ContextSpan], int]:
+	"""
+	Turn the retrieved chunks into spans: chunks of a file overlapping or
+	next to each other become one span with the best of their scores, and
+	chunks whose text is part of another are dropped. Returns the spans,
+	best scored first, and how many chunks were merged or dropped.
+	"""
+	by_file: dict[tuple[str | None, str | None], list[ContextSpan]] = {}
+	unranged: list[ContextSpan] = []
+	for node in nodes:
+		span = _span(node)
+		if span.start_line is None:
+			unranged.append(span)
+		else:
+			by_file.setdefault((span.project, span.file_path), []).append(span)
+
+	spans: list[ContextSpan] = []
+	for file_spans in by_file.values():
+		file_spans.sort(key=lambda span: (span.start_line, -span.end_line))
+		current = file_spans[0]
+		for span in file_spans[1:]:
+			if span.start_line > current.end_line + 1:
+				spans.append(current)
+				current = span
+				continue
+			# Only the lines past the end of the current span are new
+			current.lines += span.lines[current.end_line - span.start_line + 1 :]
+			current.end_line = max(current.end_line, span.end_line)
+			current.score = max(current.score, span.score)
+			current.chunks += span.chunks
+		spans.append(current)
+
+	# Chunks without lines (plain text splits) are only deduplicated
+	kept: list[ContextSpan] = []
+	for span in sorted(unranged, key=lambda span: len(span.body), reverse=True):
+		container = next((other for other in kept if span.body in other.body), None)
+		if container is None:
+			kept.append(span)
+			continue
+		container.score = max(container.score, span.score)
+		container.chunks += span.chunks
+	spans += kept
+
+	spans.sort(key=lambda span: span.score, reverse=True)
+	return spans, len(nodes) - len(spans)
+
+
+def pack_context(
+	nodes: list[NodeWithScore], budget: int = CONTEXT_TOKEN_BUDGET
+) -> PackedContext:
+	"""
+	Assemble the context of an answer from the reranked chunks: merge them
+	into spans of files, best scored first, until `budget` tokens. The span
+	crossing the budget is cut at its last fitting line.
+	"""
+	tokenizer = get_tokenizer()
+	# Counted per chunk like the spans, so tokens merging across the
+	# separators don't count as savings
+	retrieved_tokens = sum(len(tokenizer(node.text)) + 1 for node in nodes)
+	spans, merged_chunks = merge_spans(nodes)
+
+	packed: list[ContextSpan] = []
+	tokens = 0
+	for span in spans:
+		# Spans are separated by a blank line, about one token
+		span_tokens = len(tokenizer(span.text)) + 1
+		if tokens + span_tokens <= budget:
+			packed.append(span)
+			tokens += span_tokens
+			continue
+		remaining = budget - tokens - len(tokenizer(span.header)) - 1
+		if remaining >= _MIN_TRUNCATED_TOKENS:
+			lines = []
+			for line in span.lines:
+				remaining -= len(tokenizer(line)) + 1
+				if remaining < 0:
+					break
+				lines.append(line)
+			if lines:
+				span.lines = lines
+				if span.start_line is not None:
+					span.end_line = span.start_line + len(lines) - 1
+				packed.append(span)
+				tokens += len(tokenizer(span.text)) + 1
+		break
+
+	body_tokens = sum(len(tokenizer(span.body)) + 1 for span in packed)
+	context = PackedContext(
+		text="\n\n".join(span.text for span in packed),
+		spans=packed,
+		retrieved_tokens=retrieved_tokens,
+		tokens=tokens,
+		header_tokens=tokens - body_tokens,
+		merged_chunks=merged_chunks,
+		dropped_spans=len(spans) - len(packed),
+	)
+	CONTEXT_TOKENS.labels(kind="retrieved").inc(context.retrieved_tokens)
+	CONTEXT_TOKENS.labels(kind="packed").inc(context.tokens)
+	logger.info(
+		f"Context of {context.tokens} tokens from {len(nodes)} chunks "
+		f"({context.saved_tokens} tokens saved, {context.header_tokens} tokens "
+		f"of headers, {merged_chunks} chunks merged, "
+		f"{context.dropped_spans} spans over the budget of {budget})"
+	)
+	return context
+
+
+__all__ = ["ContextSpan", "PackedContext", "merge_spans", "pack_context"]
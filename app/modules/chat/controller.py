@@ -1,50 +1,342 @@
-from uuid import UUID
+import json
+import time
+from collections.abc import AsyncIterator
+from uuid import NAMESPACE_URL, UUID, uuid5
 
-from fastapi import APIRouter, HTTPException
-from pydantic import BaseModel
+from fastapi import APIRouter, HTTPException, Response, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
+from llama_index.core import Settings
+from llama_index.core.workflow import StopEvent
+from pydantic import BaseModel, Field, ValidationError, model_validator
 
-from app.modules.projects import ProjectService, ProjectStatusEnum
+from app.config import ANSWER_CACHE_ENABLED, BATCH_MAX_QUERIES
+from app.modules.projects import (
+	ProjectSchemas,
+	ProjectService,
+	ProjectStatusEnum,
+	ProjectStatusService,
+)
+from app.shared.answer_cache import CachedAnswer, answer_cache
+from app.shared.metrics import ANSWER_CACHE_LOOKUPS, CHAT_FIRST_TOKEN_SECONDS
 from app.utils import logger
 
-from .workflow import RagWorkflow
+from .batch import answer_batch
+from .workflow import (
+	RagWorkflow,
+	ReasoningEvent,
+	SourcesEvent,
+	TokenEvent,
+	get_definition_lookup,
+)
 
 chat_router = APIRouter(prefix="/chat", tags=["Chat"])
 
 
 class QueryInput(BaseModel):
 	query: str
+	project_id: UUID | None = None
+	# Questions spanning several repositories search all their projects
+	project_ids: list[UUID] = []
+
+	@model_validator(mode="after")
+	def check_projects(self):
+		if not self.projects:
+			raise ValueError("project_id or project_ids is required")
+		return self
+
+	@property
+	def projects(self) -> list[UUID]:
+		ids = [self.project_id] if self.project_id else []
+		return list(dict.fromkeys([*ids, *self.project_ids]))
+
+
+class BatchQueryInput(BaseModel):
 	project_id: UUID
+	queries: list[str] = Field(min_length=1, max_length=BATCH_MAX_QUERIES)
+
+
+def get_ready_project(project_id: UUID) -> ProjectSchemas.ProjectDetails:
+	try:
+		project = ProjectService().get_project(id=project_id)
+	except ValueError as e:
+		raise HTTPException(status_code=404, detail=str(e))
+
+	if project.status and project.status == ProjectStatusEnum.PROCESSING:
+		raise HTTPException(
+			detail="Project is processing",
+			status_code=400,
+		)
+
+	if not project.status or project.status != ProjectStatusEnum.SUCCESS:
+		raise HTTPException(
+			detail="Project not ready",
+			status_code=400,
+		)
+	return project
+
+
+def get_ready_projects(project_ids: list[UUID]) -> list[ProjectSchemas.ProjectDetails]:
+	return [get_ready_project(project_id) for project_id in project_ids]
+
+
+def answer_cache_key(
+	projects: list[ProjectSchemas.ProjectDetails],
+) -> tuple[UUID, str | None]:
+	"""
+	Key and index version of the cached answers of a question over
+	`projects`. Several projects share a key, and their answers are stale as
+	soon as one of them is re-indexed.
+	"""
+	status_service = ProjectStatusService()
+	if len(projects) == 1:
+		return projects[0].id, status_service.get_index_version(projects[0].id)
+
+	projects = sorted(projects, key=lambda project: str(project.id))
+	key = uuid5(NAMESPACE_URL, ",".join(str(project.id) for project in projects))
+	versions = [status_service.get_index_version(project.id) for project in projects]
+	if None in versions:
+		return key, None
+	return key, "|".join(versions)
+
+
+async def lookup_answer(
+	projects: list[ProjectSchemas.ProjectDetails], query: str
+) -> tuple[UUID | None, str | None, list[float] | None, CachedAnswer | None]:
+	"""
+	Look the query up in the answer cache. Returns the cache key, the index
+	version and the query embedding to cache the answer with, and the cached
+	answer if any.
+
+	Definition lookups bypass the cache: the workflow answers them exactly
+	from the symbol index, and lookups of similar identifiers embed close
+	enough to be answered with each other's locations.
+	"""
+	if not ANSWER_CACHE_ENABLED or get_definition_lookup(query):
+		return None, None, None, None
+	key, version = answer_cache_key(projects)
+	if version is None:
+		return key, None, None, None
+
+	embedding = await Settings.embed_model.aget_query_embedding(query)
+	cached = answer_cache.get(key, version, embedding)
+	ANSWER_CACHE_LOOKUPS.labels(result="miss" if cached is None else "hit").inc()
+	if cached is not None:
+		logger.debug(f"Answer cache hit for {cached.query!r}")
+	return key, version, embedding, cached
 
 
 @chat_router.post("/")
-async def chat(query_input: QueryInput):
+async def chat(query_input: QueryInput, response: Response):
 	"""
 	Handles chat requests by sending the query to the ChromaDB chat engine.
+	Questions over several projects (`project_ids`) search them
+	concurrently and rerank their chunks together.
+
+	Answers are cached per project and index version: a query close enough
+	to a cached one is answered without retrieval or LLM calls, with the
+	`X-Cache: HIT` header.
 	"""
 	logger.debug(query_input)
 	try:
-		project = ProjectService().get_project(id=query_input.project_id)
-
-		if not project:
-			raise HTTPException(status_code=404, detail="Project not found")
+		projects = get_ready_projects(query_input.projects)
 
-		if project.status and project.status == ProjectStatusEnum.PROCESSING:
-			raise HTTPException(
-				detail="Project is processing",
-				status_code=400,
-			)
-
-		if not project.status or project.status != ProjectStatusEnum.SUCCESS:
-			raise HTTPException(
-				detail="Project not ready",
-				status_code=400,
-			)
+		key, version, embedding, cached = await lookup_answer(
+			projects, query_input.query
+		)
+		if cached is not None:
+			response.headers["X-Cache"] = "HIT"
+			response.headers["X-Cache-Similarity"] = f"{cached.similarity:.4f}"
+			response.headers["Age"] = str(int(cached.age_seconds))
+			return cached.answer
 
 		w = RagWorkflow(timeout=60, verbose=True)
-		result = await w.run(project_id=query_input.project_id, query=query_input.query)
-		print(str(result))
+		result = await w.run(
+			project_ids=[project.id for project in projects], query=query_input.query
+		)
+		logger.debug(result)
+		if embedding is not None:
+			answer_cache.put(key, version, query_input.query, embedding, result)
+		response.headers["X-Cache"] = "MISS"
 		return result
 
 	except Exception as e:
 		logger.error(e)
 		raise HTTPException(status_code=501, detail="Not implemented")
+
+
+def _source(node) -> dict:
+	metadata = node.node.metadata
+	return {
+		"file_path": metadata.get("file_path"),
+		"start_line": metadata.get("start_line"),
+		"end_line": metadata.get("end_line"),
+		"symbol": metadata.get("symbol"),
+		"project": metadata.get("project"),
+		"score": node.score,
+	}
+
+
+async def stream_chat(
+	projects: list[ProjectSchemas.ProjectDetails], query: str
+) -> AsyncIterator[tuple[str, dict]]:
+	"""
+	Answer a query as a sequence of `(event, data)`: the `sources` once they
+	are reranked, a `reasoning` for each piece of the reasoning the LLM
+	writes first, a `token` for each piece of the answer and `done` with the
+	full answer and its timings. The time to the first generated token,
+	reasoning or answer, and the total time are logged separately.
+	"""
+	started_at = time.perf_counter()
+	first_token_at = None
+
+	key, version, embedding, cached = await lookup_answer(projects, query)
+	if cached is not None:
+		yield "token", {"delta": cached.answer}
+		total_ms = (time.perf_counter() - started_at) * 1000
+		yield (
+			"done",
+			{
+				"response": cached.answer,
+				"cache": "HIT",
+				"ttft_ms": round(total_ms, 1),
+				"total_ms": round(total_ms, 1),
+			},
+		)
+		return
+
+	w = RagWorkflow(timeout=60, verbose=True)
+	handler = w.run(
+		project_ids=[project.id for project in projects], query=query, stream=True
+	)
+	async for event in handler.stream_events():
+		if isinstance(event, SourcesEvent):
+			yield "sources", {"sources": [_source(node) for node in event.nodes]}
+		elif isinstance(event, ReasoningEvent | TokenEvent):
+			if first_token_at is None:
+				first_token_at = time.perf_counter()
+			kind = "reasoning" if isinstance(event, ReasoningEvent) else "token"
+			yield kind, {"delta": event.delta}
+		elif isinstance(event, StopEvent):
+			break
+	result = await handler
+
+	# Answers that don't come from the LLM (symbol lookups) arrive whole
+	if first_token_at is None:
+		first_token_at = time.perf_counter()
+		yield "token", {"delta": result}
+	if embedding is not None:
+		answer_cache.put(key, version, query, embedding, result)
+
+	CHAT_FIRST_TOKEN_SECONDS.observe(first_token_at - started_at)
+	ttft_ms = (first_token_at - started_at) * 1000
+	total_ms = (time.perf_counter() - started_at) * 1000
+	logger.info(f"Chat stream: first token {ttft_ms:.0f}ms, total {total_ms:.0f}ms")
+	yield (
+		"done",
+		{
+			"response": result,
+			"cache": "MISS",
+			"ttft_ms": round(ttft_ms, 1),
+			"total_ms": round(total_ms, 1),
+		},
+	)
+
+
+@chat_router.post("/stream")
+async def chat_stream(query_input: QueryInput):
+	"""
+	Stream the answer as Server-Sent Events: `sources`, then `reasoning` and
+	`token` events as the LLM generates the answer, and a final `done` event.
+	"""
+	logger.debug(query_input)
+	projects = get_ready_projects(query_input.projects)
+
+	async def events():
+		try:
+			async for event, data in stream_chat(projects, query_input.query):
+				yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+		except Exception as e:
+			logger.error(e)
+			yield f"event: error\ndata: {json.dumps({'detail': str(e)})}\n\n"
+
+	return StreamingResponse(
+		events(),
+		media_type="text/event-stream",
+		headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+	)
+
+
+@chat_router.post("/batch")
+async def chat_batch(batch_input: BatchQueryInput):
+	"""
+	Answer many questions about a project as Server-Sent Events: a `result`
+	event for every question as soon as it is answered, with its `index` in
+	the request, and a final `done` event.
+	"""
+	logger.debug(f"Batch of {len(batch_input.queries)} questions")
+	project = get_ready_project(batch_input.project_id)
+
+	async def events():
+		started_at = time.perf_counter()
+		errors = 0
+		try:
+			async for answer in answer_batch(project, batch_input.queries):
+				errors += answer.error is not None
+				data = {
+					"index": answer.index,
+					"query": answer.query,
+					"response": answer.response,
+					"source": answer.source,
+					"sources": [_source(node) for node in answer.nodes],
+					"error": answer.error,
+				}
+				yield f"event: result\ndata: {json.dumps(data)}\n\n"
+		except Exception as e:
+			logger.error(e)
+			yield f"event: error\ndata: {json.dumps({'detail': str(e)})}\n\n"
+			return
+		total_ms = (time.perf_counter() - started_at) * 1000
+		done = {
+			"count": len(batch_input.queries),
+			"errors": errors,
+			"total_ms": round(total_ms, 1),
+		}
+		yield f"event: done\ndata: {json.dumps(done)}\n\n"
+
+	return StreamingResponse(
+		events(),
+		media_type="text/event-stream",
+		headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+	)
+
+
+@chat_router.websocket("/ws")
+async def chat_websocket(websocket: WebSocket):
+	"""
+	Chat over a WebSocket: every `{"query": ..., "project_id": ...}` message
+	is answered with `sources`, `reasoning`, `token` and `done` messages,
+	each a JSON object with its `type`.
+	"""
+	await websocket.accept()
+	try:
+		while True:
+			try:
+				query_input = QueryInput.model_validate(await websocket.receive_json())
+				projects = get_ready_projects(query_input.projects)
+			except (ValidationError, ValueError) as e:
+				await websocket.send_json({"type": "error", "detail": str(e)})
+				continue
+			except HTTPException as e:
+				await websocket.send_json({"type": "error", "detail": e.detail})
+				continue
+
+			try:
+				async for event, data in stream_chat(projects, query_input.query):
+					await websocket.send_json({"type": event, **data})
+			except WebSocketDisconnect:
+				raise
+			except Exception as e:
+				logger.error(e)
+				await websocket.send_json({"type": "error", "detail": str(e)})
+	except WebSocketDisconnect:
+		logger.debug("Chat WebSocket disconnected")
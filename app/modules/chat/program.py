@@ -0,0 +1,278 @@
+import asyncio
+import json
+import threading
+from collections.abc import AsyncIterator
+from pathlib import Path
+
+import dspy
+
+from app.config import (
+	ANSWER_PROGRAM_PATH,
+	LLM_MODEL,
+	LLM_PROVIDER,
+	LLM_PROVIDER_API_KEY,
+	ROOT_PATH,
+)
+from app.utils import logger
+
+ANSWER_SIGNATURE = "context, question -> response"
+OPTIMIZERS = ("bootstrap", "mipro")
+
+_lm: dspy.LM | None = None
+_program: dspy.Module | None = None
+_lock = threading.Lock()
+
+
+def get_program_path() -> Path:
+	return Path(ROOT_PATH + ANSWER_PROGRAM_PATH)
+
+
+def get_answer_lm() -> dspy.LM:
+	global _lm
+	with _lock:
+		if _lm is None:
+			_lm = dspy.LM(
+				model=f"{LLM_PROVIDER}/{LLM_MODEL}", api_key=LLM_PROVIDER_API_KEY
+			)
+		return _lm
+
+
+def set_answer_lm(lm: dspy.LM):
+	"""
+	Answer with another LM than the configured one, e.g. a stub in benchmarks.
+	"""
+	global _lm
+	with _lock:
+		_lm = lm
+
+
+def build_answer_program() -> dspy.Module:
+	return dspy.ChainOfThought(ANSWER_SIGNATURE)
+
+
+def load_answer_program(path: Path | None = None) -> dspy.Module:
+	"""
+	Build the answer program and load the compiled state (instructions and
+	few-shot demos) saved by `compile_answer_program`, when there is one.
+	The program is shared by every request: calling it doesn't modify it.
+	"""
+	global _program
+	path = path or get_program_path()
+	program = build_answer_program()
+	if path.is_file():
+		program.load(str(path))
+		logger.info(f"Loaded the compiled answer program from {path}")
+	else:
+		logger.info("No compiled answer program, using the zero-shot one")
+
+	with _lock:
+		_program = program
+	return program
+
+
+def get_answer_program() -> dspy.Module:
+	if _program is None:
+		return load_answer_program()
+	return _program
+
+
+def answer_question(context: str, question: str) -> dspy.Prediction:
+	"""
+	Answer `question` from `context`, blocking on the LM call.
+	"""
+	# The LM is set for this thread only, the global dspy settings are
+	# never changed by requests
+	with dspy.context(lm=get_answer_lm()):
+		return get_answer_program()(context=context, question=question)
+
+
+async def generate_answer(context: str, question: str) -> dspy.Prediction:
+	"""
+	Answer `question` from `context`, with the LM call on a worker thread.
+	"""
+	return await asyncio.to_thread(answer_question, context, question)
+
+
+class FieldStream:
+	"""
+	Extract one output field from a completion in the chat adapter format
+	(`[[ ## field ## ]]` headers) while it streams in.
+	"""
+
+	_MARKER = "[[ ##"
+
+	def __init__(self, field: str, fallback: bool = True):
+		"""
+		With `fallback`, a completion that doesn't follow the format is
+		flushed whole as the field.
+		"""
+		self.fallback = fallback
+		self._header = f"[[ ## {field} ## ]]"
+		self._text = ""
+		self._buffer = ""
+		self._started = False
+		self._done = False
+		self._emitted = False
+
+	def feed(self, delta: str) -> str:
+		"""
+		Add the next piece of the completion and return the new text of the
+		field, holding back what could be the start of the next header.
+		"""
+		self._text += delta
+		if self._done:
+			return ""
+		if not self._started:
+			index = self._text.find(self._header)
+			if index < 0:
+				return ""
+			self._started = True
+			delta = self._text[index + len(self._header) :]
+
+		self._buffer += delta
+		end = self._buffer.find(self._MARKER)
+		if end >= 0:
+			self._done = True
+			return self._take(end, final=True)
+
+		held = next(
+			(
+				size
+				for size in range(min(len(self._MARKER), len(self._buffer)), 0, -1)
+				if self._buffer.endswith(self._MARKER[:size])
+			),
+			0,
+		)
+		return self._take(len(self._buffer) - held)
+
+	def _take(self, end: int, final: bool = False) -> str:
+		text, self._buffer = self._buffer[:end], self._buffer[end:]
+		if not self._emitted:
+			text = text.lstrip()
+		# Trailing whitespace is only sent once more text follows it
+		stripped = text.rstrip()
+		if not final:
+			self._buffer = text[len(stripped) :] + self._buffer
+		self._emitted = self._emitted or bool(stripped)
+		return stripped
+
+	def flush(self) -> str:
+		"""
+		Return the rest of the field, or the whole completion when the LM
+		didn't follow the format.
+		"""
+		if not self._started:
+			return self._text.strip() if self.fallback else ""
+		if self._done:
+			return ""
+		self._done = True
+		return self._take(len(self._buffer), final=True)
+
+
+async def stream_answer(context: str, question: str) -> AsyncIterator[tuple[str, str]]:
+	"""
+	Answer `question` from `context`, yielding `(field, text)` as the LM
+	produces it: the `reasoning` it writes first, then the `response`. The
+	prompt is the one of the compiled program.
+	"""
+	import litellm
+	from dspy.adapters.chat_adapter import ChatAdapter
+
+	predictor = get_answer_program().predictors()[0]
+	signature = getattr(predictor, "extended_signature", predictor.signature)
+	messages = ChatAdapter().format(
+		signature, predictor.demos, {"context": context, "question": question}
+	)
+
+	lm = get_answer_lm()
+	completion = await litellm.acompletion(
+		model=lm.model, messages=messages, stream=True, **lm.kwargs
+	)
+	fields = {
+		"reasoning": FieldStream("reasoning", fallback=False),
+		"response": FieldStream("response"),
+	}
+	async for chunk in completion:
+		delta = chunk.choices[0].delta.content or ""
+		for name, field in fields.items():
+			if text := field.feed(delta):
+				yield name, text
+	for name, field in fields.items():
+		if text := field.flush():
+			yield name, text
+
+
+def load_trainset(path: Path) -> list[dspy.Example]:
+	"""
+	Read labelled examples from a JSON Lines file with a `context`, a
+	`question` and the expected `response` on each line.
+	"""
+	examples = []
+	with open(path) as file:
+		for number, line in enumerate(file, start=1):
+			if not line.strip():
+				continue
+			row = json.loads(line)
+			missing = {"context", "question", "response"} - row.keys()
+			if missing:
+				raise ValueError(
+					f"Line {number} is missing {', '.join(sorted(missing))}"
+				)
+			examples.append(
+				dspy.Example(
+					context=row["context"],
+					question=row["question"],
+					response=row["response"],
+				).with_inputs("context", "question")
+			)
+	return examples
+
+
+def compile_answer_program(
+	trainset_path: Path,
+	optimizer: str = "bootstrap",
+	output: Path | None = None,
+) -> Path:
+	"""
+	Optimize the answer program against a labelled set, judged by the LM
+	with semantic F1, and save it where the server loads it from.
+	"""
+	if optimizer not in OPTIMIZERS:
+		raise ValueError(f"Invalid optimizer: {optimizer}")
+	trainset = load_trainset(trainset_path)
+	if not trainset:
+		raise ValueError(f"No examples in {trainset_path}")
+
+	from dspy.evaluate import SemanticF1
+
+	metric = SemanticF1()
+	with dspy.context(lm=get_answer_lm()):
+		match optimizer:
+			case "bootstrap":
+				teleprompter = dspy.BootstrapFewShot(metric=metric)
+				program = teleprompter.compile(
+					build_answer_program(), trainset=trainset
+				)
+			case "mipro":
+				teleprompter = dspy.MIPROv2(metric=metric, auto="light")
+				program = teleprompter.compile(
+					build_answer_program(),
+					trainset=trainset,
+					requires_permission_to_run=False,
+				)
+
+	output = output or get_program_path()
+	output.parent.mkdir(parents=True, exist_ok=True)
+	program.save(str(output))
+	return output
+
+
+__all__ = [
+	"answer_question",
+	"compile_answer_program",
+	"generate_answer",
+	"get_answer_program",
+	"load_answer_program",
+	"set_answer_lm",
+	"stream_answer",
+]
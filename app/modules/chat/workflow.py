@@ -1,9 +1,9 @@
-import dspy
+import asyncio
+import re
+
 from fastapi.exceptions import HTTPException
-from llama_index.core import QueryBundle
-from llama_index.core.postprocessor import SentenceTransformerRerank
-from llama_index.core.response.pprint_utils import pprint_source_node
-from llama_index.core.retrievers import VectorIndexRetriever
+from llama_index.core import QueryBundle, Settings
+from llama_index.core.retrievers import BaseRetriever, VectorIndexRetriever
 from llama_index.core.schema import NodeWithScore
 from llama_index.core.workflow import (
 	Context,
@@ -14,9 +14,98 @@ from llama_index.core.workflow import (
 	step,
 )
 
-from app.config import LLM_MODEL, LLM_PROVIDER, LLM_PROVIDER_API_KEY
+from app.config import FEDERATED_TOP_K, HYBRID_SEARCH_ENABLED, RETRIEVER_TOP_K
 from app.modules.projects import ProjectService
-from app.shared.chroma_db import ChromaDB
+from app.modules.symbols import SymbolService
+from app.shared.federated_retriever import FederatedRetriever
+from app.shared.hybrid_retriever import HybridRetriever
+from app.shared.lexical_index import LexicalRetriever, get_search_lexical_index
+from app.shared.metrics import instrument_step
+from app.shared.reranker import get_reranker
+from app.shared.vector_db import get_project_vector_index
+from app.utils import logger
+
+from .context import pack_context
+from .program import generate_answer, stream_answer
+
+# Questions answered from the symbol index alone, the group is the name
+_DEFINITION_QUERIES = [
+	re.compile(
+		r"where\s+(?:is|are)\s+`?([\w.:$]+)`?\s+(?:defined|declared|implemented)",
+		re.IGNORECASE,
+	),
+	re.compile(r"(?:definition|declaration)\s+of\s+`?([\w.:$]+)`?", re.IGNORECASE),
+]
+# A single word, only a lookup when it looks like code
+_BARE_IDENTIFIER = re.compile(r"^\s*(`?)([A-Za-z_$][\w.:$]*)\1\s*\??\s*$")
+# Qualified, snake_case, camelCase or PascalCase names
+_CODE_IDENTIFIER = re.compile(r"[.:_$]|[a-z0-9][A-Z]")
+
+
+def get_definition_lookup(query: str) -> str | None:
+	"""
+	Name of the symbol the query asks the definition of, if it is a plain
+	lookup such as "where is `UserService` defined?" or a bare identifier.
+	Single words that could be plain English, such as "deployment?", are
+	not identifiers unless they are quoted in backticks.
+	"""
+	for pattern in _DEFINITION_QUERIES:
+		if match := pattern.search(query):
+			return match.group(1).replace("::", ".").strip(".")
+	if match := _BARE_IDENTIFIER.search(query):
+		quoted, name = match.groups()
+		name = name.replace("::", ".").strip(".")
+		if name and (quoted or _CODE_IDENTIFIER.search(name)):
+			return name
+	return None
+
+
+def answer_definition_lookup(projects: list, query: str) -> str | None:
+	"""
+	Answer plain definition lookups from the symbol index of the projects,
+	without retrieval or the LLM. Returns `None` for other questions.
+	"""
+	name = get_definition_lookup(query)
+	if not name:
+		return None
+	locations = [
+		f"- {d.file_path}:{d.start_line}-{d.end_line} ({d.kind})"
+		for project in projects
+		for d in SymbolService().find_definitions(project.id, name)
+	]
+	if not locations:
+		return None
+	locations = "\n".join(locations)
+	return f"`{name}` is defined in:\n{locations}"
+
+
+def get_project_retrievers(project) -> list[BaseRetriever] | None:
+	"""
+	Retrievers of a project's chunks, the dense one first and the lexical
+	one with hybrid search, or `None` when it has no index yet.
+	"""
+	collection_index = get_project_vector_index(project)
+	if collection_index is None:
+		return None
+
+	retrievers: list[BaseRetriever] = [
+		VectorIndexRetriever(
+			index=collection_index,
+			similarity_top_k=RETRIEVER_TOP_K,
+		)
+	]
+	if HYBRID_SEARCH_ENABLED:
+		# Identifiers and error strings are found by BM25 when the
+		# embeddings miss them
+		lexical_index = get_search_lexical_index(project.name)
+		retrievers.append(LexicalRetriever(lexical_index, RETRIEVER_TOP_K))
+	return retrievers
+
+
+def combine_retrievers(retrievers: list[BaseRetriever], top_k: int) -> BaseRetriever:
+	if len(retrievers) == 1:
+		return retrievers[0]
+	return HybridRetriever(retrievers, similarity_top_k=top_k)
 
 
 class RetrieverEvent(Event):
@@ -32,52 +121,113 @@ class ResponseGenerationEvent(Event):
 	nodes: list[NodeWithScore]
 
 
+class SourcesEvent(Event):
+	"""
+	Streamed once the retrieved nodes are reranked, before the answer.
+	"""
+
+	nodes: list[NodeWithScore]
+
+
+class ReasoningEvent(Event):
+	"""
+	Streamed for every piece of the reasoning the LLM writes before the
+	answer.
+	"""
+
+	delta: str
+
+
+class TokenEvent(Event):
+	"""
+	Streamed for every piece of the answer produced by the LLM.
+	"""
+
+	delta: str
+
+
 class RagWorkflow(Workflow):
 	@step
-	async def start_event(self, ctx: Context, e: StartEvent) -> RetrieverEvent:
-		project_id = e.project_id
-		project = ProjectService().get_project(id=project_id)
-		if not project:
-			raise HTTPException(status_code=404, detail="Project not found")
-
-		lm = dspy.LM(
-			model=f"{LLM_PROVIDER}/{LLM_MODEL}",
-			api_key=LLM_PROVIDER_API_KEY,
-		)
+	@instrument_step
+	async def start_event(
+		self, ctx: Context, e: StartEvent
+	) -> RetrieverEvent | StopEvent:
+		# Questions can span the projects of several repositories
+		project_ids = e.get("project_ids") or [e.project_id]
+		projects = []
+		for project_id in project_ids:
+			project = ProjectService().get_project(id=project_id)
+			if not project:
+				raise HTTPException(status_code=404, detail="Project not found")
+			projects.append(project)
+
+		# Definition lookups have an exact answer, skip retrieval and the LLM
+		if answer := answer_definition_lookup(projects, e.query):
+			return StopEvent(result=answer)
 
-		await ctx.set("lm", lm)
-		await ctx.set("collection_name", project.name)
+		await ctx.set("projects", projects)
 		await ctx.set("query", e.query)
+		await ctx.set("stream", e.get("stream", False))
 
 		return RetrieverEvent(query=e.query)
 
 	@step
+	@instrument_step
 	async def retriever_event(
 		self, ctx: Context, e: RetrieverEvent
 	) -> SemanticSearchEvent:
 		query = e.query
-		collection_name = await ctx.get("collection_name")
+		projects = await ctx.get("projects")
 
-		collection_index = ChromaDB(collection_name).as_vector_store_index()
+		# Indexes not in the cache are opened concurrently
+		retrievers = await asyncio.gather(
+			*(
+				asyncio.to_thread(get_project_retrievers, project)
+				for project in projects
+			)
+		)
+		retrievers = {
+			project.name: project_retrievers
+			for project, project_retrievers in zip(projects, retrievers, strict=True)
+			if project_retrievers is not None
+		}
 
-		if collection_index is None:
-			print("Index is empty, load some documents before querying!")
+		if not retrievers:
+			logger.warning("Index is empty, load some documents before querying!")
 			return None
 
-		retriever = VectorIndexRetriever(
-			index=collection_index,
-			similarity_top_k=10,
-		)
+		if len(retrievers) == 1:
+			retriever = combine_retrievers(
+				next(iter(retrievers.values())), RETRIEVER_TOP_K
+			)
+		else:
+			# Projects are searched concurrently and reranked together. Each
+			# kind of search is merged across projects on its own scores
+			# before the kinds are fused, ranks of different projects are not
+			# comparable
+			retriever = combine_retrievers(
+				[
+					FederatedRetriever(dict(zip(retrievers, kind, strict=True)))
+					for kind in zip(*retrievers.values(), strict=True)
+				],
+				FEDERATED_TOP_K,
+			)
 
 		query_bundle = QueryBundle(query)
+		if len(retrievers) > 1:
+			# Every project and kind of search would embed the same query
+			query_bundle.embedding = await Settings.embed_model.aget_query_embedding(
+				query
+			)
 		retrieved_nodes = await retriever.aretrieve(query_bundle)
 
-		print(f"Retrieved {len(retrieved_nodes)} nodes.")
+		logger.debug(f"Retrieved {len(retrieved_nodes)} nodes")
 		await ctx.set("retrieved_nodes", retrieved_nodes)
 		await ctx.set("query_bundle", query_bundle)
 		return SemanticSearchEvent(query=query)
 
 	@step
+	@instrument_step
 	async def semantic_search(
 		self, ctx: Context, e: SemanticSearchEvent
 	) -> ResponseGenerationEvent:
@@ -85,10 +235,8 @@ class RagWorkflow(Workflow):
 		query_bundle = await ctx.get("query_bundle")
 		retrieved_nodes = await ctx.get("retrieved_nodes")
 
-		reranker = SentenceTransformerRerank(
-			model="cross-encoder/ms-marco-MiniLM-L-6-v2",
-			top_n=10,
-		)
+		# Loaded once and shared, concurrent requests are batched together
+		reranker = get_reranker()
 
 		# reranker = LLMRerank(
 		# 	llm=Settings.llm,
@@ -101,30 +249,42 @@ class RagWorkflow(Workflow):
 		# 	top_n=5,
 		# )
 
-		retrieved_nodes = reranker.postprocess_nodes(retrieved_nodes, query_bundle)
+		retrieved_nodes = await reranker.arerank(
+			query_bundle.query_str, retrieved_nodes
+		)
 		for node in retrieved_nodes:
-			pprint_source_node(source_node=node)
-			print("\n")
+			logger.debug(
+				f"Source {node.node.metadata.get('file_path')} "
+				f"({node.node.metadata.get('start_line')}-"
+				f"{node.node.metadata.get('end_line')}), score {node.score:.3f}"
+			)
+		if await ctx.get("stream"):
+			ctx.write_event_to_stream(SourcesEvent(nodes=retrieved_nodes))
 
 		return ResponseGenerationEvent(query=query, nodes=retrieved_nodes)
 
 	@step
+	@instrument_step
 	async def generate_response(
 		self, ctx: Context, e: ResponseGenerationEvent
 	) -> StopEvent:
 		query = await ctx.get("query")
 		retrieved_nodes = e.nodes
+		# Overlapping chunks are merged and the prompt stays within budget
+		context = pack_context(retrieved_nodes).text
 
-		lm = await ctx.get("lm")
-		dspy.configure(lm=lm)
+		if await ctx.get("stream"):
+			response = []
+			async for field, delta in stream_answer(context=context, question=query):
+				if field == "reasoning":
+					ctx.write_event_to_stream(ReasoningEvent(delta=delta))
+					continue
+				ctx.write_event_to_stream(TokenEvent(delta=delta))
+				response.append(delta)
+			return StopEvent(result="".join(response))
 
-		# rag = dspy.ChainOfThought("context, question -> response")
-		rag = dspy.MIPROv2("context, question -> response")
-
-		output = rag(
-			context="\n".join([node.text for node in retrieved_nodes]),
-			question=query,
-		)
+		# The program is compiled once and shared, only the LM call is left
+		output = await generate_answer(context=context, question=query)
 
 		res = {
 			"response": output.response,
@@ -1,3 +1,14 @@
+from . import listener  # noqa: F401 registers the event listeners
+from .code_splitter import check_parsers
 from .controller import indices_router
+from .jobs import job_runner
+from .watcher import project_watcher
+from .workers import shutdown_worker_pools
 
-__all__ = ["indices_router"]
+__all__ = [
+	"check_parsers",
+	"indices_router",
+	"job_runner",
+	"project_watcher",
+	"shutdown_worker_pools",
+]
@@ -1,63 +1,279 @@
+import asyncio
+import time
+from collections.abc import Iterator
+from pathlib import Path
+
 from app.modules.projects import (
 	ProjectSchemas,
 	ProjectStatusEnum,
 	ProjectStatusSchema,
 	ProjectStatusService,
 )
-from app.shared.chroma_db import ChromaDB
+from app.modules.symbols import SymbolService
+from app.shared.answer_cache import answer_cache
+from app.shared.embed_models import load_embedding_model
+from app.shared.embedding_cache import CachedEmbedding
+from app.shared.lexical_index import (
+	LexicalIndex,
+	get_lexical_index,
+	invalidate_lexical_index,
+)
+from app.shared.metrics import INDEX_RUN_SECONDS
+from app.shared.vector_db import (
+	VectorCollection,
+	get_project_vector_db,
+	invalidate_vector_index,
+)
 from app.utils import logger
-from app.utils.git import is_git_repo
+from app.utils.git import (
+	get_changed_files,
+	get_dirty_files,
+	get_head_commit,
+	is_git_repo,
+)
 
-from .directory_loader import load_documents
+from .directory_loader import iter_file_batches, to_document_path
 from .ingestion_pipeline import build_ingestion_pipeline
+from .progress import progress_broker
+from .workers import IndexingStats, ingest_file_batches
+
+symbol_service = SymbolService()
+
+
+class InvalidProjectError(ValueError):
+	"""
+	The project can't be indexed as it is, e.g. its path is not a git
+	repository. Retrying the run won't help.
+	"""
 
 
 class BackgroundIndexingArgs(ProjectSchemas.ProjectRead):
 	status: ProjectStatusSchema.ProjectStatusRead
+	full_rebuild: bool = False
+	files: list[str] | None = None
+
+
+def load_changed_files(
+	project: BackgroundIndexingArgs,
+	vector_db: VectorCollection,
+	lexical_index: LexicalIndex,
+	changed: list[str],
+	removed: list[str],
+) -> tuple[Iterator[list[Path]], list[str]]:
+	"""
+	Remove the nodes of the changed and removed files and return the batches
+	of files that have to be re-embedded, with the document paths of the
+	files whose symbols are stale.
+	"""
+	logger.debug(f"{len(changed)} changed and {len(removed)} removed files")
+
+	document_paths = [
+		to_document_path(project.path, file_path) for file_path in changed + removed
+	]
+	vector_db.delete_files(document_paths)
+	lexical_index.delete_files(document_paths)
+
+	return iter_file_batches(path=project.path, files=changed), document_paths
+
+
+def split_removed_files(path: str, files: list[str]) -> tuple[list[str], list[str]]:
+	changed, removed = [], []
+	for file_path in files:
+		(changed if (Path(path) / file_path).is_file() else removed).append(file_path)
+	return changed, removed
+
+
+def publish_progress(
+	project: BackgroundIndexingArgs,
+	stats: IndexingStats,
+	status: str = "processing",
+	error: str | None = None,
+):
+	progress_broker.publish(
+		stats.progress(project.id, status=status, error=error),
+		force=status != "processing",
+	)
 
 
 async def index_project_in_background(args: BackgroundIndexingArgs):
+	stats = IndexingStats()
+	project: BackgroundIndexingArgs | None = None
+	project_status: ProjectStatusSchema.ProjectStatusRead | None = None
+	project_status_service = ProjectStatusService()
+	vector_db: VectorCollection | None = None
+	lexical_index: LexicalIndex | None = None
+	outcome = "error"
 	try:
 		logger.info("Background indexing task started")
 		logger.info(args)
 
-		project = BackgroundIndexingArgs(**args)
+		try:
+			project = BackgroundIndexingArgs(**args)
+		except ValueError as e:
+			raise InvalidProjectError(str(e)) from e
 		project_status = project.status
 
 		logger.debug(project)
 		logger.debug(project_status)
 
-		project_status_service = ProjectStatusService()
+		vector_db = get_project_vector_db(project)
+		lexical_index = get_lexical_index(project.name)
+		publish_progress(project, stats)
 
 		project_status_service.update_project_status(
 			project_status_id=project_status.id, status=ProjectStatusEnum.PROCESSING
 		)
-		is_git_repo(project.path)
+		try:
+			is_git_repo(project.path)
+		except ValueError as e:
+			raise InvalidProjectError(str(e)) from e
 
-		logger.debug(f"Dropping collection {project.name}")
-		ChromaDB(project.name).drop_collection()
+		started_at = time.perf_counter()
+		head_commit = get_head_commit(project.path)
+		# Listed before the files are read, so the next run checks the ones
+		# reverted during this run again
+		dirty_files = get_dirty_files(project.path) if head_commit else None
+		last_commit, last_dirty_files = project_status_service.get_last_indexed_run(
+			project_id=project.id
+		)
 
-		logger.debug(f"Loading documents from {project.path}")
-		all_documents = load_documents(path=project.path)
-		logger.debug(f"Found {len(all_documents)} documents")
+		file_batches = None
+		# Symbols are staged batch by batch and swapped in once the run
+		# succeeds, like the persisted stores
+		await asyncio.to_thread(symbol_service.discard_staged, project.id)
+		stale_symbol_files: list[str] = []
+		if not project.full_rebuild and last_commit:
+			try:
+				logger.debug(f"Loading changes of {project.path} since {last_commit}")
+				changed, removed = get_changed_files(
+					project.path, since=last_commit, dirty_files=last_dirty_files
+				)
+				if project.files is not None:
+					# The files reported by the watcher, plus the changes made
+					# while it wasn't running, as the run records the head commit
+					logger.debug(f"Adding {len(project.files)} watched files")
+					changed, removed = split_removed_files(
+						project.path, sorted({*project.files, *changed, *removed})
+					)
+				file_batches, stale_symbol_files = await asyncio.to_thread(
+					load_changed_files,
+					project,
+					vector_db,
+					lexical_index,
+					changed,
+					removed,
+				)
+			except ValueError as e:
+				logger.warning(f"{e} Falling back to a full rebuild")
 
-		pipeline = build_ingestion_pipeline(collection_name=project.name)
-		await pipeline.arun(documents=all_documents, show_progress=True)
+		rebuild = file_batches is None
+		if rebuild:
+			# Recorded before the collection is dropped, so a rebuild that
+			# fails, is cancelled or dies forces the next run to rebuild too
+			project_status_service.mark_full_rebuild(
+				project_status_id=project_status.id
+			)
+			logger.debug(f"Dropping collection {project.name}")
+			# Dropping and persisting can take long on large collections
+			await asyncio.to_thread(vector_db.drop_collection)
+			invalidate_vector_index(project.name)
+			await asyncio.to_thread(lexical_index.clear)
 
-		project_status_service.update_project_status(
-			project_status_id=project_status.id, status=ProjectStatusEnum.SUCCESS
+			logger.debug(f"Loading documents from {project.path}")
+			file_batches = iter_file_batches(path=project.path)
+		stats.prepare.record(started_at, files=0)
+
+		embedding_model = load_embedding_model()
+		pipeline = build_ingestion_pipeline(
+			collection_name=project.name,
+			embedding_model=embedding_model,
+			vector_db=vector_db,
+			lexical_index=lexical_index,
 		)
-		logger.info("Background indexing task completed")
 
-	except ValueError as e:
-		logger.error(e)
+		await ingest_file_batches(
+			path=project.path,
+			file_batches=file_batches,
+			pipeline=pipeline,
+			stats=stats,
+			on_progress=lambda current: publish_progress(project, current),
+			on_symbols=lambda symbols: symbol_service.stage_files(
+				project.id, project_status.id, symbols
+			),
+		)
+		stats.stage = "finalize"
+		await asyncio.to_thread(vector_db.persist)
+		await asyncio.to_thread(lexical_index.persist)
+		await asyncio.to_thread(
+			symbol_service.commit_run,
+			project.id,
+			project_status.id,
+			removed_files=stale_symbol_files,
+			clear=rebuild,
+		)
+		stats.finished_at = time.perf_counter()
+		logger.debug(
+			f"Indexed {stats.files_loaded} files into {stats.embed.chunks} chunks"
+		)
+		project_status_service.update_stage_metrics(
+			project_status_id=project_status.id, stage_metrics=stats.as_dict()
+		)
+
+		if isinstance(embedding_model, CachedEmbedding):
+			logger.info(
+				f"Embedding cache: {embedding_model.hits} hits, "
+				f"{embedding_model.misses} misses"
+			)
+			project_status_service.update_embedding_cache_stats(
+				project_status_id=project_status.id,
+				hits=embedding_model.hits,
+				misses=embedding_model.misses,
+			)
+
 		project_status_service.update_project_status(
-			project_status_id=project_status.id, status=ProjectStatusEnum.FAILED
+			project_status_id=project_status.id,
+			status=ProjectStatusEnum.SUCCESS,
+			commit_sha=head_commit,
+			dirty_files=dirty_files,
 		)
-		return
+		publish_progress(project, stats, status=ProjectStatusEnum.SUCCESS.value)
+		logger.info("Background indexing task completed")
+		outcome = "success"
+
+	except asyncio.CancelledError:
+		outcome = "cancelled"
+		if project is not None:
+			publish_progress(project, stats, status=ProjectStatusEnum.CANCELLED.value)
+		raise
 	except Exception as e:
+		# Invalid projects (InvalidProjectError) and failed runs alike
 		logger.error(e)
-		project_status_service.update_project_status(
-			project_status_id=project_status.id, status=ProjectStatusEnum.FAILED
-		)
-		return
+		stats.finished_at = stats.finished_at or time.perf_counter()
+		if project_status is not None:
+			project_status_service.update_stage_metrics(
+				project_status_id=project_status.id, stage_metrics=stats.as_dict()
+			)
+			project_status_service.update_project_status(
+				project_status_id=project_status.id, status=ProjectStatusEnum.FAILED
+			)
+		if project is not None:
+			publish_progress(
+				project, stats, status=ProjectStatusEnum.FAILED.value, error=str(e)
+			)
+		raise
+	finally:
+		INDEX_RUN_SECONDS.labels(outcome=outcome).observe(stats.seconds)
+		if outcome != "success" and project is not None:
+			await asyncio.to_thread(symbol_service.discard_staged, project.id)
+		# Changes that weren't persisted are rolled back, except for Chroma
+		# which persists every write. A dropped collection stays dropped, the
+		# run is marked as a full rebuild so the next one starts over
+		if lexical_index is not None:
+			lexical_index.close()
+			# Queries opened before the first run found no database
+			invalidate_lexical_index(project.name)
+		if vector_db is not None:
+			vector_db.close()
+			# Queries reopen the collection with the changes of this run
+			invalidate_vector_index(vector_db.collection_name)
+			answer_cache.invalidate(project.id)
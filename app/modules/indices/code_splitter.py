@@ -0,0 +1,622 @@
+import re
+from collections.abc import Sequence
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any
+
+from llama_index.core.node_parser import NodeParser, SentenceSplitter
+from llama_index.core.node_parser.node_utils import build_nodes_from_splits
+from llama_index.core.schema import BaseNode, MetadataMode
+from pydantic import Field, PrivateAttr
+
+from app.utils import logger
+
+
+@dataclass(frozen=True)
+class LanguageSpec:
+	"""
+	How to chunk the source files of one language.
+
+	`definitions` are the node types that start a chunk of their own,
+	`containers` the definitions (classes, impl blocks, ...) that are split
+	into one chunk per member when they exceed `max_chars`, and `wrappers`
+	the node types (decorators, exports) that wrap a definition.
+	"""
+
+	grammar: str
+	definitions: frozenset[str]
+	containers: frozenset[str] = field(default_factory=frozenset)
+	wrappers: frozenset[str] = field(default_factory=frozenset)
+	max_chars: int = 3000
+
+
+_JS_DEFINITIONS = frozenset(
+	{
+		"function_declaration",
+		"generator_function_declaration",
+		"class_declaration",
+		"method_definition",
+	}
+)
+_TS_DEFINITIONS = _JS_DEFINITIONS | {
+	"abstract_class_declaration",
+	"interface_declaration",
+	"type_alias_declaration",
+	"enum_declaration",
+}
+_JS_CONTAINERS = frozenset({"class_declaration", "abstract_class_declaration"})
+
+PYTHON = LanguageSpec(
+	grammar="python",
+	definitions=frozenset({"function_definition", "class_definition"}),
+	containers=frozenset({"class_definition"}),
+	wrappers=frozenset({"decorated_definition"}),
+	max_chars=2500,
+)
+JAVASCRIPT = LanguageSpec(
+	grammar="javascript",
+	definitions=_JS_DEFINITIONS,
+	containers=_JS_CONTAINERS,
+	wrappers=frozenset({"export_statement"}),
+)
+TYPESCRIPT = LanguageSpec(
+	grammar="typescript",
+	definitions=_TS_DEFINITIONS,
+	containers=_JS_CONTAINERS,
+	wrappers=frozenset({"export_statement"}),
+)
+TSX = LanguageSpec(
+	grammar="tsx",
+	definitions=_TS_DEFINITIONS,
+	containers=_JS_CONTAINERS,
+	wrappers=frozenset({"export_statement"}),
+)
+GO = LanguageSpec(
+	grammar="go",
+	definitions=frozenset(
+		{"function_declaration", "method_declaration", "type_declaration"}
+	),
+)
+JAVA = LanguageSpec(
+	grammar="java",
+	definitions=frozenset(
+		{
+			"class_declaration",
+			"interface_declaration",
+			"enum_declaration",
+			"record_declaration",
+			"method_declaration",
+			"constructor_declaration",
+		}
+	),
+	containers=frozenset(
+		{
+			"class_declaration",
+			"interface_declaration",
+			"enum_declaration",
+			"record_declaration",
+		}
+	),
+	max_chars=4000,
+)
+RUST = LanguageSpec(
+	grammar="rust",
+	definitions=frozenset(
+		{
+			"function_item",
+			"struct_item",
+			"enum_item",
+			"impl_item",
+			"trait_item",
+			"mod_item",
+		}
+	),
+	containers=frozenset({"impl_item", "trait_item", "mod_item"}),
+)
+C = LanguageSpec(
+	grammar="c",
+	definitions=frozenset({"function_definition", "struct_specifier"}),
+)
+CPP = LanguageSpec(
+	grammar="cpp",
+	definitions=frozenset(
+		{
+			"function_definition",
+			"class_specifier",
+			"struct_specifier",
+			"namespace_definition",
+		}
+	),
+	containers=frozenset(
+		{"class_specifier", "struct_specifier", "namespace_definition"}
+	),
+	wrappers=frozenset({"template_declaration"}),
+)
+
+LANGUAGES_BY_EXTENSION: dict[str, LanguageSpec] = {
+	".py": PYTHON,
+	".js": JAVASCRIPT,
+	".jsx": JAVASCRIPT,
+	".mjs": JAVASCRIPT,
+	".cjs": JAVASCRIPT,
+	".ts": TYPESCRIPT,
+	".tsx": TSX,
+	".go": GO,
+	".java": JAVA,
+	".rs": RUST,
+	".c": C,
+	".h": C,
+	".cc": CPP,
+	".cpp": CPP,
+	".hpp": CPP,
+}
+
+_parsers: dict[str, Any] = {}
+
+
+def get_parser(grammar: str):
+	"""
+	Return a tree-sitter parser for `grammar`, or `None` when the grammar
+	can't be loaded.
+	"""
+	if grammar not in _parsers:
+		try:
+			from tree_sitter_language_pack import get_parser as get_language_parser
+
+			_parsers[grammar] = get_language_parser(grammar)
+		except Exception as e:
+			logger.warning(f"No tree-sitter parser for {grammar}: {e}")
+			_parsers[grammar] = None
+	return _parsers[grammar]
+
+
+def check_parsers():
+	"""
+	Load the parser of every supported language, raising when one of them
+	can't be loaded. Otherwise code files would silently be split as plain
+	text, without symbols.
+	"""
+	missing = sorted(
+		{
+			spec.grammar
+			for spec in LANGUAGES_BY_EXTENSION.values()
+			if get_parser(spec.grammar) is None
+		}
+	)
+	if missing:
+		raise RuntimeError(
+			f"No tree-sitter parser for {', '.join(missing)}, "
+			"is tree-sitter-language-pack installed?"
+		)
+
+
+def get_language(file_path: str) -> LanguageSpec | None:
+	return LANGUAGES_BY_EXTENSION.get(Path(file_path).suffix.lower())
+
+
+@dataclass
+class CodeChunk:
+	text: str
+	start_line: int
+	end_line: int
+	symbol: str = ""
+	symbol_type: str = ""
+
+
+def _node_text(source: bytes, node) -> str:
+	return source[node.start_byte : node.end_byte].decode("utf-8", errors="ignore")
+
+
+def _span_text(source: bytes, nodes: list) -> str:
+	return source[nodes[0].start_byte : nodes[-1].end_byte].decode(
+		"utf-8", errors="ignore"
+	)
+
+
+def _unwrap(node, spec: LanguageSpec):
+	"""
+	Return the definition wrapped by a decorator/export node, or `None` if
+	`node` is not a definition at all.
+	"""
+	if node.type in spec.definitions:
+		return node
+	if node.type in spec.wrappers:
+		inner = node.child_by_field_name("definition") or node.child_by_field_name(
+			"declaration"
+		)
+		if inner is None:
+			inner = next(
+				(
+					child
+					for child in node.named_children
+					if child.type in spec.definitions
+				),
+				None,
+			)
+		if inner is not None:
+			return _unwrap(inner, spec)
+	return None
+
+
+def _symbol_name(source: bytes, node) -> str:
+	name = node.child_by_field_name("name")
+	if name is None:
+		# e.g. go `type_declaration` > `type_spec`, c `function_definition`
+		# > `function_declarator`
+		for child in node.named_children:
+			name = child.child_by_field_name("name") or child.child_by_field_name(
+				"declarator"
+			)
+			if name is not None:
+				break
+	if name is None:
+		return node.type
+	return _node_text(source, name).split("(")[0].strip().lstrip("*&")
+
+
+# Node types of function and method calls, the references recorded by
+# `extract_symbols`
+CALL_TYPES = frozenset({"call", "call_expression", "method_invocation"})
+_IDENTIFIER = re.compile(r"[A-Za-z_$][\w$]*")
+
+
+@dataclass
+class CodeSymbol:
+	"""
+	A definition (`kind` is its node type) or, with `kind` "reference", a
+	call of `name` from the `scope` definition.
+	"""
+
+	name: str
+	qualified_name: str
+	kind: str
+	language: str
+	start_line: int
+	end_line: int
+	scope: str = ""
+
+
+def _callee_name(source: bytes, node) -> str | None:
+	callee = node.child_by_field_name("function") or node.child_by_field_name("name")
+	if callee is None:
+		return None
+	# `obj.method`, `pkg::func`, `ptr->field`: the last identifier is called
+	names = _IDENTIFIER.findall(_node_text(source, callee))
+	return names[-1] if names else None
+
+
+def extract_symbols(text: str, spec: LanguageSpec | None) -> list[CodeSymbol] | None:
+	"""
+	List the definitions of `text` with their qualified name and line range,
+	and the calls made in it. Returns `None` when the language is not
+	supported or the file doesn't parse.
+	"""
+	if spec is None or not text.strip():
+		return None
+	parser = get_parser(spec.grammar)
+	if parser is None:
+		return None
+
+	source = text.encode("utf-8")
+	try:
+		tree = parser.parse(source)
+	except Exception as e:
+		logger.warning(f"Failed to parse {spec.grammar} source: {e}")
+		return None
+
+	symbols: list[CodeSymbol] = []
+	# Walked iteratively, deeply nested code would exceed the recursion limit
+	stack: list[tuple[Any, list[str]]] = [(tree.root_node, [])]
+	while stack:
+		node, scope = stack.pop()
+		for child in reversed(node.named_children):
+			definition = _unwrap(child, spec)
+			if definition is None:
+				if child.type in CALL_TYPES and (name := _callee_name(source, child)):
+					symbols.append(
+						CodeSymbol(
+							name=name,
+							qualified_name=name,
+							kind="reference",
+							language=spec.grammar,
+							start_line=child.start_point[0] + 1,
+							end_line=child.start_point[0] + 1,
+							scope=".".join(scope),
+						)
+					)
+				stack.append((child, scope))
+				continue
+
+			name = _symbol_name(source, definition)
+			symbols.append(
+				CodeSymbol(
+					name=name,
+					qualified_name=".".join([*scope, name]),
+					kind=definition.type,
+					language=spec.grammar,
+					start_line=child.start_point[0] + 1,
+					end_line=child.end_point[0] + 1,
+					scope=".".join(scope),
+				)
+			)
+			stack.append((definition, [*scope, name]))
+
+	symbols.sort(key=lambda symbol: symbol.start_line)
+	return symbols
+
+
+class CodeSymbolSplitter(NodeParser):
+	"""
+	Split source files on function, class and method boundaries using
+	tree-sitter.
+
+	Every definition becomes a chunk of its own, classes exceeding the size
+	limit of their language are split into one chunk per member, and code
+	between definitions (imports, module level statements) is grouped into
+	chunks of its own. Each chunk records its symbol name and line range in
+	its metadata. Files in other languages, or that fail to parse, are split
+	with a `SentenceSplitter`.
+	"""
+
+	chunk_size: int = Field(description="Token chunk size of the fallback splitter")
+	chunk_overlap: int = Field(description="Token overlap of the fallback splitter")
+	max_chars: dict[str, int] = Field(
+		default_factory=dict,
+		description="Per-grammar overrides of the maximum characters of a chunk",
+	)
+	min_chars: int = Field(
+		default=300,
+		description="Adjacent chunks smaller than this are merged together",
+	)
+
+	_fallback: SentenceSplitter = PrivateAttr()
+
+	def __init__(self, chunk_size: int, chunk_overlap: int, **kwargs: Any):
+		super().__init__(chunk_size=chunk_size, chunk_overlap=chunk_overlap, **kwargs)
+		self._fallback = SentenceSplitter(
+			chunk_size=chunk_size, chunk_overlap=chunk_overlap
+		)
+
+	@classmethod
+	def class_name(cls) -> str:
+		return "CodeSymbolSplitter"
+
+	def _parse_nodes(
+		self, nodes: Sequence[BaseNode], show_progress: bool = False, **kwargs: Any
+	) -> list[BaseNode]:
+		all_nodes: list[BaseNode] = []
+		for node in nodes:
+			file_path = node.metadata.get("file_path") or node.metadata.get(
+				"file_name", ""
+			)
+			spec = get_language(file_path)
+			chunks = self.split_code(node.get_content(MetadataMode.NONE), spec)
+			if chunks is None:
+				all_nodes.extend(self._fallback.get_nodes_from_documents([node]))
+				continue
+
+			text_nodes = build_nodes_from_splits(
+				[chunk.text for chunk in chunks], node, id_func=self.id_func
+			)
+			for text_node, chunk in zip(text_nodes, chunks, strict=True):
+				text_node.metadata.update(
+					{
+						"language": spec.grammar,
+						"symbol": chunk.symbol,
+						"symbol_type": chunk.symbol_type,
+						"start_line": chunk.start_line,
+						"end_line": chunk.end_line,
+					}
+				)
+				text_node.excluded_embed_metadata_keys = [
+					*text_node.excluded_embed_metadata_keys,
+					"symbol_type",
+					"start_line",
+					"end_line",
+				]
+				text_node.excluded_llm_metadata_keys = [
+					*text_node.excluded_llm_metadata_keys,
+					"symbol_type",
+				]
+			all_nodes.extend(text_nodes)
+		return all_nodes
+
+	def split_code(
+		self, text: str, spec: LanguageSpec | None
+	) -> list[CodeChunk] | None:
+		"""
+		Split `text` into symbol chunks, or return `None` when the language
+		is not supported or the file doesn't parse.
+		"""
+		if spec is None or not text.strip():
+			return None
+		parser = get_parser(spec.grammar)
+		if parser is None:
+			return None
+
+		source = text.encode("utf-8")
+		try:
+			tree = parser.parse(source)
+		except Exception as e:
+			logger.warning(f"Failed to parse {spec.grammar} source: {e}")
+			return None
+		if tree.root_node.has_error and not tree.root_node.named_children:
+			return None
+
+		max_chars = self.max_chars.get(spec.grammar, spec.max_chars)
+		chunks: list[CodeChunk] = []
+		self._split_children(
+			source, tree.root_node.named_children, spec, max_chars, [], chunks
+		)
+		return self._merge_small_chunks(chunks, max_chars) or None
+
+	def _split_children(
+		self,
+		source: bytes,
+		children: list,
+		spec: LanguageSpec,
+		max_chars: int,
+		scope: list[str],
+		chunks: list[CodeChunk],
+	):
+		# Non-definition nodes between definitions, comments directly above a
+		# definition are attached to it
+		pending: list = []
+
+		def flush(nodes: list):
+			if nodes:
+				self._add_text_chunk(source, nodes, max_chars, "", "", chunks)
+
+		for child in children:
+			definition = _unwrap(child, spec)
+			if definition is None:
+				pending.append(child)
+				continue
+
+			leading = []
+			while (
+				pending
+				and "comment" in pending[-1].type
+				and child.start_point[0] - pending[-1].end_point[0] <= 1
+			):
+				leading.insert(0, pending.pop())
+			flush(pending)
+			pending = []
+
+			name = _symbol_name(source, definition)
+			symbol = ".".join([*scope, name])
+			nodes = [*leading, child]
+			# In characters like the limit, not bytes
+			size = len(_span_text(source, nodes))
+			body = definition.child_by_field_name("body")
+
+			if (
+				size <= max_chars
+				or body is None
+				or definition.type not in spec.containers
+			):
+				self._add_text_chunk(
+					source, nodes, max_chars, symbol, definition.type, chunks
+				)
+				continue
+
+			# Container too large: the header (signature, docstring, fields)
+			# and every member become chunks of their own
+			header_end = next(
+				(
+					member.start_byte
+					for member in body.named_children
+					if _unwrap(member, spec) is not None
+				),
+				body.end_byte,
+			)
+			header = source[nodes[0].start_byte : header_end].decode(
+				"utf-8", errors="ignore"
+			)
+			chunks.append(
+				CodeChunk(
+					text=header.rstrip(),
+					start_line=nodes[0].start_point[0] + 1,
+					end_line=nodes[0].start_point[0] + header.rstrip().count("\n") + 1,
+					symbol=symbol,
+					symbol_type=definition.type,
+				)
+			)
+			members = [
+				member
+				for member in body.named_children
+				if member.start_byte >= header_end
+			]
+			self._split_children(
+				source, members, spec, max_chars, [*scope, name], chunks
+			)
+
+		flush(pending)
+
+	def _add_text_chunk(
+		self,
+		source: bytes,
+		nodes: list,
+		max_chars: int,
+		symbol: str,
+		symbol_type: str,
+		chunks: list[CodeChunk],
+	):
+		start_line = nodes[0].start_point[0] + 1
+		text = _span_text(source, nodes)
+		if not text.strip():
+			return
+		if len(text) <= max_chars:
+			chunks.append(
+				CodeChunk(
+					text=text,
+					start_line=start_line,
+					end_line=nodes[-1].end_point[0] + 1,
+					symbol=symbol,
+					symbol_type=symbol_type,
+				)
+			)
+			return
+
+		# Definitions that can't be split on members are split on lines
+		part: list[str] = []
+		part_size = 0
+		part_start = part_end = start_line
+		for offset, line in enumerate(text.splitlines(keepends=True)):
+			line_number = start_line + offset
+			# A line longer than the limit (minified code, long literals) is
+			# split into pieces of the limit
+			for i in range(0, len(line), max_chars):
+				piece = line[i : i + max_chars]
+				if part and part_size + len(piece) > max_chars:
+					chunks.append(
+						CodeChunk(
+							text="".join(part),
+							start_line=part_start,
+							end_line=part_end,
+							symbol=symbol,
+							symbol_type=symbol_type,
+						)
+					)
+					part, part_size, part_start = [], 0, line_number
+				part.append(piece)
+				part_size += len(piece)
+				part_end = line_number
+		if part:
+			chunks.append(
+				CodeChunk(
+					text="".join(part),
+					start_line=part_start,
+					end_line=part_end,
+					symbol=symbol,
+					symbol_type=symbol_type,
+				)
+			)
+
+	def _merge_small_chunks(
+		self, chunks: list[CodeChunk], max_chars: int
+	) -> list[CodeChunk]:
+		merged: list[CodeChunk] = []
+		for chunk in chunks:
+			previous = merged[-1] if merged else None
+			if (
+				previous is not None
+				and len(previous.text) < self.min_chars
+				and len(chunk.text) < self.min_chars
+				and len(previous.text) + len(chunk.text) + 1 <= max_chars
+				and chunk.start_line > previous.end_line
+			):
+				previous.text = f"{previous.text}\n{chunk.text}"
+				previous.end_line = chunk.end_line
+				previous.symbol = ", ".join(
+					symbol for symbol in (previous.symbol, chunk.symbol) if symbol
+				)
+				if previous.symbol_type != chunk.symbol_type:
+					previous.symbol_type = ", ".join(
+						symbol_type
+						for symbol_type in (previous.symbol_type, chunk.symbol_type)
+						if symbol_type
+					)
+				continue
+			merged.append(chunk)
+		return merged
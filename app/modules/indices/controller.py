@@ -1,93 +1,181 @@
+import asyncio
 from uuid import UUID
 
-from fastapi import APIRouter, BackgroundTasks
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from pyventus.linkers import EventLinker
 
-from app.modules.projects import ProjectService, ProjectStatusEnum, ProjectStatusService
+from app.modules.projects import (
+	ProjectSchemas,
+	ProjectService,
+	ProjectStatusEnum,
+	ProjectStatusSchema,
+	ProjectStatusService,
+)
 from app.utils import logger
 
-from .background import index_project_in_background
+from .jobs import IndexJobSchema, IndexJobService, IndexJobStatusEnum, job_runner
+from .progress import IndexingProgress, progress_broker
+from .watcher import project_watcher
 
 indices_router = APIRouter(prefix="/index", tags=["Index"])
+index_job_service = IndexJobService()
+
+PROGRESS_KEEPALIVE_SECONDS = 15
+_FINISHED_STATUSES = {
+	ProjectStatusEnum.SUCCESS,
+	ProjectStatusEnum.FAILED,
+	ProjectStatusEnum.CANCELLED,
+}
 
 
 class IndexProjectBody(BaseModel):
 	project_id: UUID
+	full_rebuild: bool = False
+	priority: int = 0
 
 
 @indices_router.post("/")
-async def index_project(
-	data: IndexProjectBody,
-	background_tasks: BackgroundTasks,
-):
+async def index_project(data: IndexProjectBody):
 	try:
 		logger.debug(f"Indexing project {data.project_id}")
 		project = ProjectService().get_project(id=data.project_id)
 		if not project:
 			return {"message": "Project not found."}
-		project_status_service = ProjectStatusService()
-		project_status = project_status_service.create_project_status(
-			project_id=data.project_id, status=ProjectStatusEnum.QUEUE
+
+		job = index_job_service.enqueue(
+			project_id=data.project_id,
+			full_rebuild=data.full_rebuild,
+			priority=data.priority,
 		)
+		job_runner.notify()
+		return {"message": "Project indexing queued", "job_id": job.id}
 
-		if project_status and project_status.status == ProjectStatusEnum.PROCESSING:
-			return {"message": "Project is already being indexed."}
+	except Exception as e:
+		logger.error(e)
+		return {"message": "Failed to index project."}
 
-		if project_status and project_status.status == ProjectStatusEnum.SUCCESS:
-			return {"message": "Project has already been indexed."}
 
-		if project_status and project_status.status == ProjectStatusEnum.FAILED:
-			return {"message": "Project indexing failed."}
+@indices_router.get("/jobs", response_model=IndexJobSchema.IndexJobList)
+def get_job_list(
+	project_id: UUID | None = None,
+	status: IndexJobStatusEnum | None = None,
+	offset: int = 0,
+	limit: int = 100,
+):
+	return index_job_service.get_job_list(
+		project_id=project_id, status=status, offset=offset, limit=limit
+	)
 
-		args = {
-			"id": project.id,
-			"name": project.name,
-			"path": project.path,
-			"status": project_status,
-		}
 
-		background_tasks.add_task(index_project_in_background, args)
-		return {"message": "Project indexing started"}
+@indices_router.get("/jobs/{job_id}", response_model=IndexJobSchema.IndexJobRead)
+def get_job(job_id: UUID):
+	try:
+		return index_job_service.get_job(id=job_id)
+	except ValueError as e:
+		raise HTTPException(status_code=404, detail=str(e))
 
-	except Exception as e:
-		logger.error(e)
-		return {"message": "Failed to index project."}
 
+@indices_router.delete("/jobs/{job_id}", response_model=IndexJobSchema.IndexJobRead)
+async def cancel_job(job_id: UUID):
+	# Runs on the event loop, the running job's task can only be cancelled
+	# from its loop
+	try:
+		return job_runner.cancel(job_id)
+	except ValueError as e:
+		raise HTTPException(status_code=400, detail=str(e))
 
-@EventLinker.on("ProjectIndex")
-async def index_project_listener(
-	project_status_id: UUID,
-):
+
+@indices_router.post("/{project_id}/watch", response_model=ProjectSchemas.ProjectRead)
+async def watch_project(project_id: UUID):
+	"""
+	Re-index the files of the project as soon as they change on disk. Async
+	so the watcher task is created on the event loop.
+	"""
 	try:
-		logger.debug(f"Indexing project {project_status_id}")
-		project_status_service = ProjectStatusService()
-		project_status = project_status_service.get_project_status(id=project_status_id)
+		project = ProjectService().set_project_watch(project_id=project_id, watch=True)
+	except ValueError as e:
+		raise HTTPException(status_code=404, detail=str(e))
+	project_watcher.watch(project)
+	return project
 
-		project = ProjectService().get_project(id=project_status.project_id)
 
-		if not project_status:
-			return {"message": "Project status not found."}
+@indices_router.delete("/{project_id}/watch", response_model=ProjectSchemas.ProjectRead)
+async def unwatch_project(project_id: UUID):
+	try:
+		project = ProjectService().set_project_watch(project_id=project_id, watch=False)
+	except ValueError as e:
+		raise HTTPException(status_code=404, detail=str(e))
+	project_watcher.unwatch(project_id)
+	return project
 
-		if project_status.status == ProjectStatusEnum.PROCESSING:
-			return {"message": "Project is already being indexed."}
 
-		if project_status.status == ProjectStatusEnum.SUCCESS:
-			return {"message": "Project has already been indexed."}
+def _progress_event(progress: IndexingProgress) -> str:
+	return f"event: progress\ndata: {progress.model_dump_json()}\n\n"
 
-		if project_status.status == ProjectStatusEnum.FAILED:
-			return {"message": "Project indexing failed."}
 
-		args = {
-			"id": project.id,
-			"name": project.name,
-			"path": project.path,
-			"status": project_status,
-		}
+def _status_event(status: ProjectStatusSchema.ProjectStatusRead | None) -> str:
+	data = status.model_dump_json() if status is not None else "null"
+	return f"event: status\ndata: {data}\n\n"
 
-		BackgroundTasks().add_task(index_project_in_background, args)
-		return {"message": "Project indexing started"}
 
-	except Exception as e:
-		logger.error(e)
-		return {"message": "Failed to index project."}
+def _is_finished(status: ProjectStatusSchema.ProjectStatusRead | None) -> bool:
+	# Projects never queued for indexing have nothing to wait for
+	return status is None or status.status in _FINISHED_STATUSES
+
+
+@indices_router.get("/{project_id}/progress")
+async def stream_progress(project_id: UUID, request: Request):
+	"""
+	Stream the progress of the project indexing as Server-Sent Events. The
+	stream starts with a `status` event holding the persisted status of the
+	last run and its stage metrics. When a run is queued or running, the
+	latest known progress and the next ones follow as `progress` events,
+	until the run finishes. Otherwise the stream ends right away.
+	"""
+	status_service = ProjectStatusService()
+	try:
+		status = status_service.get_project_status_by_project_id(project_id)
+	except ValueError as e:
+		raise HTTPException(status_code=404, detail=str(e))
+
+	async def events():
+		with progress_broker.subscribe(project_id) as queue:
+			yield _status_event(status)
+			if _is_finished(status):
+				return
+
+			# A finished progress is the one of a previous run
+			latest = progress_broker.latest(project_id)
+			if latest is not None and not latest.finished:
+				yield _progress_event(latest)
+
+			while not await request.is_disconnected():
+				try:
+					progress = await asyncio.wait_for(
+						queue.get(), PROGRESS_KEEPALIVE_SECONDS
+					)
+				except asyncio.TimeoutError:
+					# Jobs cancelled before they ran don't report progress
+					try:
+						current = status_service.get_project_status_by_project_id(
+							project_id
+						)
+					except ValueError:
+						# The project was deleted
+						return
+					if _is_finished(current):
+						yield _status_event(current)
+						return
+					yield ": keep-alive\n\n"
+					continue
+
+				yield _progress_event(progress)
+				if progress.finished:
+					return
+
+	return StreamingResponse(
+		events(),
+		media_type="text/event-stream",
+		headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+	)
@@ -1,65 +1,178 @@
+import os
+from collections.abc import Iterable, Iterator
+from fnmatch import fnmatch
+from pathlib import Path
+
+from llama_index.core import Document
+
+from app.config import INDEX_BATCH_SIZE
 from app.utils import logger
-from app.utils.git import exclude_ignored_documents
+from app.utils.git import GitIgnoreMatcher
+
+EXCLUDED_FILE_PATTERNS = [
+	"*.crx",
+	"*.pem",
+	"*.zip",
+	"*.yaml",
+	"*.png",
+	"*.jpg",
+	"*.jpeg",
+	"*.gif",
+	"*.pdf",
+	"*.docx",
+	"*.pptx",
+	"*.xlsx",
+	"*.mp4",
+	"*.avi",
+	"*.mov",
+	"*.mp3",
+	"*.wav",
+	"*.map",
+	"*.json",
+	"*.lock",
+]
+
+
+def to_document_path(path: str, file_path: str) -> str:
+	"""
+	Map a path relative to the project directory to the `file_path`
+	stored in the document metadata.
+	"""
+	return str(Path(path) / file_path).replace(path, "")
+
+
+def is_excluded_file(file_name: str) -> bool:
+	return file_name.startswith(".") or any(
+		fnmatch(file_name, pattern) for pattern in EXCLUDED_FILE_PATTERNS
+	)
+
 
+def filter_indexable_files(path: str, files: list[str]) -> list[str]:
+	"""
+	Apply the same rules as the directory walk (hidden files, excluded
+	extensions and `.gitignore`) to a list of paths relative to `path`.
+	"""
+	matcher = GitIgnoreMatcher(path)
+
+	indexable = []
+	for file_path in files:
+		parts = Path(file_path).parts
+		if any(part.startswith(".") for part in parts[:-1]):
+			continue
+		if is_excluded_file(parts[-1]):
+			continue
+		if matcher.is_excluded(file_path):
+			continue
+		indexable.append(file_path)
+
+	return indexable
+
+
+def iter_file_paths(path: str) -> Iterator[Path]:
+	"""
+	Walk the project directory and yield the files to index.
+
+	Hidden and git-ignored directories are pruned during the walk, so
+	`node_modules/`, build outputs and the like are never visited.
+	"""
+	matcher = GitIgnoreMatcher(path)
+
+	for dir_path, dir_names, file_names in os.walk(path):
+		relative_dir = Path(dir_path).relative_to(path)
+
+		dir_names[:] = sorted(
+			dir_name
+			for dir_name in dir_names
+			if not dir_name.startswith(".")
+			and not matcher.is_ignored(
+				(relative_dir / dir_name).as_posix(), is_dir=True
+			)
+		)
 
-def load_documents(path: str):
+		for file_name in sorted(file_names):
+			if is_excluded_file(file_name):
+				continue
+			if matcher.is_ignored((relative_dir / file_name).as_posix()):
+				continue
+			yield Path(dir_path) / file_name
+
+
+def _batched(iterable: Iterable[Path], size: int) -> Iterator[list[Path]]:
+	batch = []
+	for item in iterable:
+		batch.append(item)
+		if len(batch) == size:
+			yield batch
+			batch = []
+	if batch:
+		yield batch
+
+
+def read_documents(path: str, file_paths: list[Path]) -> list[Document]:
 	from llama_index.core.readers import SimpleDirectoryReader
 
-	try:
-		import nest_asyncio
-
-		nest_asyncio.apply()
-
-		exclude_list = [
-			"*.crx",
-			"*.pem",
-			"*.zip",
-			"*.yaml",
-			"*.png",
-			"*.jpg",
-			"*.jpeg",
-			"*.gif",
-			"*.pdf",
-			"*.docx",
-			"*.pptx",
-			"*.xlsx",
-			"*.mp4",
-			"*.avi",
-			"*.mov",
-			"*.mp3",
-			"*.wav",
-			"*.map",
-			"*.json",
-			"*.lock",
-		]
-
-		loader = SimpleDirectoryReader(
-			recursive=True,
-			filename_as_id=True,
-			raise_on_error=True,
-			input_dir=path,
-			exclude_hidden=True,
-			exclude=exclude_list,
+	# Files may have been removed since they were discovered
+	input_files = [str(file_path) for file_path in file_paths if file_path.is_file()]
+	if not input_files:
+		return []
+
+	loader = SimpleDirectoryReader(
+		filename_as_id=True,
+		raise_on_error=True,
+		input_files=input_files,
+	)
+	documents = loader.load_data()
+
+	for doc in documents:
+		doc.metadata["file_path"] = doc.metadata["file_path"].replace(path, "")
+
+	return documents
+
+
+def iter_file_batches(
+	path: str,
+	files: list[str] | None = None,
+	batch_size: int = INDEX_BATCH_SIZE,
+) -> Iterator[list[Path]]:
+	"""
+	Yield the files to index in batches of at most `batch_size` paths.
+
+	When `files` (paths relative to `path`) is given, only those files are
+	considered instead of walking the whole directory.
+	"""
+	if files is None:
+		file_paths = iter_file_paths(path)
+	else:
+		file_paths = (
+			Path(path) / file_path for file_path in filter_indexable_files(path, files)
 		)
-		documents = loader.load_data()
-		filtered_docs = exclude_ignored_documents(directory=path, documents=documents)
-
-		for doc in filtered_docs:
-			doc.metadata["file_path"] = doc.metadata["file_path"].replace(path, "")
-
-		return filtered_docs
-
-	except Exception as e:
-		import sys
-		import traceback
-
-		# Catch the error if the data dir is empty
-		# and return as empty document list
-		_, _, exc_traceback = sys.exc_info()
-		function_name = traceback.extract_tb(exc_traceback)[-1].name
-		if function_name == "_add_files":
-			logger.warning(f"Failed to load file documents, error message: {e}")
-			return []
-		else:
-			# Raise the error if it is not the case of empty data dir
-			raise e
+
+	yield from _batched(file_paths, batch_size)
+
+
+def iter_documents(
+	path: str,
+	files: list[str] | None = None,
+	batch_size: int = INDEX_BATCH_SIZE,
+) -> Iterator[list[Document]]:
+	"""
+	Lazily load the documents of a project directory in batches of at most
+	`batch_size` files, so memory stays bounded whatever the repository size.
+	"""
+	for batch in iter_file_batches(path, files=files, batch_size=batch_size):
+		documents = read_documents(path, batch)
+		logger.debug(f"Loaded {len(documents)} documents from {len(batch)} files")
+		if documents:
+			yield documents
+
+
+def load_documents(path: str, files: list[str] | None = None) -> list[Document]:
+	"""
+	Load all the documents of a project directory at once.
+	Prefer `iter_documents` for indexing large directories.
+	"""
+	return [
+		document
+		for documents in iter_documents(path=path, files=files)
+		for document in documents
+	]
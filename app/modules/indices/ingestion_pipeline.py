@@ -1,33 +1,38 @@
-from llama_index.core.ingestion import DocstoreStrategy, IngestionPipeline
-from llama_index.core.storage.docstore import SimpleDocumentStore
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.ingestion import IngestionPipeline
 
 # from llama_index.core.storage.chat_store import SimpleChatStore
 # from llama_index.core.storage.index_store import SimpleIndexStore
 # from llama_index.core.storage.storage_context import StorageContext, DEFAULT_PERSIST_DIR
-from app.shared.chroma_db import ChromaDB
 from app.shared.embed_models import load_embedding_model
+from app.shared.lexical_index import LexicalIndex, LexicalIndexer
+from app.shared.vector_db import VectorCollection, get_vector_db
 from app.utils import logger
 
 
-def build_ingestion_pipeline(collection_name: str):
+def build_ingestion_pipeline(
+	collection_name: str,
+	embedding_model: BaseEmbedding | None = None,
+	vector_db: VectorCollection | None = None,
+	lexical_index: LexicalIndex | None = None,
+):
 	try:
-		embedding_model = load_embedding_model()
-		chroma_collection = ChromaDB(collection_name)
-		vector_store = chroma_collection.as_vector_store()
-
-		doc_store = SimpleDocumentStore.from_persist_dir(
-			persist_dir="database/docstore",
-		)
+		embedding_model = embedding_model or load_embedding_model()
+		vector_db = vector_db or get_vector_db(collection_name)
+		vector_store = vector_db.as_vector_store()
 
+		# Documents are split into nodes by the parse workers before they
+		# reach the pipeline, which only embeds and stores them. Stale nodes
+		# are removed explicitly before re-indexing, so no docstore is needed.
 		transformations = [
 			embedding_model,
 		]
+		if lexical_index is not None:
+			transformations.append(LexicalIndexer(lexical_index))
 
 		pipeline = IngestionPipeline(
 			transformations=transformations,
 			vector_store=vector_store,
-			docstore=doc_store,
-			docstore_strategy=DocstoreStrategy.UPSERTS_AND_DELETE,
 			project_name=collection_name,
 			disable_cache=True,
 		)
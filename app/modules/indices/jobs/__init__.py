@@ -0,0 +1,13 @@
+from .models import IndexJob, IndexJobStatusEnum
+from .runner import IndexJobRunner, job_runner
+from .schemas import IndexJobSchema
+from .service import IndexJobService
+
+__all__ = [
+	IndexJob,
+	IndexJobStatusEnum,
+	IndexJobSchema,
+	IndexJobService,
+	IndexJobRunner,
+	job_runner,
+]
@@ -0,0 +1,49 @@
+from datetime import datetime
+from enum import Enum
+from uuid import UUID
+
+from sqlalchemy import JSON
+from sqlmodel import Field, SQLModel
+
+from app.utils import generate_timestamp, generate_uuid
+
+
+class IndexJobStatusEnum(str, Enum):
+	QUEUED = "queued"
+	RUNNING = "running"
+	SUCCEEDED = "succeeded"
+	FAILED = "failed"
+	CANCELLED = "cancelled"
+
+
+class IndexJobBase(SQLModel):
+	project_id: UUID = Field(foreign_key="project.id", index=True)
+	project_status_id: UUID = Field(foreign_key="projectstatus.id")
+	status: IndexJobStatusEnum = Field(default=IndexJobStatusEnum.QUEUED, index=True)
+	priority: int = Field(default=0, description="Higher priorities run first")
+	full_rebuild: bool = Field(default=False)
+	files: list[str] | None = Field(
+		default=None,
+		sa_type=JSON,
+		description="Re-index these files along with the changes since the last indexed commit",
+	)
+	attempts: int = Field(default=0)
+	max_attempts: int = Field(default=1)
+	run_after: datetime = Field(
+		default_factory=generate_timestamp,
+		description="The job is not picked up before this time (retry backoff)",
+	)
+	cancel_requested: bool = Field(default=False)
+	error: str | None = Field(default=None)
+
+
+class IndexJob(IndexJobBase, table=True):
+	id: UUID = Field(default_factory=generate_uuid, primary_key=True)
+
+	created_at: datetime = Field(default_factory=generate_timestamp)
+	updated_at: datetime = Field(default_factory=generate_timestamp)
+	started_at: datetime | None = Field(default=None)
+	finished_at: datetime | None = Field(default=None)
+
+
+__all__ = [IndexJob, IndexJobBase, IndexJobStatusEnum]
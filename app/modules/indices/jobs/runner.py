@@ -0,0 +1,162 @@
+import asyncio
+import contextlib
+from uuid import UUID
+
+from app.config import INDEX_JOB_POLL_INTERVAL, INDEX_JOB_WORKERS
+from app.modules.projects import ProjectService, ProjectStatusEnum, ProjectStatusService
+from app.utils import logger
+from app.utils.request_context import request_id
+
+from ..background import InvalidProjectError, index_project_in_background
+from .models import IndexJobStatusEnum
+from .schemas import IndexJobSchema
+from .service import IndexJobService
+
+index_job_service = IndexJobService()
+project_status_service = ProjectStatusService()
+
+
+class IndexJobRunner:
+	"""
+	Runs the queued indexing jobs on a bounded number of asyncio workers.
+
+	Jobs are persisted by `IndexJobService`, so the runner only keeps the
+	tasks of the jobs it is currently running. Call `notify()` after
+	enqueueing a job to pick it up without waiting for the next poll.
+	"""
+
+	def __init__(
+		self,
+		workers: int = INDEX_JOB_WORKERS,
+		poll_interval: float = INDEX_JOB_POLL_INTERVAL,
+	):
+		self.workers = max(workers, 1)
+		self.poll_interval = poll_interval
+		self._wakeup = asyncio.Event()
+		self._workers: list[asyncio.Task] = []
+		self._running: dict[UUID, asyncio.Task] = {}
+		# Running jobs deleted with their project, nothing to record for them
+		self._deleted: set[UUID] = set()
+		self._stopping = False
+
+	async def start(self):
+		requeued = index_job_service.requeue_interrupted()
+		if requeued:
+			logger.info(f"Requeued {requeued} interrupted indexing jobs")
+
+		self._stopping = False
+		self._workers = [
+			asyncio.create_task(self._work(), name=f"index-job-worker-{i}")
+			for i in range(self.workers)
+		]
+		logger.info(f"Started {self.workers} indexing workers")
+
+	async def stop(self):
+		self._stopping = True
+		for worker in self._workers:
+			worker.cancel()
+		await asyncio.gather(*self._workers, return_exceptions=True)
+		self._workers = []
+
+	def notify(self):
+		self._wakeup.set()
+
+	def cancel(self, job_id: UUID) -> IndexJobSchema.IndexJobRead:
+		job = index_job_service.cancel(job_id)
+		task = self._running.get(job_id)
+		if task is not None:
+			task.cancel()
+		return job
+
+	def delete_project_jobs(self, project_id: UUID):
+		"""
+		Delete the jobs of a project and stop the ones running. Must be
+		called from the event loop of the runner.
+		"""
+		for job_id in index_job_service.delete_project_jobs(project_id):
+			task = self._running.get(job_id)
+			if task is not None:
+				self._deleted.add(job_id)
+				task.cancel()
+
+	async def _work(self):
+		while True:
+			job = index_job_service.claim_next()
+			if job is None:
+				with contextlib.suppress(asyncio.TimeoutError):
+					await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+				self._wakeup.clear()
+				continue
+
+			await self._run(job)
+
+	async def _run(self, job: IndexJobSchema.IndexJobRead):
+		logger.info(f"Running index job {job.id} (attempt {job.attempts})")
+		try:
+			project = ProjectService().get_project(id=job.project_id)
+			project_status = project_status_service.get_project_status(
+				id=job.project_status_id
+			)
+		except ValueError as e:
+			logger.error(e)
+			index_job_service.abort(job.id, error=str(e))
+			return
+
+		args = {
+			"id": project.id,
+			"name": project.name,
+			"path": project.path,
+			"vector_store": project.vector_store,
+			"vector_index_type": project.vector_index_type,
+			"vector_compression": project.vector_compression,
+			"status": project_status,
+			"full_rebuild": job.full_rebuild,
+			"files": job.files,
+		}
+		# The logs of the run are tagged with the job id
+		token = request_id.set(f"job-{job.id}")
+		try:
+			task = asyncio.create_task(index_project_in_background(args))
+		finally:
+			request_id.reset(token)
+		self._running[job.id] = task
+		try:
+			await task
+			index_job_service.complete(job.id)
+		except asyncio.CancelledError:
+			if job.id in self._deleted:
+				logger.info(f"Index job {job.id} stopped, its project was deleted")
+				if self._stopping:
+					raise
+				return
+			if self._stopping:
+				index_job_service.requeue(job.id)
+				raise
+			logger.info(f"Index job {job.id} cancelled")
+			index_job_service.mark_cancelled(job.id)
+			project_status_service.update_project_status(
+				project_status_id=job.project_status_id,
+				status=ProjectStatusEnum.CANCELLED,
+			)
+		except Exception as e:
+			if job.id in self._deleted:
+				# Finished before it could be stopped
+				return
+			job = index_job_service.fail(
+				job.id, error=str(e), retry=not isinstance(e, InvalidProjectError)
+			)
+			logger.warning(f"Index job {job.id} {job.status}: {e}")
+			if job.status == IndexJobStatusEnum.QUEUED:
+				project_status_service.update_project_status(
+					project_status_id=job.project_status_id,
+					status=ProjectStatusEnum.QUEUE,
+				)
+		finally:
+			self._running.pop(job.id, None)
+			self._deleted.discard(job.id)
+
+
+job_runner = IndexJobRunner()
+
+
+__all__ = ["IndexJobRunner", "job_runner"]
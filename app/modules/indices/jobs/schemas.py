@@ -0,0 +1,29 @@
+from datetime import datetime
+from uuid import UUID
+
+from pydantic import BaseModel
+
+
+class IndexJobSchema:
+	class IndexJobRead(BaseModel):
+		id: UUID
+		project_id: UUID
+		project_status_id: UUID
+		status: str
+		priority: int
+		full_rebuild: bool
+		files: list[str] | None = None
+		attempts: int
+		max_attempts: int
+		run_after: datetime
+		cancel_requested: bool
+		error: str | None
+		created_at: datetime
+		started_at: datetime | None
+		finished_at: datetime | None
+
+	class IndexJobList(BaseModel):
+		jobs: list["IndexJobSchema.IndexJobRead"] = []
+
+
+__all__ = [IndexJobSchema]
@@ -0,0 +1,277 @@
+from datetime import datetime, timedelta, timezone
+from uuid import UUID
+
+from sqlmodel import select
+
+from app.config import INDEX_JOB_MAX_ATTEMPTS, INDEX_JOB_RETRY_BACKOFF
+from app.database import Session, engine
+from app.modules.projects import ProjectStatusEnum, ProjectStatusService
+
+from .models import IndexJob, IndexJobStatusEnum
+from .schemas import IndexJobSchema
+
+project_status_service = ProjectStatusService()
+
+
+def _read(job: IndexJob) -> IndexJobSchema.IndexJobRead:
+	return IndexJobSchema.IndexJobRead.model_validate(job, from_attributes=True)
+
+
+class IndexJobService:
+	def __init__(self):
+		pass
+
+	def get_job(self, id: UUID) -> IndexJobSchema.IndexJobRead:
+		with Session(engine) as session:
+			job = session.get(IndexJob, id)
+			if not job:
+				raise ValueError("Index job not found.")
+			return _read(job)
+
+	def get_job_list(
+		self,
+		project_id: UUID | None = None,
+		status: IndexJobStatusEnum | None = None,
+		offset: int = 0,
+		limit: int = 100,
+	) -> IndexJobSchema.IndexJobList:
+		with Session(engine) as session:
+			query = select(IndexJob)
+			if project_id:
+				query = query.where(IndexJob.project_id == project_id)
+			if status:
+				query = query.where(IndexJob.status == status)
+			jobs = session.exec(
+				query.order_by(IndexJob.created_at.desc()).offset(offset).limit(limit)
+			).all()
+			return IndexJobSchema.IndexJobList(jobs=[_read(job) for job in jobs])
+
+	def enqueue(
+		self,
+		project_id: UUID,
+		full_rebuild: bool = False,
+		priority: int = 0,
+		project_status_id: UUID | None = None,
+		files: list[str] | None = None,
+	) -> IndexJobSchema.IndexJobRead:
+		"""
+		Queue an indexing job for the project. `files` restricts the job to
+		the given paths, relative to the project directory.
+
+		A project has at most one queued job: enqueueing again merges into
+		the queued job (keeping the highest priority, a full rebuild if any
+		request asked for one, and the union of the files) instead of
+		creating a new one.
+		"""
+		with Session(engine) as session:
+			queued = session.exec(
+				select(IndexJob).where(
+					IndexJob.project_id == project_id,
+					IndexJob.status == IndexJobStatusEnum.QUEUED,
+				)
+			).first()
+			if queued:
+				queued.priority = max(queued.priority, priority)
+				queued.full_rebuild = queued.full_rebuild or full_rebuild
+				if queued.files is not None:
+					queued.files = (
+						sorted(set(queued.files) | set(files))
+						if files is not None
+						else None
+					)
+				queued.updated_at = datetime.now(timezone.utc)
+				session.commit()
+				session.refresh(queued)
+				return _read(queued)
+
+		if project_status_id is None:
+			project_status_id = project_status_service.create_project_status(
+				project_id=project_id, status=ProjectStatusEnum.QUEUE
+			).id
+
+		with Session(engine) as session:
+			job = IndexJob(
+				project_id=project_id,
+				project_status_id=project_status_id,
+				full_rebuild=full_rebuild,
+				files=sorted(set(files)) if files is not None else None,
+				priority=priority,
+				max_attempts=max(INDEX_JOB_MAX_ATTEMPTS, 1),
+			)
+			session.add(job)
+			session.commit()
+			session.refresh(job)
+			return _read(job)
+
+	def claim_next(self) -> IndexJobSchema.IndexJobRead | None:
+		"""
+		Mark the next runnable job as running and return it. Jobs of a
+		project that already has a running job are skipped.
+		"""
+		now = datetime.now(timezone.utc)
+		with Session(engine) as session:
+			running_projects = select(IndexJob.project_id).where(
+				IndexJob.status == IndexJobStatusEnum.RUNNING
+			)
+			job = session.exec(
+				select(IndexJob)
+				.where(
+					IndexJob.status == IndexJobStatusEnum.QUEUED,
+					IndexJob.run_after <= now,
+					IndexJob.project_id.not_in(running_projects),
+				)
+				.order_by(IndexJob.priority.desc(), IndexJob.created_at)
+			).first()
+			if not job:
+				return None
+
+			job.status = IndexJobStatusEnum.RUNNING
+			job.attempts += 1
+			job.started_at = now
+			job.updated_at = now
+			session.commit()
+			session.refresh(job)
+			return _read(job)
+
+	def _finish(
+		self, job_id: UUID, status: IndexJobStatusEnum, error: str | None = None
+	) -> IndexJobSchema.IndexJobRead:
+		with Session(engine) as session:
+			job = session.get(IndexJob, job_id)
+			if not job:
+				raise ValueError("Index job not found.")
+			job.status = status
+			job.error = error
+			job.finished_at = datetime.now(timezone.utc)
+			job.updated_at = job.finished_at
+			session.commit()
+			session.refresh(job)
+			return _read(job)
+
+	def complete(self, job_id: UUID) -> IndexJobSchema.IndexJobRead:
+		return self._finish(job_id, IndexJobStatusEnum.SUCCEEDED)
+
+	def abort(self, job_id: UUID, error: str) -> IndexJobSchema.IndexJobRead:
+		"""
+		Fail the job without retrying it.
+		"""
+		return self._finish(job_id, IndexJobStatusEnum.FAILED, error=error)
+
+	def fail(
+		self, job_id: UUID, error: str, retry: bool = True
+	) -> IndexJobSchema.IndexJobRead:
+		"""
+		Record a failed attempt. The job is queued again with an exponential
+		backoff until it runs out of attempts, failures that can't be
+		retried (`retry=False`) fail it right away.
+		"""
+		with Session(engine) as session:
+			job = session.get(IndexJob, job_id)
+			if not job:
+				raise ValueError("Index job not found.")
+			if not retry or job.attempts >= job.max_attempts or job.cancel_requested:
+				return self._finish(job_id, IndexJobStatusEnum.FAILED, error=error)
+
+			now = datetime.now(timezone.utc)
+			backoff = INDEX_JOB_RETRY_BACKOFF * 2 ** (job.attempts - 1)
+			job.status = IndexJobStatusEnum.QUEUED
+			job.error = error
+			job.run_after = now + timedelta(seconds=backoff)
+			job.updated_at = now
+			session.commit()
+			session.refresh(job)
+			return _read(job)
+
+	def cancel(self, job_id: UUID) -> IndexJobSchema.IndexJobRead:
+		"""
+		Cancel a queued job, or flag a running job for cancellation. The
+		worker running the job is responsible for stopping it.
+		"""
+		with Session(engine) as session:
+			job = session.get(IndexJob, job_id)
+			if not job:
+				raise ValueError("Index job not found.")
+			if job.status == IndexJobStatusEnum.RUNNING:
+				job.cancel_requested = True
+				job.updated_at = datetime.now(timezone.utc)
+				session.commit()
+				session.refresh(job)
+				return _read(job)
+			if job.status != IndexJobStatusEnum.QUEUED:
+				raise ValueError(f"Index job is already {job.status.value}.")
+
+		project_status_service.update_project_status(
+			project_status_id=job.project_status_id,
+			status=ProjectStatusEnum.CANCELLED,
+		)
+		return self._finish(job_id, IndexJobStatusEnum.CANCELLED)
+
+	def delete_project_jobs(self, project_id: UUID) -> list[UUID]:
+		"""
+		Delete the jobs of a project that is being deleted. Returns the ids
+		of the jobs that were running, for the runner to stop them.
+		"""
+		with Session(engine) as session:
+			jobs = session.exec(
+				select(IndexJob).where(IndexJob.project_id == project_id)
+			).all()
+			running = [
+				job.id for job in jobs if job.status == IndexJobStatusEnum.RUNNING
+			]
+			for job in jobs:
+				session.delete(job)
+			session.commit()
+		return running
+
+	def mark_cancelled(self, job_id: UUID) -> IndexJobSchema.IndexJobRead:
+		return self._finish(job_id, IndexJobStatusEnum.CANCELLED)
+
+	def requeue(self, job_id: UUID) -> IndexJobSchema.IndexJobRead:
+		"""
+		Put a running job back in the queue without counting the attempt,
+		used when the service shuts down while the job is running.
+		"""
+		with Session(engine) as session:
+			job = session.get(IndexJob, job_id)
+			if not job:
+				raise ValueError("Index job not found.")
+			job.status = IndexJobStatusEnum.QUEUED
+			job.attempts = max(job.attempts - 1, 0)
+			job.updated_at = datetime.now(timezone.utc)
+			session.commit()
+			session.refresh(job)
+			return _read(job)
+
+	def requeue_interrupted(self) -> int:
+		"""
+		Queue again the jobs left running by a previous process that crashed
+		or was killed. Returns the number of requeued jobs.
+		"""
+		with Session(engine) as session:
+			jobs = session.exec(
+				select(IndexJob).where(IndexJob.status == IndexJobStatusEnum.RUNNING)
+			).all()
+			now = datetime.now(timezone.utc)
+			interrupted = []
+			for job in jobs:
+				job.updated_at = now
+				if job.cancel_requested:
+					job.status = IndexJobStatusEnum.CANCELLED
+					job.finished_at = now
+				else:
+					job.status = IndexJobStatusEnum.QUEUED
+					job.run_after = now
+				interrupted.append((job.project_status_id, job.status))
+			session.commit()
+
+		for project_status_id, status in interrupted:
+			project_status_service.update_project_status(
+				project_status_id=project_status_id,
+				status=ProjectStatusEnum.CANCELLED
+				if status == IndexJobStatusEnum.CANCELLED
+				else ProjectStatusEnum.QUEUE,
+			)
+		return len(interrupted)
+
+
+__all__ = [IndexJobService]
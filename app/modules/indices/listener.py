@@ -1,12 +1,11 @@
 from uuid import UUID
 
-from fastapi import BackgroundTasks
 from pyventus.linkers import EventLinker
 
-from app.modules.projects import ProjectService, ProjectStatusEnum, ProjectStatusService
+from app.modules.projects import ProjectStatusService
 from app.utils import logger
 
-from .background import index_project_in_background
+from .jobs import IndexJobService, job_runner
 
 
 @EventLinker.on("ProjectIndex")
@@ -15,33 +14,13 @@ async def index_project_listener(
 ):
 	try:
 		logger.debug(f"Indexing project {project_status_id}")
-		project_status_service = ProjectStatusService()
-		project_status = project_status_service.get_project_status(id=project_status_id)
+		project_status = ProjectStatusService().get_project_status(id=project_status_id)
 
-		project = ProjectService().get_project(id=project_status.project_id)
-
-		if not project_status:
-			return {"message": "Project status not found."}
-
-		if project_status.status == ProjectStatusEnum.PROCESSING:
-			return {"message": "Project is already being indexed."}
-
-		if project_status.status == ProjectStatusEnum.SUCCESS:
-			return {"message": "Project has already been indexed."}
-
-		if project_status.status == ProjectStatusEnum.FAILED:
-			return {"message": "Project indexing failed."}
-
-		args = {
-			"id": project.id,
-			"name": project.name,
-			"path": project.path,
-			"status": project_status,
-		}
-
-		BackgroundTasks().add_task(index_project_in_background, args)
-		return {"message": "Project indexing started"}
+		IndexJobService().enqueue(
+			project_id=project_status.project_id,
+			project_status_id=project_status.id,
+		)
+		job_runner.notify()
 
 	except Exception as e:
 		logger.error(e)
-		return {"message": "Failed to index project."}
@@ -0,0 +1,84 @@
+import asyncio
+import time
+from collections import defaultdict
+from collections.abc import Iterator
+from contextlib import contextmanager
+from uuid import UUID
+
+from pydantic import BaseModel
+
+
+class IndexingProgress(BaseModel):
+	project_id: UUID
+	status: str = "processing"
+	stage: str = "prepare"
+	files_discovered: int = 0
+	files_loaded: int = 0
+	files_skipped: int = 0
+	chunks_produced: int = 0
+	chunks_embedded: int = 0
+	tokens_embedded: int = 0
+	tokens_per_sec: float = 0.0
+	elapsed_seconds: float = 0.0
+	eta_seconds: float | None = None
+	error: str | None = None
+
+	@property
+	def finished(self) -> bool:
+		return self.status != "processing"
+
+
+class ProgressBroker:
+	"""
+	Fan out the progress of running indexing jobs to the subscribed clients.
+
+	The latest progress of every project is kept, so clients subscribing in
+	the middle of a run get the current state right away. Intermediate
+	updates are throttled to one every `min_interval` seconds per project.
+	"""
+
+	def __init__(self, min_interval: float = 0.5, queue_size: int = 16):
+		self.min_interval = min_interval
+		self.queue_size = queue_size
+		self._latest: dict[UUID, IndexingProgress] = {}
+		self._published_at: dict[UUID, float] = {}
+		self._subscribers: dict[UUID, set[asyncio.Queue]] = defaultdict(set)
+
+	def latest(self, project_id: UUID) -> IndexingProgress | None:
+		return self._latest.get(project_id)
+
+	def publish(self, progress: IndexingProgress, force: bool = False):
+		project_id = progress.project_id
+		self._latest[project_id] = progress
+
+		now = time.monotonic()
+		if (
+			not force
+			and not progress.finished
+			and now - self._published_at.get(project_id, 0.0) < self.min_interval
+		):
+			return
+		self._published_at[project_id] = now
+
+		for queue in self._subscribers.get(project_id, ()):
+			if queue.full():
+				# Slow clients only miss intermediate updates
+				queue.get_nowait()
+			queue.put_nowait(progress)
+
+	@contextmanager
+	def subscribe(self, project_id: UUID) -> Iterator[asyncio.Queue]:
+		queue: asyncio.Queue[IndexingProgress] = asyncio.Queue(maxsize=self.queue_size)
+		self._subscribers[project_id].add(queue)
+		try:
+			yield queue
+		finally:
+			self._subscribers[project_id].discard(queue)
+			if not self._subscribers[project_id]:
+				del self._subscribers[project_id]
+
+
+progress_broker = ProgressBroker()
+
+
+__all__ = ["IndexingProgress", "ProgressBroker", "progress_broker"]
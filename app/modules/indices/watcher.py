@@ -0,0 +1,213 @@
+import asyncio
+from pathlib import Path, PurePosixPath
+from uuid import UUID
+
+from watchfiles import Change, DefaultFilter, awatch
+
+from app.config import (
+	INDEX_WATCH_DEBOUNCE_MS,
+	INDEX_WATCH_FORCE_POLLING,
+	INDEX_WATCH_POLL_DELAY_MS,
+	INDEX_WATCH_STEP_MS,
+)
+from app.modules.projects import ProjectSchemas, ProjectService
+from app.shared.lexical_index import get_lexical_index
+from app.utils import logger
+from app.utils.git import GitIgnoreMatcher
+
+from .directory_loader import is_excluded_file, iter_file_paths
+from .jobs import IndexJobService, job_runner
+
+index_job_service = IndexJobService()
+
+
+def _relative_path(root: Path, path: str) -> Path | None:
+	try:
+		return Path(path).relative_to(root)
+	except ValueError:
+		return None
+
+
+class ProjectChangeFilter(DefaultFilter):
+	"""
+	Keep the changes of the files the directory walk would index, plus the
+	`.gitignore` files so the ignore rules can be reloaded.
+	"""
+
+	def __init__(self, path: str):
+		super().__init__()
+		self.root = Path(path)
+		self.reload()
+
+	def reload(self):
+		self.matcher = GitIgnoreMatcher(str(self.root))
+
+	def __call__(self, change: Change, path: str) -> bool:
+		if not super().__call__(change, path):
+			return False
+
+		relative = _relative_path(self.root, path)
+		if relative is None:
+			return False
+		if relative.name == ".gitignore":
+			return True
+		if any(part.startswith(".") for part in relative.parts[:-1]):
+			return False
+		if is_excluded_file(relative.name):
+			return False
+		return not self.matcher.is_excluded(relative.as_posix())
+
+
+def list_ignore_rule_changes(
+	project: ProjectSchemas.ProjectRead, directories: set[PurePosixPath]
+) -> set[str]:
+	"""
+	Files below `directories`, whose `.gitignore` changed, that the index
+	doesn't match anymore: files no longer ignored that aren't indexed yet,
+	and indexed files that are now ignored.
+	"""
+	root = Path(project.path)
+	indexable = {
+		path.relative_to(root).as_posix() for path in iter_file_paths(project.path)
+	}
+	lexical_index = get_lexical_index(project.name, read_only=True)
+	try:
+		# Indexed paths are document paths, relative to the project with a
+		# leading slash
+		indexed = {path.lstrip("/") for path in lexical_index.file_paths()}
+	finally:
+		lexical_index.close()
+
+	def is_below(file_path: str) -> bool:
+		parents = PurePosixPath(file_path).parents
+		return any(directory in parents for directory in directories)
+
+	return {file_path for file_path in indexable ^ indexed if is_below(file_path)}
+
+
+class ProjectWatcher:
+	"""
+	Watch the directories of the projects that opted in and queue an
+	indexing job for the changed files only.
+
+	Changes are grouped by watchfiles until the directory is quiet, and the
+	files of successive groups are merged into the queued job of the
+	project while a previous job is still running, so a burst of changes
+	(a branch checkout, a rebase) results in a single job.
+	"""
+
+	def __init__(self):
+		self._tasks: dict[UUID, asyncio.Task] = {}
+
+	def is_watching(self, project_id: UUID) -> bool:
+		return project_id in self._tasks
+
+	async def start(self):
+		for project in ProjectService().get_watched_projects():
+			self.watch(project)
+
+	async def stop(self):
+		tasks = list(self._tasks.values())
+		self._tasks.clear()
+		for task in tasks:
+			task.cancel()
+		await asyncio.gather(*tasks, return_exceptions=True)
+
+	def watch(self, project: ProjectSchemas.ProjectRead):
+		if self.is_watching(project.id):
+			return
+		self._tasks[project.id] = asyncio.create_task(
+			self._watch(project), name=f"project-watcher-{project.id}"
+		)
+		logger.info(f"Watching {project.path} for changes")
+
+	def unwatch(self, project_id: UUID):
+		task = self._tasks.pop(project_id, None)
+		if task is not None:
+			task.cancel()
+
+	async def _watch(self, project: ProjectSchemas.ProjectRead):
+		watch_filter = ProjectChangeFilter(project.path)
+		force_polling = INDEX_WATCH_FORCE_POLLING
+
+		try:
+			while True:
+				try:
+					async for changes in awatch(
+						project.path,
+						watch_filter=watch_filter,
+						debounce=INDEX_WATCH_DEBOUNCE_MS,
+						step=INDEX_WATCH_STEP_MS,
+						force_polling=force_polling,
+						poll_delay_ms=INDEX_WATCH_POLL_DELAY_MS,
+					):
+						if not await self._on_changes(project, watch_filter, changes):
+							return
+					return
+				except (OSError, RuntimeError) as e:
+					# Native notifications fail when the inotify watch limit
+					# is reached or on some network file systems
+					if force_polling:
+						raise
+					logger.warning(f"Watching {project.path} failed ({e}), polling")
+					force_polling = True
+		except Exception as e:
+			logger.error(f"Stopped watching {project.path}: {e}")
+		finally:
+			if self._tasks.get(project.id) is asyncio.current_task():
+				del self._tasks[project.id]
+
+	async def _on_changes(
+		self,
+		project: ProjectSchemas.ProjectRead,
+		watch_filter: ProjectChangeFilter,
+		changes: set[tuple[Change, str]],
+	) -> bool:
+		"""
+		Queue the changed files. Returns False when the project no longer
+		exists and the watcher should stop.
+
+		A `.gitignore` change also queues the files below it that it
+		un-ignored or ignored, they didn't change themselves.
+		"""
+		files = set()
+		ignore_rule_directories = set()
+		for _, path in changes:
+			relative = _relative_path(watch_filter.root, path)
+			if relative is None:
+				continue
+			if relative.name == ".gitignore":
+				ignore_rule_directories.add(PurePosixPath(relative.parent.as_posix()))
+				continue
+			files.add(relative.as_posix())
+
+		if ignore_rule_directories:
+			watch_filter.reload()
+			files |= await asyncio.to_thread(
+				list_ignore_rule_changes, project, ignore_rule_directories
+			)
+
+		if not files:
+			return True
+
+		try:
+			ProjectService().get_project(id=project.id)
+		except ValueError:
+			logger.info(f"Project {project.id} was removed, stop watching")
+			return False
+
+		logger.debug(f"{len(files)} files changed in {project.path}")
+		index_job_service.enqueue(project_id=project.id, files=sorted(files))
+		job_runner.notify()
+		return True
+
+
+project_watcher = ProjectWatcher()
+
+
+__all__ = [
+	"ProjectChangeFilter",
+	"ProjectWatcher",
+	"list_ignore_rule_changes",
+	"project_watcher",
+]
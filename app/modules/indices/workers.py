@@ -0,0 +1,350 @@
+import asyncio
+import multiprocessing
+import threading
+import time
+from collections.abc import Callable, Iterator
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
+from functools import lru_cache
+from pathlib import Path
+from uuid import UUID
+
+from llama_index.core import Settings
+from llama_index.core.ingestion import IngestionPipeline
+from llama_index.core.schema import BaseNode, Document, MetadataMode
+from llama_index.core.utils import get_tokenizer
+
+from app.config import INDEX_PARSE_WORKERS, INDEX_QUEUE_SIZE, INDEX_READ_WORKERS
+from app.shared.metrics import INDEX_CHUNKS, INDEX_FILES, INDEX_STAGE_SECONDS
+from app.utils import logger
+
+from .code_splitter import (
+	CodeSymbol,
+	CodeSymbolSplitter,
+	extract_symbols,
+	get_language,
+)
+from .directory_loader import read_documents
+from .progress import IndexingProgress
+
+_read_pool: ThreadPoolExecutor | None = None
+_parse_pool: ProcessPoolExecutor | None = None
+_pool_lock = threading.Lock()
+
+
+def get_read_pool() -> ThreadPoolExecutor:
+	global _read_pool
+	with _pool_lock:
+		if _read_pool is None:
+			_read_pool = ThreadPoolExecutor(
+				max_workers=max(INDEX_READ_WORKERS, 1),
+				thread_name_prefix="index-reader",
+			)
+		return _read_pool
+
+
+def get_parse_pool() -> Executor:
+	global _parse_pool
+	if INDEX_PARSE_WORKERS <= 0:
+		return get_read_pool()
+
+	with _pool_lock:
+		if _parse_pool is None:
+			# Workers are spawned rather than forked, the server process
+			# holds threads and open database connections
+			_parse_pool = ProcessPoolExecutor(
+				max_workers=INDEX_PARSE_WORKERS,
+				mp_context=multiprocessing.get_context("spawn"),
+			)
+		return _parse_pool
+
+
+def _reset_parse_pool():
+	global _parse_pool
+	with _pool_lock:
+		_parse_pool = None
+
+
+def shutdown_worker_pools():
+	global _read_pool, _parse_pool
+	with _pool_lock:
+		if _parse_pool is not None:
+			_parse_pool.shutdown(wait=False, cancel_futures=True)
+			_parse_pool = None
+		if _read_pool is not None:
+			_read_pool.shutdown(wait=False, cancel_futures=True)
+			_read_pool = None
+
+
+@lru_cache
+def _get_node_parser(chunk_size: int, chunk_overlap: int) -> CodeSymbolSplitter:
+	return CodeSymbolSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+
+
+def parse_documents(
+	documents: list[Document], chunk_size: int, chunk_overlap: int
+) -> tuple[list[BaseNode], int, dict[str, list[CodeSymbol]]]:
+	"""
+	Split documents into nodes, count the tokens that will be sent to the
+	embedding model and extract the symbols of each file. Runs in the parse
+	worker processes, so the chunking settings are passed explicitly instead
+	of read from `Settings`.
+	"""
+	node_parser = _get_node_parser(chunk_size, chunk_overlap)
+	nodes = node_parser.get_nodes_from_documents(documents)
+	tokenizer = get_tokenizer()
+	tokens = sum(
+		len(tokenizer(node.get_content(metadata_mode=MetadataMode.EMBED)))
+		for node in nodes
+	)
+
+	symbols: dict[str, list[CodeSymbol]] = {}
+	for document in documents:
+		file_path = document.metadata.get("file_path")
+		if not file_path:
+			continue
+		file_symbols = extract_symbols(
+			document.get_content(metadata_mode=MetadataMode.NONE),
+			get_language(file_path),
+		)
+		if file_symbols:
+			symbols.setdefault(file_path, []).extend(file_symbols)
+	return nodes, tokens, symbols
+
+
+@dataclass
+class StageStats:
+	name: str = ""
+	files: int = 0
+	chunks: int = 0
+	tokens: int = 0
+	started_at: float | None = None
+	finished_at: float | None = None
+
+	def record(self, started_at: float, files: int, chunks: int = 0, tokens: int = 0):
+		if self.started_at is None or started_at < self.started_at:
+			self.started_at = started_at
+		self.finished_at = time.perf_counter()
+		self.files += files
+		self.chunks += chunks
+		self.tokens += tokens
+		INDEX_STAGE_SECONDS.labels(stage=self.name).observe(
+			self.finished_at - started_at
+		)
+		INDEX_FILES.labels(stage=self.name).inc(files)
+		INDEX_CHUNKS.labels(stage=self.name).inc(chunks)
+
+	@property
+	def seconds(self) -> float:
+		if self.started_at is None or self.finished_at is None:
+			return 0.0
+		return self.finished_at - self.started_at
+
+	@property
+	def files_per_sec(self) -> float:
+		return self.files / self.seconds if self.seconds else 0.0
+
+	@property
+	def tokens_per_sec(self) -> float:
+		return self.tokens / self.seconds if self.seconds else 0.0
+
+	def as_dict(self) -> dict:
+		return {
+			"files": self.files,
+			"chunks": self.chunks,
+			"tokens": self.tokens,
+			"seconds": round(self.seconds, 3),
+			"files_per_sec": round(self.files_per_sec, 2),
+			"tokens_per_sec": round(self.tokens_per_sec, 2),
+		}
+
+
+@dataclass
+class IndexingStats:
+	"""
+	Throughput of each indexing stage. Stages overlap, so the time of a stage
+	is measured from its first batch starting to its last batch finishing.
+	"""
+
+	prepare: StageStats = field(default_factory=lambda: StageStats("prepare"))
+	discover: StageStats = field(default_factory=lambda: StageStats("discover"))
+	read: StageStats = field(default_factory=lambda: StageStats("read"))
+	parse: StageStats = field(default_factory=lambda: StageStats("parse"))
+	embed: StageStats = field(default_factory=lambda: StageStats("embed"))
+	stage: str = "prepare"
+	files_loaded: int = 0
+	files_skipped: int = 0
+	discovered_all: bool = False
+	started_at: float = field(default_factory=time.perf_counter)
+	finished_at: float | None = None
+
+	@property
+	def seconds(self) -> float:
+		return (self.finished_at or time.perf_counter()) - self.started_at
+
+	@property
+	def eta_seconds(self) -> float | None:
+		"""
+		Remaining time at the current embedding throughput, only known once
+		every file has been discovered.
+		"""
+		if not self.discovered_all:
+			return None
+		remaining = self.discover.files - self.files_skipped - self.embed.files
+		if remaining <= 0:
+			return 0.0
+		if not self.embed.files_per_sec:
+			return None
+		return remaining / self.embed.files_per_sec
+
+	def progress(
+		self, project_id: UUID, status: str = "processing", error: str | None = None
+	) -> IndexingProgress:
+		eta_seconds = self.eta_seconds
+		return IndexingProgress(
+			project_id=project_id,
+			status=status,
+			stage=self.stage,
+			files_discovered=self.discover.files,
+			files_loaded=self.files_loaded,
+			files_skipped=self.files_skipped,
+			chunks_produced=self.parse.chunks,
+			chunks_embedded=self.embed.chunks,
+			tokens_embedded=self.embed.tokens,
+			tokens_per_sec=round(self.embed.tokens_per_sec, 2),
+			elapsed_seconds=round(self.seconds, 3),
+			eta_seconds=round(eta_seconds, 1) if eta_seconds is not None else None,
+			error=error,
+		)
+
+	def as_dict(self) -> dict:
+		return {
+			"prepare": self.prepare.as_dict(),
+			"discover": self.discover.as_dict(),
+			"read": self.read.as_dict(),
+			"parse": self.parse.as_dict(),
+			"embed": self.embed.as_dict(),
+			"total": {
+				"files": self.files_loaded,
+				"skipped": self.files_skipped,
+				"chunks": self.embed.chunks,
+				"tokens": self.embed.tokens,
+				"seconds": round(self.seconds, 3),
+			},
+		}
+
+
+async def ingest_file_batches(
+	path: str,
+	file_batches: Iterator[list[Path]],
+	pipeline: IngestionPipeline,
+	stats: IndexingStats | None = None,
+	on_progress: Callable[[IndexingStats], None] | None = None,
+	on_symbols: Callable[[dict[str, list[CodeSymbol]]], None] | None = None,
+) -> IndexingStats:
+	"""
+	Read, parse and embed batches of files with the stages running
+	concurrently: files are read and decoded on a thread pool, parsed and
+	chunked on a process pool, and the resulting nodes are embedded by
+	`pipeline` while the next batches are still being parsed.
+
+	`on_progress` is called with the stats every time a batch moves through
+	a stage, and `on_symbols`, on a thread, with the symbols of every parsed
+	batch.
+	"""
+	stats = stats or IndexingStats()
+	loop = asyncio.get_running_loop()
+	queue: asyncio.Queue[tuple[int, list[BaseNode], int] | None] = asyncio.Queue(
+		maxsize=max(INDEX_QUEUE_SIZE, 1)
+	)
+	chunk_size, chunk_overlap = Settings.chunk_size, Settings.chunk_overlap
+	max_in_flight = max(INDEX_READ_WORKERS, INDEX_PARSE_WORKERS, 1)
+
+	def report(stage: str | None = None):
+		if stage is not None:
+			stats.stage = stage
+		if on_progress is not None:
+			on_progress(stats)
+
+	async def process(batch: list[Path]):
+		started_at = time.perf_counter()
+		documents = await loop.run_in_executor(
+			get_read_pool(), read_documents, path, batch
+		)
+		# Files that can't be read or decoded produce no documents
+		loaded = len({document.metadata.get("file_path") for document in documents})
+		stats.read.record(started_at, files=len(batch))
+		stats.files_loaded += loaded
+		stats.files_skipped += len(batch) - loaded
+		report()
+		if not documents:
+			return
+
+		started_at = time.perf_counter()
+		try:
+			nodes, tokens, symbols = await loop.run_in_executor(
+				get_parse_pool(), parse_documents, documents, chunk_size, chunk_overlap
+			)
+		except BrokenProcessPool:
+			_reset_parse_pool()
+			raise
+		stats.parse.record(started_at, files=loaded, chunks=len(nodes), tokens=tokens)
+		report()
+		if on_symbols is not None and symbols:
+			await asyncio.to_thread(on_symbols, symbols)
+		await queue.put((loaded, nodes, tokens))
+
+	async def produce():
+		in_flight: set[asyncio.Task] = set()
+		try:
+			while True:
+				started_at = time.perf_counter()
+				batch = await loop.run_in_executor(
+					get_read_pool(), next, file_batches, None
+				)
+				if batch is None:
+					break
+				stats.discover.record(started_at, files=len(batch))
+				report()
+
+				in_flight.add(asyncio.create_task(process(batch)))
+				if len(in_flight) >= max_in_flight:
+					done, in_flight = await asyncio.wait(
+						in_flight, return_when=asyncio.FIRST_COMPLETED
+					)
+					for task in done:
+						task.result()
+			stats.discovered_all = True
+			report("parse")
+			await asyncio.gather(*in_flight)
+			report("embed")
+		except asyncio.CancelledError:
+			for task in in_flight:
+				task.cancel()
+			raise
+		except Exception:
+			for task in in_flight:
+				task.cancel()
+			await queue.put(None)
+			raise
+		await queue.put(None)
+
+	producer = asyncio.create_task(produce())
+	report("discover")
+	try:
+		while (item := await queue.get()) is not None:
+			file_count, nodes, tokens = item
+			started_at = time.perf_counter()
+			await pipeline.arun(nodes=nodes)
+			stats.embed.record(
+				started_at, files=file_count, chunks=len(nodes), tokens=tokens
+			)
+			report()
+		await producer
+	finally:
+		if not producer.done():
+			producer.cancel()
+
+	logger.debug(f"Indexing stats: {stats.as_dict()}")
+	return stats
@@ -57,7 +57,9 @@ def update_project(project_id: str, project_data: ProjectSchemas.ProjectUpdate):
 
 
 @project_router.delete("/{project_id}")
-def delete_project(project_id: str):
+async def delete_project(project_id: str):
+	# Runs on the event loop, the project's running job can only be
+	# cancelled from its loop
 	return project_service.delete_project(project_id=UUID(project_id))
 
 
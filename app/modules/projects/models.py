@@ -3,6 +3,12 @@ from uuid import UUID
 
 from sqlmodel import Field, SQLModel
 
+from app.config import VECTOR_STORE_BACKEND
+from app.shared.vector_db import (
+	VectorCompressionEnum,
+	VectorIndexTypeEnum,
+	VectorStoreEnum,
+)
 from app.utils import generate_timestamp, generate_uuid
 
 
@@ -13,6 +19,16 @@ class ProjectBase(SQLModel):
 
 class Project(ProjectBase, table=True):
 	id: UUID = Field(default_factory=generate_uuid, primary_key=True)
+	watch: bool = Field(
+		default=False, description="Re-index changed files as soon as they are saved"
+	)
+	vector_store: VectorStoreEnum = Field(default=VectorStoreEnum(VECTOR_STORE_BACKEND))
+	vector_index_type: VectorIndexTypeEnum | None = Field(
+		default=None, description="FAISS index type, defaults to FAISS_INDEX_TYPE"
+	)
+	vector_compression: VectorCompressionEnum | None = Field(
+		default=None, description="FAISS vector codes, defaults to FAISS_COMPRESSION"
+	)
 
 	created_at: datetime = Field(default_factory=generate_timestamp)
 	updated_at: datetime = Field(default_factory=generate_timestamp)
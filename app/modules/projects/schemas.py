@@ -2,6 +2,12 @@ from uuid import UUID
 
 from pydantic import BaseModel, Field
 
+from app.shared.vector_db import (
+	VectorCompressionEnum,
+	VectorIndexTypeEnum,
+	VectorStoreEnum,
+)
+
 from .status.models import ProjectStatusEnum
 
 
@@ -9,17 +15,28 @@ class ProjectSchemas(BaseModel):
 	class ProjectCreate(BaseModel):
 		name: str = Field(..., min_length=1)
 		path: str = Field(..., min_length=1)
+		vector_store: VectorStoreEnum | None = None
+		vector_index_type: VectorIndexTypeEnum | None = None
+		vector_compression: VectorCompressionEnum | None = None
 
 	class ProjectDetails(BaseModel):
 		id: UUID
 		name: str
 		path: str
+		watch: bool = False
+		vector_store: VectorStoreEnum | None = None
+		vector_index_type: VectorIndexTypeEnum | None = None
+		vector_compression: VectorCompressionEnum | None = None
 		status: ProjectStatusEnum | None
 
 	class ProjectRead(BaseModel):
 		id: UUID
 		name: str
 		path: str
+		watch: bool = False
+		vector_store: VectorStoreEnum | None = None
+		vector_index_type: VectorIndexTypeEnum | None = None
+		vector_compression: VectorCompressionEnum | None = None
 
 	class ProjectDelete(BaseModel):
 		id: UUID
@@ -4,6 +4,9 @@ from uuid import UUID
 from sqlmodel import select
 
 from app.database import Session, engine
+from app.shared.answer_cache import answer_cache
+from app.shared.lexical_index import delete_lexical_index
+from app.shared.vector_db import invalidate_vector_index
 from app.utils.git import is_git_repo
 
 from .models import Project
@@ -31,6 +34,10 @@ class ProjectService:
 			id=project.id,
 			name=project.name,
 			path=project.path,
+			watch=project.watch,
+			vector_store=project.vector_store,
+			vector_index_type=project.vector_index_type,
+			vector_compression=project.vector_compression,
 			status=status,
 		)
 
@@ -47,6 +54,14 @@ class ProjectService:
 			]
 			return ProjectSchemas.ProjectList(projects=projects_read)
 
+	def get_watched_projects(self) -> list[ProjectSchemas.ProjectRead]:
+		with Session(engine) as session:
+			projects = session.exec(select(Project).where(Project.watch)).all()
+			return [
+				ProjectSchemas.ProjectRead.model_validate(p, from_attributes=True)
+				for p in projects
+			]
+
 	def get_project_count() -> int:
 		with Session(engine) as session:
 			return session.exec(select(Project)).count()
@@ -62,7 +77,7 @@ class ProjectService:
 			).first()
 			if existing:
 				raise ValueError("Project path already exists.")
-			db_project = Project(**project_data.model_dump())
+			db_project = Project(**project_data.model_dump(exclude_none=True))
 			session.add(db_project)
 			session.commit()
 			session.refresh(db_project)
@@ -75,6 +90,9 @@ class ProjectService:
 			id=db_project.id,
 			name=db_project.name,
 			path=db_project.path,
+			vector_store=db_project.vector_store,
+			vector_index_type=db_project.vector_index_type,
+			vector_compression=db_project.vector_compression,
 			status=status.status if status else None,
 		)
 
@@ -90,14 +108,41 @@ class ProjectService:
 			db_project.updated_at = datetime.now(timezone.utc)
 			session.commit()
 			session.refresh(db_project)
-			return ProjectSchemas.ProjectRead(
-				id=db_project.id, name=db_project.name, path=db_project.path
+			return ProjectSchemas.ProjectRead.model_validate(
+				db_project, from_attributes=True
+			)
+
+	def set_project_watch(
+		self, project_id: UUID, watch: bool
+	) -> ProjectSchemas.ProjectRead:
+		with Session(engine) as session:
+			db_project = session.get(Project, project_id)
+			if not db_project:
+				raise ValueError("Project not found.")
+
+			db_project.watch = watch
+			db_project.updated_at = datetime.now(timezone.utc)
+			session.commit()
+			session.refresh(db_project)
+			return ProjectSchemas.ProjectRead.model_validate(
+				db_project, from_attributes=True
 			)
 
 	def delete_project(self, project_id: UUID):
+		"""
+		Delete the project, its statuses, indexing jobs and symbols. Must be
+		called from the event loop, to stop the project's running job and
+		watcher.
+		"""
 		with Session(engine) as session:
 			db_project = session.get(Project, project_id)
 			if db_project:
+				# Imported here, the indices module imports this package
+				from app.modules.indices import job_runner, project_watcher
+
+				project_watcher.unwatch(project_id)
+				job_runner.delete_project_jobs(project_id)
+
 				db_project_statuses = session.exec(
 					select(ProjectStatus).where(ProjectStatus.project_id == project_id)
 				).all()
@@ -107,6 +152,14 @@ class ProjectService:
 
 				session.delete(db_project)
 				session.commit()
+				invalidate_vector_index(db_project.name)
+				delete_lexical_index(db_project.name)
+				answer_cache.invalidate(project_id)
+
+				# Imported here, the symbols module imports this package
+				from app.modules.symbols import SymbolService
+
+				SymbolService().clear(project_id)
 				return True
 			return False
 
@@ -2,6 +2,7 @@ from datetime import datetime
 from enum import Enum
 from uuid import UUID
 
+from sqlalchemy import JSON
 from sqlmodel import Field, SQLModel
 
 from app.utils import generate_timestamp, generate_uuid
@@ -12,11 +13,37 @@ class ProjectStatusEnum(str, Enum):
 	PROCESSING = "processing"
 	FAILED = "failed"
 	SUCCESS = "success"
+	CANCELLED = "cancelled"
 
 
 class ProjectStatusBase(SQLModel):
 	project_id: UUID = Field(foreign_key="project.id")
 	status: ProjectStatusEnum = Field(default=ProjectStatusEnum.QUEUE)
+	commit_sha: str | None = Field(
+		default=None, description="HEAD commit the indexing run was built from"
+	)
+	dirty_files: list[str] | None = Field(
+		default=None,
+		sa_type=JSON,
+		description="Files that differed from the commit, indexed as they were "
+		"in the working tree",
+	)
+	full_rebuild: bool = Field(
+		default=False,
+		description="Whether the run dropped the indexed collection before "
+		"re-embedding the project",
+	)
+	embedding_cache_hits: int = Field(
+		default=0, description="Chunks served from the embedding cache"
+	)
+	embedding_cache_misses: int = Field(
+		default=0, description="Chunks sent to the embedding provider"
+	)
+	stage_metrics: dict | None = Field(
+		default=None,
+		sa_type=JSON,
+		description="Files, chunks and throughput of each indexing stage",
+	)
 
 
 class ProjectStatus(ProjectStatusBase, table=True):
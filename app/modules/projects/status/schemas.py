@@ -12,6 +12,11 @@ class ProjectStatusSchema:
 		id: UUID
 		project_id: UUID
 		status: str
+		commit_sha: str | None = None
+		full_rebuild: bool = False
+		embedding_cache_hits: int = 0
+		embedding_cache_misses: int = 0
+		stage_metrics: dict | None = None
 
 	class ProjectStatusUpdate(BaseModel):
 		id: UUID
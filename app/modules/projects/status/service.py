@@ -6,7 +6,7 @@ from sqlmodel import select
 from app.database import Session, engine
 
 from ..models import Project
-from .models import ProjectStatus
+from .models import ProjectStatus, ProjectStatusEnum
 from .schemas import ProjectStatusSchema
 
 
@@ -23,10 +23,8 @@ class ProjectStatusService:
 			).first()
 			if not project_status:
 				raise ValueError("Project status not found.")
-		return ProjectStatusSchema.ProjectStatusRead(
-			id=project_status.id,
-			project_id=project_status.project_id,
-			status=project_status.status,
+		return ProjectStatusSchema.ProjectStatusRead.model_validate(
+			project_status, from_attributes=True
 		)
 
 	def get_project_status_by_project_id(
@@ -48,12 +46,62 @@ class ProjectStatusService:
 		if not project_status:
 			# raise ValueError("Project status not found.")
 			return None
-		return ProjectStatusSchema.ProjectStatusRead(
-			id=project_status.id,
-			project_id=project_status.project_id,
-			status=project_status.status,
+		return ProjectStatusSchema.ProjectStatusRead.model_validate(
+			project_status, from_attributes=True
 		)
 
+	def get_last_indexed_run(self, project_id: UUID) -> tuple[str | None, list[str]]:
+		"""
+		Return the commit SHA of the most recent successful indexing run,
+		or `None` if the project has never been indexed successfully, with
+		the files that differed from that commit when they were indexed.
+
+		A full rebuild drops the collection before re-embedding it, so while
+		the last one hasn't succeeded the index is empty or partial and
+		`None` is returned to rebuild it again.
+		"""
+		with Session(engine) as session:
+			last_rebuild = session.exec(
+				select(ProjectStatus)
+				.where(
+					ProjectStatus.project_id == project_id,
+					ProjectStatus.full_rebuild.is_(True),
+				)
+				.order_by(ProjectStatus.created_at.desc())
+			).first()
+			if last_rebuild and last_rebuild.status != ProjectStatusEnum.SUCCESS:
+				return None, []
+			project_status = session.exec(
+				select(ProjectStatus)
+				.where(
+					ProjectStatus.project_id == project_id,
+					ProjectStatus.status == ProjectStatusEnum.SUCCESS,
+					ProjectStatus.commit_sha.is_not(None),
+				)
+				.order_by(ProjectStatus.updated_at.desc())
+			).first()
+		if not project_status:
+			return None, []
+		return project_status.commit_sha, project_status.dirty_files or []
+
+	def get_index_version(self, project_id: UUID) -> str | None:
+		"""
+		Identify the index of a project: the commit and time of its last
+		successful indexing run, which changes with every re-index.
+		"""
+		with Session(engine) as session:
+			project_status = session.exec(
+				select(ProjectStatus)
+				.where(
+					ProjectStatus.project_id == project_id,
+					ProjectStatus.status == ProjectStatusEnum.SUCCESS,
+				)
+				.order_by(ProjectStatus.updated_at.desc())
+			).first()
+		if not project_status:
+			return None
+		return f"{project_status.commit_sha}@{project_status.updated_at.isoformat()}"
+
 	def create_project_status(
 		self, project_id: UUID, status: str
 	) -> ProjectStatusSchema.ProjectStatusRead:
@@ -68,27 +116,77 @@ class ProjectStatusService:
 			session.add(project_status)
 			session.commit()
 			session.refresh(project_status)
-			return ProjectStatusSchema.ProjectStatusRead(
-				id=project_status.id,
-				project_id=project_status.project_id,
-				status=project_status.status,
+			return ProjectStatusSchema.ProjectStatusRead.model_validate(
+				project_status, from_attributes=True
+			)
+
+	def mark_full_rebuild(
+		self, project_status_id: UUID
+	) -> ProjectStatusSchema.ProjectStatusRead:
+		with Session(engine) as session:
+			project_status = session.get(ProjectStatus, project_status_id)
+			if not project_status:
+				raise ValueError("Project status not found.")
+			project_status.full_rebuild = True
+			project_status.updated_at = datetime.now(timezone.utc)
+			session.commit()
+			session.refresh(project_status)
+			return ProjectStatusSchema.ProjectStatusRead.model_validate(
+				project_status, from_attributes=True
+			)
+
+	def update_embedding_cache_stats(
+		self, project_status_id: UUID, hits: int, misses: int
+	) -> ProjectStatusSchema.ProjectStatusRead:
+		with Session(engine) as session:
+			project_status = session.get(ProjectStatus, project_status_id)
+			if not project_status:
+				raise ValueError("Project status not found.")
+			project_status.embedding_cache_hits = hits
+			project_status.embedding_cache_misses = misses
+			project_status.updated_at = datetime.now(timezone.utc)
+			session.commit()
+			session.refresh(project_status)
+			return ProjectStatusSchema.ProjectStatusRead.model_validate(
+				project_status, from_attributes=True
+			)
+
+	def update_stage_metrics(
+		self, project_status_id: UUID, stage_metrics: dict
+	) -> ProjectStatusSchema.ProjectStatusRead:
+		with Session(engine) as session:
+			project_status = session.get(ProjectStatus, project_status_id)
+			if not project_status:
+				raise ValueError("Project status not found.")
+			project_status.stage_metrics = stage_metrics
+			project_status.updated_at = datetime.now(timezone.utc)
+			session.commit()
+			session.refresh(project_status)
+			return ProjectStatusSchema.ProjectStatusRead.model_validate(
+				project_status, from_attributes=True
 			)
 
 	def update_project_status(
-		self, project_status_id: UUID, status: str
+		self,
+		project_status_id: UUID,
+		status: str,
+		commit_sha: str | None = None,
+		dirty_files: list[str] | None = None,
 	) -> ProjectStatusSchema.ProjectStatusRead:
 		with Session(engine) as session:
 			project_status = session.get(ProjectStatus, project_status_id)
 			if not project_status:
 				raise ValueError("Project status not found.")
 			project_status.status = status
+			if commit_sha:
+				project_status.commit_sha = commit_sha
+			if dirty_files is not None:
+				project_status.dirty_files = dirty_files
 			project_status.updated_at = datetime.now(timezone.utc)
 			session.commit()
 			session.refresh(project_status)
-			return ProjectStatusSchema.ProjectStatusRead(
-				id=project_status.id,
-				project_id=project_status.project_id,
-				status=project_status.status,
+			return ProjectStatusSchema.ProjectStatusRead.model_validate(
+				project_status, from_attributes=True
 			)
 
 
@@ -4,8 +4,8 @@ from fastapi import HTTPException
 from pydantic import BaseModel, Field
 
 from app.modules.projects import ProjectService
-from app.shared.chroma_db import ChromaDB
 from app.shared.llms import load_llm_model
+from app.shared.vector_db import get_project_vector_index
 
 from .schemas import QuestionsSchema
 
@@ -45,8 +45,7 @@ async def generate_questions(project_id, num: int = 1) -> QuestionList:
 	project = ProjectService().get_project(id=project_id)
 	if not project:
 		raise HTTPException(status_code=404, detail="Project not found")
-	collection_name = project.name
-	collection_index = ChromaDB(collection_name).as_vector_store_index()
+	collection_index = get_project_vector_index(project)
 	query_engine = collection_index.as_query_engine(
 		llm=load_llm_model("openai"),
 		response_mode="tree_summarize",
@@ -70,8 +69,7 @@ async def generate_question(
 	project = ProjectService().get_project(id=project_id)
 	if not project:
 		raise HTTPException(status_code=404, detail="Project not found")
-	collection_name = project.name
-	collection_index = ChromaDB(collection_name).as_vector_store_index()
+	collection_index = get_project_vector_index(project)
 	query_engine = collection_index.as_query_engine(
 		llm=load_llm_model("openai"),
 		response_mode="tree_summarize",
@@ -103,8 +101,7 @@ async def evaluate_answer(project_id: str, question_str: str, answer_str: str):
 	project = ProjectService().get_project(id=project_id)
 	if not project:
 		raise HTTPException(status_code=404, detail="Project not found")
-	collection_name = project.name
-	collection_index = ChromaDB(collection_name).as_vector_store_index()
+	collection_index = get_project_vector_index(project)
 	query_engine = collection_index.as_query_engine(
 		llm=load_llm_model("openai"),
 		response_mode="tree_summarize",
@@ -131,8 +128,7 @@ async def rephrase_question(project_id: UUID, question_str: str) -> str:
 	project = ProjectService().get_project(id=project_id)
 	if not project:
 		raise HTTPException(status_code=404, detail="Project not found")
-	collection_name = project.name
-	collection_index = ChromaDB(collection_name).as_vector_store_index()
+	collection_index = get_project_vector_index(project)
 	query_engine = collection_index.as_query_engine(
 		llm=load_llm_model("openai"),
 		response_mode="tree_summarize",
@@ -0,0 +1,5 @@
+from .controller import symbol_router
+from .schemas import SymbolSchema
+from .service import SymbolService
+
+__all__ = [symbol_router, SymbolSchema, SymbolService]
@@ -0,0 +1,52 @@
+from typing import Annotated
+from uuid import UUID
+
+from fastapi import APIRouter, HTTPException, Query
+
+from app.modules.projects import ProjectService
+from app.utils import logger
+
+from .schemas import SymbolSchema
+from .service import SymbolService
+
+symbol_router = APIRouter(prefix="/project", tags=["Symbols"])
+symbol_service = SymbolService()
+
+
+@symbol_router.get("/{project_id}/symbols", response_model=SymbolSchema.SymbolList)
+def search_symbols(
+	project_id: str,
+	q: Annotated[str, Query(min_length=1)],
+	kind: str | None = None,
+	limit: Annotated[int, Query(ge=1, le=100)] = 20,
+):
+	"""
+	Find definitions by exact or qualified name, or by the prefixes of the
+	words of their name.
+	"""
+	try:
+		logger.debug(f"Searching symbols of project {project_id} for {q}")
+		ProjectService().get_project(id=UUID(project_id))
+		return symbol_service.search(
+			project_id=UUID(project_id), query=q, kind=kind, limit=limit
+		)
+	except ValueError as e:
+		raise HTTPException(status_code=404, detail=str(e))
+
+
+@symbol_router.get(
+	"/{project_id}/symbols/{name}/references",
+	response_model=SymbolSchema.SymbolReferenceList,
+)
+def get_symbol_references(
+	project_id: str,
+	name: str,
+	limit: Annotated[int, Query(ge=1, le=1000)] = 100,
+):
+	try:
+		ProjectService().get_project(id=UUID(project_id))
+		return symbol_service.get_references(
+			project_id=UUID(project_id), name=name, limit=limit
+		)
+	except ValueError as e:
+		raise HTTPException(status_code=404, detail=str(e))
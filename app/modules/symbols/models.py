@@ -0,0 +1,66 @@
+from uuid import UUID
+
+from sqlalchemy import DDL, event
+from sqlmodel import Field, SQLModel
+
+
+class SymbolBase(SQLModel):
+	project_id: UUID = Field(foreign_key="project.id", index=True)
+	file_path: str = Field(index=True)
+	name: str = Field(index=True)
+	qualified_name: str = Field(description="Name prefixed with the enclosing classes")
+	kind: str = Field(description="Tree-sitter node type of the definition")
+	language: str
+	start_line: int
+	end_line: int
+
+
+class Symbol(SymbolBase, table=True):
+	id: int | None = Field(default=None, primary_key=True)
+	tokens: str = Field(
+		description="Code tokens of the qualified name, searched by FTS"
+	)
+	run_id: UUID | None = Field(
+		default=None,
+		index=True,
+		description="Indexing run that wrote the row, until the run succeeds",
+	)
+
+
+class SymbolReference(SQLModel, table=True):
+	id: int | None = Field(default=None, primary_key=True)
+	project_id: UUID = Field(foreign_key="project.id", index=True)
+	file_path: str = Field(index=True)
+	name: str = Field(index=True, description="Name of the called symbol")
+	line: int
+	scope: str = Field(default="", description="Qualified name of the caller")
+	run_id: UUID | None = Field(
+		default=None,
+		index=True,
+		description="Indexing run that wrote the row, until the run succeeds",
+	)
+
+
+# Full-text index of the symbol names, kept in sync with the table by triggers
+for statement in (
+	"""
+	CREATE VIRTUAL TABLE IF NOT EXISTS symbol_fts USING fts5(
+		tokens, content='symbol', content_rowid='id', tokenize="unicode61 tokenchars '_'"
+	)
+	""",
+	"""
+	CREATE TRIGGER IF NOT EXISTS symbol_ai AFTER INSERT ON symbol BEGIN
+		INSERT INTO symbol_fts (rowid, tokens) VALUES (new.id, new.tokens);
+	END
+	""",
+	"""
+	CREATE TRIGGER IF NOT EXISTS symbol_ad AFTER DELETE ON symbol BEGIN
+		INSERT INTO symbol_fts (symbol_fts, rowid, tokens)
+		VALUES ('delete', old.id, old.tokens);
+	END
+	""",
+):
+	event.listen(Symbol.__table__, "after_create", DDL(statement))
+
+
+__all__ = [Symbol, SymbolBase, SymbolReference]
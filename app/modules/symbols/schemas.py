@@ -0,0 +1,31 @@
+from uuid import UUID
+
+from pydantic import BaseModel
+
+
+class SymbolSchema:
+	class SymbolRead(BaseModel):
+		id: int
+		project_id: UUID
+		file_path: str
+		name: str
+		qualified_name: str
+		kind: str
+		language: str
+		start_line: int
+		end_line: int
+
+	class SymbolList(BaseModel):
+		symbols: list["SymbolSchema.SymbolRead"] = []
+
+	class SymbolReferenceRead(BaseModel):
+		file_path: str
+		name: str
+		line: int
+		scope: str
+
+	class SymbolReferenceList(BaseModel):
+		references: list["SymbolSchema.SymbolReferenceRead"] = []
+
+
+__all__ = [SymbolSchema]
@@ -0,0 +1,281 @@
+from typing import TYPE_CHECKING
+from uuid import UUID
+
+from sqlalchemy import column, func, literal_column, or_, table
+from sqlmodel import delete, select, update
+
+from app.database import Session, engine
+from app.shared.lexical_index import code_tokens
+
+from .models import Symbol, SymbolReference
+from .schemas import SymbolSchema
+
+if TYPE_CHECKING:
+	# Imported for the annotations only, the indices package imports this one
+	from app.modules.indices.code_splitter import CodeSymbol
+
+# SQLite limits the number of host parameters of a single statement
+_SQL_BATCH_SIZE = 500
+
+symbol_fts = table("symbol_fts", column("rowid"))
+_fts = literal_column("symbol_fts")
+
+
+def to_prefix_query(text: str) -> str | None:
+	"""
+	FTS5 query matching the symbols whose name has a word starting with each
+	token of `text`, e.g. `user serv` finds `UserService`.
+	"""
+	tokens = list(dict.fromkeys(code_tokens(text)))
+	if not tokens:
+		return None
+	# Tokens only contain letters, digits and underscores
+	return " ".join(f'"{token}"*' for token in tokens)
+
+
+class SymbolService:
+	def __init__(self):
+		pass
+
+	def _delete_files(self, session: Session, project_id: UUID, file_paths: list[str]):
+		for i in range(0, len(file_paths), _SQL_BATCH_SIZE):
+			batch = file_paths[i : i + _SQL_BATCH_SIZE]
+			for model in (Symbol, SymbolReference):
+				session.exec(
+					delete(model).where(
+						model.project_id == project_id,
+						model.run_id.is_(None),
+						model.file_path.in_(batch),
+					)
+				)
+
+	def _clear(self, session: Session, project_id: UUID):
+		for model in (Symbol, SymbolReference):
+			session.exec(delete(model).where(model.project_id == project_id))
+
+	def _add_symbols(
+		self,
+		session: Session,
+		project_id: UUID,
+		symbols: dict[str, list["CodeSymbol"]],
+		run_id: UUID | None = None,
+	):
+		for file_path, file_symbols in symbols.items():
+			for symbol in file_symbols:
+				if symbol.kind == "reference":
+					session.add(
+						SymbolReference(
+							project_id=project_id,
+							file_path=file_path,
+							name=symbol.name,
+							line=symbol.start_line,
+							scope=symbol.scope,
+							run_id=run_id,
+						)
+					)
+					continue
+
+				session.add(
+					Symbol(
+						project_id=project_id,
+						file_path=file_path,
+						name=symbol.name,
+						qualified_name=symbol.qualified_name,
+						kind=symbol.kind,
+						language=symbol.language,
+						start_line=symbol.start_line,
+						end_line=symbol.end_line,
+						tokens=" ".join(code_tokens(symbol.qualified_name)),
+						run_id=run_id,
+					)
+				)
+
+	def replace_files(
+		self,
+		project_id: UUID,
+		symbols: dict[str, list["CodeSymbol"]],
+		removed_files: list[str] | None = None,
+		clear: bool = False,
+	):
+		"""
+		Store the definitions and calls extracted from files, replacing what
+		was stored for them before, in a single transaction. The symbols of
+		`removed_files` are deleted, and with `clear` every symbol of the
+		project is.
+		"""
+		with Session(engine) as session:
+			if clear:
+				self._clear(session, project_id)
+			else:
+				self._delete_files(
+					session, project_id, [*(removed_files or []), *symbols]
+				)
+			self._add_symbols(session, project_id, symbols)
+			session.commit()
+
+	def stage_files(
+		self,
+		project_id: UUID,
+		run_id: UUID,
+		symbols: dict[str, list["CodeSymbol"]],
+	):
+		"""
+		Store the symbols of a batch of files indexed by the run `run_id`.
+		They are hidden from the lookups until `commit_run` swaps them in.
+		"""
+		with Session(engine) as session:
+			self._add_symbols(session, project_id, symbols, run_id=run_id)
+			session.commit()
+
+	def commit_run(
+		self,
+		project_id: UUID,
+		run_id: UUID,
+		removed_files: list[str] | None = None,
+		clear: bool = False,
+	):
+		"""
+		Replace the symbols of the files staged by the run `run_id` with the
+		staged ones, in a single transaction. The symbols of `removed_files`
+		are deleted, and with `clear` every other symbol of the project is.
+		"""
+		with Session(engine) as session:
+			if clear:
+				for model in (Symbol, SymbolReference):
+					session.exec(
+						delete(model).where(
+							model.project_id == project_id,
+							or_(model.run_id.is_(None), model.run_id != run_id),
+						)
+					)
+			else:
+				staged_files = {
+					file_path
+					for model in (Symbol, SymbolReference)
+					for file_path in session.exec(
+						select(model.file_path)
+						.where(model.project_id == project_id, model.run_id == run_id)
+						.distinct()
+					)
+				}
+				self._delete_files(
+					session, project_id, [*(removed_files or []), *staged_files]
+				)
+			for model in (Symbol, SymbolReference):
+				session.exec(
+					update(model)
+					.where(model.project_id == project_id, model.run_id == run_id)
+					.values(run_id=None)
+				)
+			session.commit()
+
+	def discard_staged(self, project_id: UUID):
+		"""
+		Delete the symbols staged by runs that didn't succeed.
+		"""
+		with Session(engine) as session:
+			for model in (Symbol, SymbolReference):
+				session.exec(
+					delete(model).where(
+						model.project_id == project_id, model.run_id.is_not(None)
+					)
+				)
+			session.commit()
+
+	def clear(self, project_id: UUID):
+		with Session(engine) as session:
+			self._clear(session, project_id)
+			session.commit()
+
+	def find_definitions(
+		self, project_id: UUID, name: str, limit: int = 20
+	) -> list[SymbolSchema.SymbolRead]:
+		"""
+		Definitions whose name or qualified name is exactly `name`.
+		"""
+		with Session(engine) as session:
+			symbols = session.exec(
+				select(Symbol)
+				.where(
+					Symbol.project_id == project_id,
+					Symbol.run_id.is_(None),
+					or_(Symbol.qualified_name == name, Symbol.name == name),
+				)
+				.order_by(Symbol.file_path, Symbol.start_line)
+				.limit(limit)
+			).all()
+			return [
+				SymbolSchema.SymbolRead.model_validate(s, from_attributes=True)
+				for s in symbols
+			]
+
+	def search(
+		self,
+		project_id: UUID,
+		query: str,
+		kind: str | None = None,
+		limit: int = 20,
+	) -> SymbolSchema.SymbolList:
+		"""
+		Exact matches of `query` first, then the definitions matching its
+		words as prefixes ranked by BM25.
+		"""
+		exact = [
+			symbol
+			for symbol in self.find_definitions(project_id, query, limit)
+			if kind is None or symbol.kind == kind
+		]
+		match_query = to_prefix_query(query)
+		if match_query is None or len(exact) >= limit:
+			return SymbolSchema.SymbolList(symbols=exact)
+
+		with Session(engine) as session:
+			statement = (
+				select(Symbol)
+				.join(symbol_fts, symbol_fts.c.rowid == Symbol.id)
+				.where(
+					_fts.op("MATCH")(match_query),
+					Symbol.project_id == project_id,
+					Symbol.run_id.is_(None),
+					Symbol.id.not_in([symbol.id for symbol in exact]),
+				)
+				.order_by(func.bm25(_fts))
+				.limit(limit - len(exact))
+			)
+			if kind is not None:
+				statement = statement.where(Symbol.kind == kind)
+			matches = [
+				SymbolSchema.SymbolRead.model_validate(s, from_attributes=True)
+				for s in session.exec(statement).all()
+			]
+		return SymbolSchema.SymbolList(symbols=exact + matches)
+
+	def get_references(
+		self, project_id: UUID, name: str, limit: int = 100
+	) -> SymbolSchema.SymbolReferenceList:
+		"""
+		Calls of `name`, given as a plain or a qualified name.
+		"""
+		name = name.rsplit(".", 1)[-1]
+		with Session(engine) as session:
+			references = session.exec(
+				select(SymbolReference)
+				.where(
+					SymbolReference.project_id == project_id,
+					SymbolReference.run_id.is_(None),
+					SymbolReference.name == name,
+				)
+				.order_by(SymbolReference.file_path, SymbolReference.line)
+				.limit(limit)
+			).all()
+			return SymbolSchema.SymbolReferenceList(
+				references=[
+					SymbolSchema.SymbolReferenceRead.model_validate(
+						r, from_attributes=True
+					)
+					for r in references
+				]
+			)
+
+
+__all__ = [SymbolService]
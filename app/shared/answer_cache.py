@@ -0,0 +1,138 @@
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from uuid import UUID
+
+import numpy as np
+
+from app.config import (
+	ANSWER_CACHE_MAX_ENTRIES,
+	ANSWER_CACHE_SIMILARITY,
+	ANSWER_CACHE_TTL_SECONDS,
+)
+
+
+@dataclass
+class CachedAnswer:
+	query: str
+	answer: str
+	similarity: float
+	age_seconds: float
+
+
+@dataclass
+class _Entry:
+	project_id: UUID
+	version: str
+	query: str
+	embedding: np.ndarray
+	answer: str
+	created_at: float
+
+
+class AnswerCache:
+	"""
+	In-memory cache of chat answers, matched by the cosine similarity of the
+	query embeddings.
+
+	Entries belong to a project and to the index version that answered them,
+	so answers of a previous index are never returned. Entries expire after
+	`ttl_seconds` and the least recently used are evicted past `max_entries`.
+	"""
+
+	def __init__(
+		self,
+		max_entries: int = ANSWER_CACHE_MAX_ENTRIES,
+		ttl_seconds: float = ANSWER_CACHE_TTL_SECONDS,
+		threshold: float = ANSWER_CACHE_SIMILARITY,
+	):
+		self.max_entries = max_entries
+		self.ttl_seconds = ttl_seconds
+		self.threshold = threshold
+		self.hits = 0
+		self.misses = 0
+		self._lock = threading.Lock()
+		self._entries: OrderedDict[tuple[UUID, str, str], _Entry] = OrderedDict()
+
+	@staticmethod
+	def _normalize(embedding: list[float]) -> np.ndarray:
+		vector = np.asarray(embedding, dtype="float32")
+		norm = np.linalg.norm(vector)
+		return vector / norm if norm else vector
+
+	def _remove_stale(self, project_id: UUID, version: str, now: float):
+		for key in [
+			key
+			for key, entry in self._entries.items()
+			if now - entry.created_at > self.ttl_seconds
+			or (entry.project_id == project_id and entry.version != version)
+		]:
+			del self._entries[key]
+
+	def get(
+		self, project_id: UUID, version: str, embedding: list[float]
+	) -> CachedAnswer | None:
+		now = time.time()
+		query = self._normalize(embedding)
+		with self._lock:
+			self._remove_stale(project_id, version, now)
+			candidates = [
+				(key, entry)
+				for key, entry in self._entries.items()
+				if entry.project_id == project_id
+			]
+			if candidates:
+				similarities = (
+					np.stack([entry.embedding for _, entry in candidates]) @ query
+				)
+				best = int(np.argmax(similarities))
+				if similarities[best] >= self.threshold:
+					key, entry = candidates[best]
+					self._entries.move_to_end(key)
+					self.hits += 1
+					return CachedAnswer(
+						query=entry.query,
+						answer=entry.answer,
+						similarity=float(similarities[best]),
+						age_seconds=now - entry.created_at,
+					)
+			self.misses += 1
+			return None
+
+	def put(
+		self,
+		project_id: UUID,
+		version: str,
+		query: str,
+		embedding: list[float],
+		answer: str,
+	):
+		if self.max_entries <= 0:
+			return
+		key = (project_id, version, query.strip())
+		with self._lock:
+			self._entries[key] = _Entry(
+				project_id=project_id,
+				version=version,
+				query=query,
+				embedding=self._normalize(embedding),
+				answer=answer,
+				created_at=time.time(),
+			)
+			self._entries.move_to_end(key)
+			while len(self._entries) > self.max_entries:
+				self._entries.popitem(last=False)
+
+	def invalidate(self, project_id: UUID):
+		"""
+		Drop the answers of a project, after it has been re-indexed or deleted.
+		"""
+		with self._lock:
+			for key in [key for key in self._entries if key[0] == project_id]:
+				del self._entries[key]
+
+
+answer_cache = AnswerCache()
+
+__all__ = ["AnswerCache", "CachedAnswer", "answer_cache"]
@@ -1,3 +1,5 @@
+import threading
+
 import chromadb
 from chromadb.config import Settings as ChromaDbSettings
 from llama_index.core.indices import VectorStoreIndex
@@ -8,15 +10,29 @@ from app.config import (
 	ROOT_PATH,
 )
 
+_clients: dict[bool, chromadb.ClientAPI] = {}
+_clients_lock = threading.Lock()
+
+
+def get_chroma_client(allow_reset: bool = False) -> chromadb.ClientAPI:
+	"""
+	Return the Chroma client of the process, created on first use and shared
+	by every collection.
+	"""
+	with _clients_lock:
+		if allow_reset not in _clients:
+			allow_reset_str = "True" if allow_reset else "False"
+			_clients[allow_reset] = chromadb.PersistentClient(
+				path=ROOT_PATH + CHROMA_DB_PATH,
+				settings=ChromaDbSettings(allow_reset=allow_reset_str),
+			)
+		return _clients[allow_reset]
+
 
 class ChromaDB:
 	def __init__(self, name: str, allow_reset: bool = False):
-		allow_reset_str = "True" if allow_reset else "False"
 		self.collection_name = name
-		path = ROOT_PATH + CHROMA_DB_PATH
-		self.client = chromadb.PersistentClient(
-			path=path, settings=ChromaDbSettings(allow_reset=allow_reset_str)
-		)
+		self.client = get_chroma_client(allow_reset=allow_reset)
 
 	def get_collection(self):
 		return self.client.get_or_create_collection(
@@ -28,6 +44,27 @@ class ChromaDB:
 		if collection:
 			self.client.delete_collection(self.collection_name)
 
+	def delete_files(self, file_paths: list[str]):
+		"""
+		Delete every node that was built from one of `file_paths`
+		(matched on the `file_path` metadata of the node).
+		"""
+		if not file_paths:
+			return
+		collection = self.get_collection()
+		collection.delete(where={"file_path": {"$in": file_paths}})
+
+	def persist(self):
+		"""
+		Chroma persists every write itself.
+		"""
+
+	def close(self):
+		"""
+		Nothing to close or roll back, the client is shared and Chroma
+		persists every write itself.
+		"""
+
 	def as_vector_store(self):
 		chroma_collection = self.get_collection()
 		vector_store = ChromaVectorStore(
@@ -1,29 +1,44 @@
+from functools import lru_cache
+
+from llama_index.core.base.embeddings.base import BaseEmbedding
 from llama_index.embeddings.ollama import OllamaEmbedding
 from llama_index.embeddings.openai import OpenAIEmbedding
 
 from app.config import (
+	EMBEDDING_CACHE_ENABLED,
 	EMBEDDING_MODEL,
-	LLM_PROVIDER,
+	EMBEDDING_PROVIDER,
 	LLM_PROVIDER_API_KEY,
 	LLM_PROVIDER_BASE_URL,
+	LOCAL_EMBEDDING_MODEL,
 )
+from app.shared.embedding_cache import CachedEmbedding
+from app.shared.embedding_dispatcher import EmbeddingDispatcher
 from app.utils import logger
 
 
-def load_embedding_model(provider: str | None = None):
-	_provider = provider or LLM_PROVIDER
+def load_embedding_model(
+	provider: str | None = None, use_cache: bool = EMBEDDING_CACHE_ENABLED
+):
+	_provider = provider or EMBEDDING_PROVIDER
 
 	logger.info(_provider)
-	logger.debug(f"Embed_model: {EMBEDDING_MODEL}")
 
 	try:
 		match _provider:
 			case "openai":
-				model = init_openai_embed()
+				logger.debug(f"Embed_model: {EMBEDDING_MODEL}")
+				model = EmbeddingDispatcher(init_openai_embed())
 			case "ollama":
-				model = init_ollama_embed()
+				logger.debug(f"Embed_model: {EMBEDDING_MODEL}")
+				model = EmbeddingDispatcher(init_ollama_embed())
+			case "local":
+				logger.debug(f"Embed_model: {LOCAL_EMBEDDING_MODEL}")
+				model = init_local_embed()
 			case _:
-				raise ValueError(f"Invalid model provider: {LLM_PROVIDER}")
+				raise ValueError(f"Invalid model provider: {_provider}")
+		if use_cache:
+			model = CachedEmbedding(model)
 		return model
 	except Exception as e:
 		logger.error(e)
@@ -31,8 +46,9 @@ def load_embedding_model(provider: str | None = None):
 
 
 def init_openai_embed():
+	# Retries are handled by the EmbeddingDispatcher
 	embed_model = OpenAIEmbedding(
-		api_key=LLM_PROVIDER_API_KEY, model_name=EMBEDDING_MODEL
+		api_key=LLM_PROVIDER_API_KEY, model_name=EMBEDDING_MODEL, max_retries=0
 	)
 
 	return embed_model
@@ -44,7 +60,15 @@ def init_ollama_embed():
 	embed_model = OllamaEmbedding(
 		base_url=BASE_URL,
 		model_name=EMBEDDING_MODEL,
-		# embed_batch_size=50,
 	)
 
 	return embed_model
+
+
+@lru_cache
+def init_local_embed() -> BaseEmbedding:
+	# Loading the model is slow and it holds its weights in memory, so a
+	# single instance is shared by every caller
+	from app.shared.local_embedding import LocalEmbedding
+
+	return LocalEmbedding()
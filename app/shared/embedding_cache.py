@@ -0,0 +1,277 @@
+import asyncio
+import hashlib
+import sqlite3
+import threading
+import time
+from array import array
+from pathlib import Path
+
+from llama_index.core.base.embeddings.base import BaseEmbedding, Embedding
+from pydantic import PrivateAttr
+
+from app.config import EMBEDDING_CACHE_PATH, EMBEDDING_CACHE_SIZE_MB, ROOT_PATH
+from app.shared.embedding_dispatcher import EmbeddingDispatcher, aget_query_embeddings
+from app.utils import logger
+
+# SQLite limits the number of host parameters of a single statement
+_SQL_BATCH_SIZE = 500
+
+
+class EmbeddingCache:
+	"""
+	Persistent, content-addressed embedding cache.
+
+	Embeddings are keyed by the embedding model and the hash of the text, so
+	identical chunks are shared across projects and branches. The cache is
+	bounded by `max_bytes` and evicts the least recently used entries.
+	"""
+
+	def __init__(self, path: str, max_bytes: int):
+		Path(path).parent.mkdir(parents=True, exist_ok=True)
+		self.max_bytes = max_bytes
+		self._lock = threading.Lock()
+		self._conn = sqlite3.connect(path, check_same_thread=False)
+		self._conn.execute("PRAGMA journal_mode=WAL")
+		self._conn.execute(
+			"""
+			CREATE TABLE IF NOT EXISTS embeddings (
+				key TEXT PRIMARY KEY,
+				model TEXT NOT NULL,
+				embedding BLOB NOT NULL,
+				size INTEGER NOT NULL,
+				accessed_at REAL NOT NULL
+			)
+			"""
+		)
+		self._conn.execute(
+			"CREATE INDEX IF NOT EXISTS ix_embeddings_accessed_at "
+			"ON embeddings (accessed_at)"
+		)
+		self._conn.commit()
+		self._size = self._conn.execute(
+			"SELECT COALESCE(SUM(size), 0) FROM embeddings"
+		).fetchone()[0]
+
+	@staticmethod
+	def make_key(model: str, text: str) -> str:
+		return hashlib.sha256(f"{model}\0{text}".encode()).hexdigest()
+
+	def get_many(self, model: str, texts: list[str]) -> list[Embedding | None]:
+		keys = [self.make_key(model, text) for text in texts]
+		found: dict[str, Embedding] = {}
+
+		with self._lock:
+			for i in range(0, len(keys), _SQL_BATCH_SIZE):
+				batch = keys[i : i + _SQL_BATCH_SIZE]
+				placeholders = ",".join("?" * len(batch))
+				rows = self._conn.execute(
+					f"SELECT key, embedding FROM embeddings WHERE key IN ({placeholders})",
+					batch,
+				).fetchall()
+				for key, blob in rows:
+					found[key] = array("f", blob).tolist()
+
+				hit_keys = [key for key in batch if key in found]
+				if hit_keys:
+					self._conn.execute(
+						f"UPDATE embeddings SET accessed_at = ? "
+						f"WHERE key IN ({','.join('?' * len(hit_keys))})",
+						[time.time(), *hit_keys],
+					)
+			self._conn.commit()
+
+		return [found.get(key) for key in keys]
+
+	def put_many(self, model: str, texts: list[str], embeddings: list[Embedding]):
+		now = time.time()
+		rows = {}
+		for text, embedding in zip(texts, embeddings, strict=True):
+			key = self.make_key(model, text)
+			blob = array("f", embedding).tobytes()
+			rows[key] = (key, model, blob, len(blob), now)
+		rows = list(rows.values())
+
+		with self._lock:
+			for key, *_ in rows:
+				previous = self._conn.execute(
+					"SELECT size FROM embeddings WHERE key = ?", (key,)
+				).fetchone()
+				if previous:
+					self._size -= previous[0]
+			self._conn.executemany(
+				"INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?, ?)", rows
+			)
+			self._size += sum(row[3] for row in rows)
+			if self._size > self.max_bytes:
+				self._evict()
+			self._conn.commit()
+
+	def _evict(self):
+		# Evict down to 90% of the limit so that we don't evict on every insert
+		target = int(self.max_bytes * 0.9)
+		keys = []
+		cursor = self._conn.execute(
+			"SELECT key, size FROM embeddings ORDER BY accessed_at"
+		)
+		for key, size in cursor:
+			if self._size <= target:
+				break
+			keys.append(key)
+			self._size -= size
+		cursor.close()
+
+		for i in range(0, len(keys), _SQL_BATCH_SIZE):
+			batch = keys[i : i + _SQL_BATCH_SIZE]
+			self._conn.execute(
+				f"DELETE FROM embeddings WHERE key IN ({','.join('?' * len(batch))})",
+				batch,
+			)
+		logger.debug(f"Evicted {len(keys)} embeddings from the cache")
+
+
+_cache: EmbeddingCache | None = None
+_cache_lock = threading.Lock()
+
+
+def get_embedding_cache() -> EmbeddingCache:
+	global _cache
+	with _cache_lock:
+		if _cache is None:
+			_cache = EmbeddingCache(
+				path=ROOT_PATH + EMBEDDING_CACHE_PATH,
+				max_bytes=EMBEDDING_CACHE_SIZE_MB * 1024 * 1024,
+			)
+		return _cache
+
+
+class CachedEmbedding(BaseEmbedding):
+	"""
+	Embedding model wrapper that consults the `EmbeddingCache` before calling
+	the wrapped provider. Only the texts missing from the cache are sent to
+	the provider; `hits` and `misses` count the texts of each kind.
+	"""
+
+	_embed_model: BaseEmbedding = PrivateAttr()
+	_cache: EmbeddingCache = PrivateAttr()
+	_model_key: str = PrivateAttr()
+	_hits: int = PrivateAttr(default=0)
+	_misses: int = PrivateAttr(default=0)
+
+	def __init__(
+		self,
+		embed_model: BaseEmbedding,
+		cache: EmbeddingCache | None = None,
+		**kwargs,
+	):
+		super().__init__(
+			model_name=embed_model.model_name,
+			embed_batch_size=embed_model.embed_batch_size,
+			**kwargs,
+		)
+		self._embed_model = embed_model
+		self._cache = cache or get_embedding_cache()
+
+		# Key the cache by the provider, whatever the dispatching in between.
+		# Providers whose settings change the vectors define their own key.
+		provider = embed_model
+		while isinstance(provider, EmbeddingDispatcher):
+			provider = provider.embed_model
+		self._model_key = getattr(
+			provider, "cache_key", f"{provider.class_name()}:{provider.model_name}"
+		)
+
+	@classmethod
+	def class_name(cls) -> str:
+		return "CachedEmbedding"
+
+	@property
+	def hits(self) -> int:
+		return self._hits
+
+	@property
+	def misses(self) -> int:
+		return self._misses
+
+	def _lookup(self, model: str, texts: list[str]):
+		embeddings = self._cache.get_many(model, texts)
+		missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+		self._hits += len(texts) - len(missing)
+		self._misses += len(missing)
+		return embeddings, missing
+
+	def _store(
+		self,
+		model: str,
+		texts: list[str],
+		embeddings: list[Embedding | None],
+		missing: list[int],
+		new_embeddings: list[Embedding],
+	) -> list[Embedding]:
+		for i, embedding in zip(missing, new_embeddings, strict=True):
+			embeddings[i] = embedding
+		self._cache.put_many(model, [texts[i] for i in missing], new_embeddings)
+		return embeddings
+
+	def _get_text_embeddings(self, texts: list[str]) -> list[Embedding]:
+		embeddings, missing = self._lookup(self._model_key, texts)
+		if not missing:
+			return embeddings
+		new_embeddings = self._embed_model.get_text_embedding_batch(
+			[texts[i] for i in missing]
+		)
+		return self._store(self._model_key, texts, embeddings, missing, new_embeddings)
+
+	async def _aget_text_embeddings(self, texts: list[str]) -> list[Embedding]:
+		embeddings, missing = await asyncio.to_thread(
+			self._lookup, self._model_key, texts
+		)
+		if not missing:
+			return embeddings
+		new_embeddings = await self._embed_model.aget_text_embedding_batch(
+			[texts[i] for i in missing]
+		)
+		return await asyncio.to_thread(
+			self._store, self._model_key, texts, embeddings, missing, new_embeddings
+		)
+
+	def _get_text_embedding(self, text: str) -> Embedding:
+		return self._get_text_embeddings([text])[0]
+
+	async def _aget_text_embedding(self, text: str) -> Embedding:
+		return (await self._aget_text_embeddings([text]))[0]
+
+	def _get_query_embedding(self, query: str) -> Embedding:
+		# Query embeddings may use a different prompt than text embeddings
+		model = f"{self._model_key}:query"
+		embeddings, missing = self._lookup(model, [query])
+		if not missing:
+			return embeddings[0]
+		embedding = self._embed_model.get_query_embedding(query)
+		return self._store(model, [query], embeddings, missing, [embedding])[0]
+
+	async def _aget_query_embedding(self, query: str) -> Embedding:
+		model = f"{self._model_key}:query"
+		embeddings, missing = await asyncio.to_thread(self._lookup, model, [query])
+		if not missing:
+			return embeddings[0]
+		embedding = await self._embed_model.aget_query_embedding(query)
+		return (
+			await asyncio.to_thread(
+				self._store, model, [query], embeddings, missing, [embedding]
+			)
+		)[0]
+
+	async def aget_query_embeddings(self, queries: list[str]) -> list[Embedding]:
+		model = f"{self._model_key}:query"
+		embeddings, missing = await asyncio.to_thread(self._lookup, model, queries)
+		if not missing:
+			return embeddings
+		new_embeddings = await aget_query_embeddings(
+			self._embed_model, [queries[i] for i in missing]
+		)
+		return await asyncio.to_thread(
+			self._store, model, queries, embeddings, missing, new_embeddings
+		)
+
+
+__all__ = ["EmbeddingCache", "CachedEmbedding", "get_embedding_cache"]
@@ -0,0 +1,367 @@
+import asyncio
+import random
+import threading
+import time
+import weakref
+from collections import deque
+
+from llama_index.core.base.embeddings.base import BaseEmbedding, Embedding
+from llama_index.core.utils import get_tokenizer
+from pydantic import PrivateAttr
+
+from app.config import (
+	EMBEDDING_CONCURRENCY,
+	EMBEDDING_MAX_BATCH_SIZE,
+	EMBEDDING_MAX_BATCH_TOKENS,
+	EMBEDDING_MAX_RETRIES,
+	EMBEDDING_RETRY_BACKOFF,
+	EMBEDDING_RPM,
+	EMBEDDING_TPM,
+)
+from app.shared.metrics import EMBEDDING_REQUEST_SECONDS, record_embedding, timed
+from app.utils import logger
+
+# Maximum inputs and tokens of a single embedding request, by provider
+PROVIDER_LIMITS: dict[str, tuple[int, int]] = {
+	"OpenAIEmbedding": (2048, 300_000),
+	"OllamaEmbedding": (256, 65_536),
+}
+DEFAULT_LIMITS = (256, 65_536)
+# Providers embedding queries like texts, their queries can be batched
+_SYMMETRIC_PROVIDERS = {"OpenAIEmbedding", "OllamaEmbedding"}
+
+# The largest batch `BaseEmbedding` accepts; the dispatcher re-packs them
+_MAX_EMBED_BATCH_SIZE = 2048
+_RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+_RETRYABLE_ERRORS = {
+	"APIConnectionError",
+	"APITimeoutError",
+	"ConnectError",
+	"ConnectTimeout",
+	"ReadTimeout",
+	"RemoteProtocolError",
+}
+_MAX_BACKOFF = 60.0
+
+
+class RateLimiter:
+	"""
+	Requests and tokens per minute budget over a sliding window, shared by
+	every embedding model of the same provider and model name.
+
+	`reserve()` records the request if it fits in the budget, otherwise it
+	returns how long to wait before trying again, so the same limiter serves
+	both the sync and the async code paths.
+	"""
+
+	def __init__(self, rpm: int = 0, tpm: int = 0, concurrency: int = 1):
+		self.rpm = rpm
+		self.tpm = tpm
+		self.concurrency = max(concurrency, 1)
+		self._lock = threading.Lock()
+		self._window: deque[tuple[float, int]] = deque()
+		self._tokens = 0
+		self._paused_until = 0.0
+		self._semaphores: weakref.WeakKeyDictionary[
+			asyncio.AbstractEventLoop, asyncio.Semaphore
+		] = weakref.WeakKeyDictionary()
+
+	@property
+	def semaphore(self) -> asyncio.Semaphore:
+		# A semaphore only works on the loop it was first used on, and the
+		# limiter outlives the loops of `asyncio.run` (benchmarks, CLI)
+		loop = asyncio.get_running_loop()
+		with self._lock:
+			semaphore = self._semaphores.get(loop)
+			if semaphore is None:
+				semaphore = asyncio.Semaphore(self.concurrency)
+				self._semaphores[loop] = semaphore
+			return semaphore
+
+	def reserve(self, tokens: int) -> float:
+		with self._lock:
+			now = time.monotonic()
+			if now < self._paused_until:
+				return self._paused_until - now
+
+			while self._window and now - self._window[0][0] >= 60:
+				self._tokens -= self._window.popleft()[1]
+
+			over_rpm = self.rpm and len(self._window) + 1 > self.rpm
+			# A request larger than the whole budget is let through alone
+			over_tpm = self.tpm and self._window and self._tokens + tokens > self.tpm
+			if over_rpm or over_tpm:
+				return max(60 - (now - self._window[0][0]), 0.01)
+
+			self._window.append((now, tokens))
+			self._tokens += tokens
+			return 0.0
+
+	def pause(self, seconds: float):
+		"""
+		Hold every request back, used when the provider answers with 429.
+		"""
+		with self._lock:
+			self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+	def acquire(self, tokens: int):
+		while (wait := self.reserve(tokens)) > 0:
+			time.sleep(wait)
+
+	async def aacquire(self, tokens: int):
+		while (wait := self.reserve(tokens)) > 0:
+			await asyncio.sleep(wait)
+
+
+_limiters: dict[str, RateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(model_key: str) -> RateLimiter:
+	with _limiters_lock:
+		if model_key not in _limiters:
+			_limiters[model_key] = RateLimiter(
+				rpm=EMBEDDING_RPM, tpm=EMBEDDING_TPM, concurrency=EMBEDDING_CONCURRENCY
+			)
+		return _limiters[model_key]
+
+
+def _unwrap_error(error: BaseException) -> BaseException:
+	# tenacity wraps the last error of its retries
+	last_attempt = getattr(error, "last_attempt", None)
+	if last_attempt is not None and last_attempt.exception() is not None:
+		return last_attempt.exception()
+	return error
+
+
+def _status_code(error: BaseException) -> int | None:
+	for source in (error, getattr(error, "response", None)):
+		code = getattr(source, "status_code", None)
+		if isinstance(code, int):
+			return code
+	return None
+
+
+def _retry_after(error: BaseException) -> float | None:
+	headers = getattr(getattr(error, "response", None), "headers", None) or {}
+	try:
+		return float(headers.get("retry-after"))
+	except (TypeError, ValueError):
+		return None
+
+
+def get_retry_delay(error: BaseException, attempt: int) -> tuple[float, bool] | None:
+	"""
+	Return the delay before retrying a failed request and whether the
+	provider rate limited it, or None when the error is not transient.
+	"""
+	error = _unwrap_error(error)
+	status_code = _status_code(error)
+	if status_code is not None:
+		if status_code not in _RETRYABLE_STATUS_CODES:
+			return None
+	elif not isinstance(error, TimeoutError | ConnectionError) and (
+		type(error).__name__ not in _RETRYABLE_ERRORS
+	):
+		return None
+
+	delay = _retry_after(error)
+	if delay is None:
+		delay = min(EMBEDDING_RETRY_BACKOFF * 2**attempt, _MAX_BACKOFF)
+		delay *= 1 + random.random() / 4
+	return delay, status_code == 429
+
+
+class EmbeddingDispatcher(BaseEmbedding):
+	"""
+	Embedding model wrapper that packs texts into requests by token count,
+	up to the limits of the provider, and keeps up to `concurrency` requests
+	in flight.
+
+	Requests go through the `RateLimiter` of the model, and transient errors
+	are retried with an exponential backoff. A 429 response pauses every
+	request to the model, not only the one that was rejected.
+	"""
+
+	max_batch_size: int
+	max_batch_tokens: int
+	max_retries: int
+
+	_embed_model: BaseEmbedding = PrivateAttr()
+	_limiter: RateLimiter = PrivateAttr()
+
+	def __init__(
+		self,
+		embed_model: BaseEmbedding,
+		max_batch_size: int = EMBEDDING_MAX_BATCH_SIZE,
+		max_batch_tokens: int = EMBEDDING_MAX_BATCH_TOKENS,
+		max_retries: int = EMBEDDING_MAX_RETRIES,
+		limiter: RateLimiter | None = None,
+		**kwargs,
+	):
+		default_size, default_tokens = PROVIDER_LIMITS.get(
+			embed_model.class_name(), DEFAULT_LIMITS
+		)
+		super().__init__(
+			model_name=embed_model.model_name,
+			embed_batch_size=_MAX_EMBED_BATCH_SIZE,
+			max_batch_size=max_batch_size or default_size,
+			max_batch_tokens=max_batch_tokens or default_tokens,
+			max_retries=max_retries,
+			**kwargs,
+		)
+		self._embed_model = embed_model
+		self._limiter = limiter or get_rate_limiter(
+			f"{embed_model.class_name()}:{embed_model.model_name}"
+		)
+
+	@classmethod
+	def class_name(cls) -> str:
+		return "EmbeddingDispatcher"
+
+	@property
+	def embed_model(self) -> BaseEmbedding:
+		return self._embed_model
+
+	def pack(self, texts: list[str]) -> list[tuple[list[int], int]]:
+		"""
+		Group the indices of `texts` into batches of at most `max_batch_size`
+		texts and `max_batch_tokens` tokens. Returns the batches with their
+		token count.
+		"""
+		tokenizer = get_tokenizer()
+		batches: list[tuple[list[int], int]] = []
+		batch: list[int] = []
+		batch_tokens = 0
+		for i, text in enumerate(texts):
+			tokens = len(tokenizer(text))
+			if batch and (
+				len(batch) >= self.max_batch_size
+				or batch_tokens + tokens > self.max_batch_tokens
+			):
+				batches.append((batch, batch_tokens))
+				batch, batch_tokens = [], 0
+			batch.append(i)
+			batch_tokens += tokens
+		if batch:
+			batches.append((batch, batch_tokens))
+		return batches
+
+	def _on_error(self, error: Exception, attempt: int) -> float:
+		retry = get_retry_delay(error, attempt) if attempt < self.max_retries else None
+		if retry is None:
+			raise error
+		delay, rate_limited = retry
+		if rate_limited:
+			self._limiter.pause(delay)
+		logger.warning(
+			f"Embedding request failed ({error}), retrying in {delay:.1f}s "
+			f"({attempt + 1}/{self.max_retries})"
+		)
+		return delay
+
+	def _embed_batch(self, texts: list[str], tokens: int) -> list[Embedding]:
+		attempt = 0
+		while True:
+			self._limiter.acquire(tokens)
+			try:
+				# The provider hook sends the whole batch as a single request
+				with timed(EMBEDDING_REQUEST_SECONDS, model=self.model_name):
+					embeddings = self._embed_model._get_text_embeddings(texts)
+				record_embedding(self.model_name, len(texts), tokens)
+				return embeddings
+			except Exception as e:
+				time.sleep(self._on_error(e, attempt))
+				attempt += 1
+
+	async def _aembed_batch(self, texts: list[str], tokens: int) -> list[Embedding]:
+		attempt = 0
+		while True:
+			async with self._limiter.semaphore:
+				await self._limiter.aacquire(tokens)
+				try:
+					with timed(EMBEDDING_REQUEST_SECONDS, model=self.model_name):
+						embeddings = await self._embed_model._aget_text_embeddings(
+							texts
+						)
+					record_embedding(self.model_name, len(texts), tokens)
+					return embeddings
+				except Exception as e:
+					delay = self._on_error(e, attempt)
+			await asyncio.sleep(delay)
+			attempt += 1
+
+	def _get_text_embeddings(self, texts: list[str]) -> list[Embedding]:
+		embeddings: list[Embedding] = [None] * len(texts)
+		for batch, tokens in self.pack(texts):
+			results = self._embed_batch([texts[i] for i in batch], tokens)
+			for i, embedding in zip(batch, results, strict=True):
+				embeddings[i] = embedding
+		return embeddings
+
+	async def _aget_text_embeddings(self, texts: list[str]) -> list[Embedding]:
+		batches = self.pack(texts)
+		results = await asyncio.gather(
+			*(
+				self._aembed_batch([texts[i] for i in batch], tokens)
+				for batch, tokens in batches
+			)
+		)
+		embeddings: list[Embedding] = [None] * len(texts)
+		for (batch, _), batch_embeddings in zip(batches, results, strict=True):
+			for i, embedding in zip(batch, batch_embeddings, strict=True):
+				embeddings[i] = embedding
+		return embeddings
+
+	def _get_text_embedding(self, text: str) -> Embedding:
+		return self._get_text_embeddings([text])[0]
+
+	async def _aget_text_embedding(self, text: str) -> Embedding:
+		return (await self._aget_text_embeddings([text]))[0]
+
+	def _get_query_embedding(self, query: str) -> Embedding:
+		# Query embeddings may use a different prompt than text embeddings
+		tokens = len(get_tokenizer()(query))
+		self._limiter.acquire(tokens)
+		with timed(EMBEDDING_REQUEST_SECONDS, model=self.model_name):
+			embedding = self._embed_model.get_query_embedding(query)
+		record_embedding(self.model_name, 1, tokens)
+		return embedding
+
+	async def _aget_query_embedding(self, query: str) -> Embedding:
+		tokens = len(get_tokenizer()(query))
+		await self._limiter.aacquire(tokens)
+		with timed(EMBEDDING_REQUEST_SECONDS, model=self.model_name):
+			embedding = await self._embed_model.aget_query_embedding(query)
+		record_embedding(self.model_name, 1, tokens)
+		return embedding
+
+	async def aget_query_embeddings(self, queries: list[str]) -> list[Embedding]:
+		if self._embed_model.class_name() in _SYMMETRIC_PROVIDERS:
+			return await self.aget_text_embedding_batch(queries)
+		return list(
+			await asyncio.gather(*(self.aget_query_embedding(q) for q in queries))
+		)
+
+
+async def aget_query_embeddings(
+	embed_model: BaseEmbedding, queries: list[str]
+) -> list[Embedding]:
+	"""
+	Embed several queries, in as few requests as the model allows. Models
+	without an `aget_query_embeddings` method embed them one by one,
+	concurrently.
+	"""
+	if hasattr(embed_model, "aget_query_embeddings"):
+		return await embed_model.aget_query_embeddings(queries)
+	return list(
+		await asyncio.gather(*(embed_model.aget_query_embedding(q) for q in queries))
+	)
+
+
+__all__ = [
+	"EmbeddingDispatcher",
+	"RateLimiter",
+	"aget_query_embeddings",
+	"get_rate_limiter",
+]
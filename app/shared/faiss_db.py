@@ -0,0 +1,671 @@
+import asyncio
+import json
+import os
+import re
+import shutil
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Any
+
+import faiss
+import numpy as np
+from llama_index.core.indices import VectorStoreIndex
+from llama_index.core.schema import BaseNode
+from llama_index.core.vector_stores.simple import _build_metadata_filter_fn
+from llama_index.core.vector_stores.types import (
+	BasePydanticVectorStore,
+	MetadataFilters,
+	VectorStoreQuery,
+	VectorStoreQueryResult,
+)
+from llama_index.core.vector_stores.utils import (
+	metadata_dict_to_node,
+	node_to_metadata_dict,
+)
+from pydantic import PrivateAttr
+
+from app.config import (
+	FAISS_COMPRESSION,
+	FAISS_DB_PATH,
+	FAISS_HNSW_EF_CONSTRUCTION,
+	FAISS_HNSW_EF_SEARCH,
+	FAISS_HNSW_M,
+	FAISS_INDEX_TYPE,
+	FAISS_IVF_NLIST,
+	FAISS_IVF_NPROBE,
+	FAISS_PQ_M,
+	FAISS_RESCORE_FACTOR,
+	ROOT_PATH,
+)
+from app.utils import logger
+
+INDEX_FILE = "index.faiss"
+PAYLOAD_FILE = "payloads.db"
+# Deleted vectors an index that can't remove them (HNSW) keeps, as a share
+# of its size, before it is rebuilt
+COMPACT_RATIO = 0.2
+# Results fetched per requested result when some have to be filtered out
+OVERFETCH = 4
+# SQLite limits the number of host parameters of a single statement
+_SQL_BATCH_SIZE = 500
+# faiss needs about 39 training vectors per centroid
+_MIN_POINTS_PER_CENTROID = 39
+
+
+def _ivf_nlist(count: int) -> int:
+	if FAISS_IVF_NLIST:
+		return FAISS_IVF_NLIST
+	return max(1, min(int(4 * count**0.5), count // _MIN_POINTS_PER_CENTROID))
+
+
+def _pq_m(dim: int) -> int:
+	if FAISS_PQ_M:
+		return FAISS_PQ_M
+	# One byte per 8 dimensions, 16 times smaller than float32
+	m = max(dim // 8, 1)
+	while dim % m:
+		m -= 1
+	return m
+
+
+def _codec(compression: str | None, count: int, dim: int) -> str:
+	"""
+	faiss factory name of the codes that store the vectors.
+	"""
+	match compression:
+		case None:
+			return "Flat"
+		case "int8":
+			return "SQ8"
+		case "pq":
+			# Each sub-quantizer trains 2^nbits centroids: small collections
+			# get fewer of them, and int8 codes below 16
+			nbits = min(8, int(np.log2(max(count // _MIN_POINTS_PER_CENTROID, 1))))
+			if nbits < 4:
+				return "SQ8"
+			return f"PQ{_pq_m(dim)}x{nbits}"
+		case _:
+			raise ValueError(f"Invalid FAISS compression: {compression}")
+
+
+def build_faiss_index(
+	index_type: str, vectors: np.ndarray, compression: str | None = None
+) -> faiss.Index:
+	"""
+	Create an empty index of `index_type` for vectors of the dimension of
+	`vectors`, trained on them when the index type or the compression needs
+	training. Vectors are normalized, so the inner product is the cosine
+	similarity.
+	"""
+	dim = vectors.shape[1]
+	codec = _codec(compression, len(vectors), dim)
+	match index_type:
+		case "flat":
+			description = codec
+		case "ivf":
+			description = f"IVF{_ivf_nlist(len(vectors))},{codec}"
+		case "hnsw":
+			description = f"HNSW{FAISS_HNSW_M}" + (
+				"" if codec == "Flat" else f"_{codec}"
+			)
+		case _:
+			raise ValueError(f"Invalid FAISS index type: {index_type}")
+
+	# Some quantized indexes (HNSW with PQ) only measure L2 distances. On
+	# normalized vectors they rank like the inner product, and the results
+	# of compressed indexes are re-scored anyway
+	metric = faiss.METRIC_L2 if compression else faiss.METRIC_INNER_PRODUCT
+	index = faiss.index_factory(dim, description, metric)
+	if isinstance(index, faiss.IndexHNSW):
+		index.hnsw.efConstruction = FAISS_HNSW_EF_CONSTRUCTION
+	if not index.is_trained:
+		index.train(vectors)
+	if isinstance(index, faiss.IndexIVF):
+		# IVF indexes store the ids themselves; wrapped in an IDMap their
+		# removals would go out of sync with the id map
+		return index
+	return faiss.IndexIDMap2(index)
+
+
+def _to_vectors(blobs: list[bytes]) -> np.ndarray:
+	return np.stack([np.frombuffer(blob, dtype="float32") for blob in blobs])
+
+
+def _base_index(index: faiss.Index) -> faiss.Index:
+	if isinstance(index, faiss.IndexIDMap2):
+		return faiss.downcast_index(index.index)
+	return index
+
+
+def configure_search(index: faiss.Index):
+	inner = _base_index(index)
+	if isinstance(inner, faiss.IndexIVF):
+		inner.nprobe = FAISS_IVF_NPROBE
+	elif isinstance(inner, faiss.IndexHNSW):
+		inner.hnsw.efSearch = FAISS_HNSW_EF_SEARCH
+
+
+class FaissVectorStore(BasePydanticVectorStore):
+	"""
+	Vector store keeping the vectors in a FAISS index and the nodes in a
+	SQLite side table, both in `persist_dir`.
+
+	Writes are kept in memory (and in an open SQLite transaction) until
+	`persist()`, which replaces the index file atomically, so readers never
+	see a partially written index. Read-only stores open the index with
+	`IO_FLAG_MMAP`: the inverted lists of IVF indexes are memory-mapped and
+	their pages are shared by every process reading the collection.
+
+	With `compression` the index only holds int8 or product quantization
+	codes. The float vectors are kept in the SQLite table, on disk, and the
+	candidates found in the index are re-scored with them.
+	"""
+
+	stores_text: bool = True
+	flat_metadata: bool = False
+
+	persist_dir: str
+	index_type: str = "flat"
+	compression: str | None = None
+	read_only: bool = False
+
+	_index: faiss.Index | None = PrivateAttr(default=None)
+	# Vectors waiting for the training of the index, with their ids
+	_pending: list[tuple[np.ndarray, np.ndarray]] = PrivateAttr(default_factory=list)
+	_stale: int = PrivateAttr(default=0)
+	_dirty: bool = PrivateAttr(default=False)
+	_conn: sqlite3.Connection = PrivateAttr()
+	_lock: threading.RLock = PrivateAttr(default_factory=threading.RLock)
+
+	def __init__(
+		self,
+		persist_dir: str,
+		index_type: str = "flat",
+		compression: str | None = None,
+		read_only: bool = False,
+		**kwargs: Any,
+	):
+		super().__init__(
+			persist_dir=persist_dir,
+			index_type=index_type,
+			compression=compression,
+			read_only=read_only,
+			**kwargs,
+		)
+		Path(persist_dir).mkdir(parents=True, exist_ok=True)
+		self._conn = self._connect()
+		self._index = self._load_index()
+		if self._index is not None:
+			self._stale = max(self._index.ntotal - self._count(), 0)
+
+	@classmethod
+	def class_name(cls) -> str:
+		return "FaissVectorStore"
+
+	@property
+	def client(self) -> faiss.Index | None:
+		return self._index
+
+	@property
+	def index_path(self) -> Path:
+		return Path(self.persist_dir) / INDEX_FILE
+
+	def _connect(self) -> sqlite3.Connection:
+		conn = sqlite3.connect(
+			str(Path(self.persist_dir) / PAYLOAD_FILE), check_same_thread=False
+		)
+		conn.execute("PRAGMA journal_mode=WAL")
+		conn.execute(
+			"""
+			CREATE TABLE IF NOT EXISTS nodes (
+				id INTEGER PRIMARY KEY AUTOINCREMENT,
+				node_id TEXT NOT NULL UNIQUE,
+				ref_doc_id TEXT,
+				file_path TEXT,
+				metadata TEXT NOT NULL,
+				vector BLOB
+			)
+			"""
+		)
+		conn.execute(
+			"CREATE INDEX IF NOT EXISTS ix_nodes_ref_doc_id ON nodes (ref_doc_id)"
+		)
+		conn.execute(
+			"CREATE INDEX IF NOT EXISTS ix_nodes_file_path ON nodes (file_path)"
+		)
+		conn.commit()
+		return conn
+
+	def _load_index(self) -> faiss.Index | None:
+		if not self.index_path.is_file():
+			return None
+		if self.read_only:
+			index = faiss.read_index(
+				str(self.index_path), faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY
+			)
+		else:
+			index = faiss.read_index(str(self.index_path))
+		configure_search(index)
+		return index
+
+	def _count(self) -> int:
+		return self._conn.execute("SELECT COUNT(*) FROM nodes").fetchone()[0]
+
+	def _check_writable(self):
+		# Modifying a memory-mapped index aborts the process
+		if self.read_only:
+			raise ValueError("The FAISS vector store is opened read-only.")
+
+	def _build_index(self, vectors: np.ndarray):
+		self._index = build_faiss_index(self.index_type, vectors, self.compression)
+		configure_search(self._index)
+
+	def _add_vectors(self, ids: np.ndarray, vectors: np.ndarray):
+		if self._index is None and (self.index_type == "ivf" or self.compression):
+			# Lists and codes are trained on the whole first batch of the
+			# collection
+			self._pending.append((ids, vectors))
+			return
+		if self._index is None:
+			self._build_index(vectors)
+		self._index.add_with_ids(vectors, ids)
+
+	def _delete_where(self, column: str, values: list[str]):
+		ids = []
+		for i in range(0, len(values), _SQL_BATCH_SIZE):
+			batch = values[i : i + _SQL_BATCH_SIZE]
+			placeholders = ",".join("?" * len(batch))
+			rows = self._conn.execute(
+				f"SELECT id FROM nodes WHERE {column} IN ({placeholders})", batch
+			).fetchall()
+			ids.extend(row[0] for row in rows)
+			self._conn.execute(
+				f"DELETE FROM nodes WHERE {column} IN ({placeholders})", batch
+			)
+		if not ids:
+			return
+
+		ids = np.array(ids, dtype="int64")
+		if self._index is not None:
+			if isinstance(_base_index(self._index), faiss.IndexHNSW):
+				# HNSW can't remove vectors: deleted ids are filtered out of
+				# the results until the index is compacted
+				self._stale += len(ids)
+			else:
+				self._index.remove_ids(ids)
+		self._pending = [
+			(pending_ids[mask], vectors[mask])
+			for pending_ids, vectors in self._pending
+			if (mask := ~np.isin(pending_ids, ids)).any()
+		]
+		self._dirty = True
+
+	def add(self, nodes: list[BaseNode], **add_kwargs: Any) -> list[str]:
+		self._check_writable()
+		if not nodes:
+			return []
+
+		vectors = np.array([node.get_embedding() for node in nodes], dtype="float32")
+		faiss.normalize_L2(vectors)
+
+		with self._lock:
+			# Nodes added again replace their previous version
+			self._delete_where("node_id", [node.node_id for node in nodes])
+
+			ids = np.empty(len(nodes), dtype="int64")
+			for i, node in enumerate(nodes):
+				metadata = node_to_metadata_dict(
+					node, remove_text=False, flat_metadata=self.flat_metadata
+				)
+				cursor = self._conn.execute(
+					"INSERT INTO nodes (node_id, ref_doc_id, file_path, metadata, vector) "
+					"VALUES (?, ?, ?, ?, ?)",
+					(
+						node.node_id,
+						node.ref_doc_id,
+						node.metadata.get("file_path"),
+						json.dumps(metadata),
+						vectors[i].tobytes() if self.compression else None,
+					),
+				)
+				ids[i] = cursor.lastrowid
+
+			self._add_vectors(ids, vectors)
+			self._dirty = True
+
+		return [node.node_id for node in nodes]
+
+	async def async_add(self, nodes: list[BaseNode], **kwargs: Any) -> list[str]:
+		return await asyncio.to_thread(self.add, nodes, **kwargs)
+
+	def delete(self, ref_doc_id: str, **delete_kwargs: Any) -> None:
+		self._check_writable()
+		with self._lock:
+			self._delete_where("ref_doc_id", [ref_doc_id])
+
+	def delete_files(self, file_paths: list[str]):
+		"""
+		Delete every node that was built from one of `file_paths`.
+		"""
+		self._check_writable()
+		with self._lock:
+			self._delete_where("file_path", file_paths)
+
+	def delete_nodes(
+		self,
+		node_ids: list[str] | None = None,
+		filters: MetadataFilters | None = None,
+		**delete_kwargs: Any,
+	) -> None:
+		self._check_writable()
+		with self._lock:
+			if filters is not None:
+				node_ids = [
+					node.node_id
+					for node in self.get_nodes(node_ids=node_ids, filters=filters)
+				]
+			if node_ids:
+				self._delete_where("node_id", node_ids)
+
+	def clear(self) -> None:
+		self._check_writable()
+		with self._lock:
+			self._conn.execute("DELETE FROM nodes")
+			self._index = None
+			self._pending = []
+			self._stale = 0
+			self._dirty = True
+
+	def _compact(self):
+		"""
+		Rebuild the index without its deleted vectors once they exceed
+		`COMPACT_RATIO` of the index.
+		"""
+		if self._index is None or self._stale <= COMPACT_RATIO * self._index.ntotal:
+			return
+
+		logger.debug(f"Compacting {self.persist_dir} ({self._stale} deleted vectors)")
+		if self.compression:
+			# Codes only approximate the vectors, rebuild from the exact ones
+			rows = self._conn.execute("SELECT id, vector FROM nodes").fetchall()
+			ids = np.array([row[0] for row in rows], dtype="int64")
+			vectors = _to_vectors([row[1] for row in rows])
+		else:
+			ids = faiss.vector_to_array(self._index.id_map)
+			vectors = self._index.index.reconstruct_n(0, self._index.ntotal)
+			live = np.fromiter(
+				(row[0] for row in self._conn.execute("SELECT id FROM nodes")),
+				dtype="int64",
+			)
+			mask = np.isin(ids, live)
+			ids, vectors = ids[mask], vectors[mask]
+
+		self._index = None
+		self._stale = 0
+		if len(ids):
+			self._add_vectors(ids, vectors)
+
+	def persist(self, persist_path: str | None = None, fs=None) -> None:
+		"""
+		Write the index and commit the nodes. `persist_path` is ignored, the
+		store always persists to its own directory.
+		"""
+		with self._lock:
+			if self.read_only or not self._dirty:
+				return
+
+			self._compact()
+			if self._pending:
+				ids = np.concatenate([ids for ids, _ in self._pending])
+				vectors = np.concatenate([vectors for _, vectors in self._pending])
+				self._pending = []
+				if self._index is None:
+					self._build_index(vectors)
+				self._index.add_with_ids(vectors, ids)
+
+			if self._index is None:
+				self.index_path.unlink(missing_ok=True)
+			else:
+				# Readers keep the previous file mapped until they reopen it
+				tmp_path = self.index_path.with_suffix(".tmp")
+				faiss.write_index(self._index, str(tmp_path))
+				os.replace(tmp_path, self.index_path)
+
+			self._conn.commit()
+			self._dirty = False
+
+	def close(self):
+		"""
+		Close the store, rolling back the changes that weren't persisted.
+		"""
+		with self._lock:
+			if self._dirty:
+				self._conn.rollback()
+				self._pending = []
+				self._dirty = False
+			self._conn.close()
+
+	def _get_rows(
+		self, column: str, values: list, with_vectors: bool = False
+	) -> list[tuple]:
+		columns = "id, node_id, ref_doc_id, metadata" + (
+			", vector" if with_vectors else ""
+		)
+		rows = []
+		for i in range(0, len(values), _SQL_BATCH_SIZE):
+			batch = values[i : i + _SQL_BATCH_SIZE]
+			placeholders = ",".join("?" * len(batch))
+			rows.extend(
+				self._conn.execute(
+					f"SELECT {columns} FROM nodes WHERE {column} IN ({placeholders})",
+					batch,
+				).fetchall()
+			)
+		return rows
+
+	def get_nodes(
+		self,
+		node_ids: list[str] | None = None,
+		filters: MetadataFilters | None = None,
+	) -> list[BaseNode]:
+		with self._lock:
+			if node_ids is not None:
+				rows = self._get_rows("node_id", node_ids)
+			else:
+				rows = self._conn.execute(
+					"SELECT id, node_id, ref_doc_id, metadata FROM nodes"
+				).fetchall()
+
+		metadata = {row[1]: json.loads(row[3]) for row in rows}
+		filter_fn = _build_metadata_filter_fn(
+			lambda node_id: metadata[node_id], filters
+		)
+		return [
+			metadata_dict_to_node(metadata[node_id])
+			for node_id in metadata
+			if filter_fn(node_id)
+		]
+
+	def query(self, query: VectorStoreQuery, **kwargs: Any) -> VectorStoreQueryResult:
+		return self.query_many([query])[0]
+
+	def _fetch_k(self, query: VectorStoreQuery) -> int:
+		top_k = query.similarity_top_k
+		filtered = query.filters or query.doc_ids or query.node_ids or self._stale
+		fetch_k = top_k * OVERFETCH if filtered else top_k
+		if self.compression:
+			fetch_k *= FAISS_RESCORE_FACTOR
+		return min(fetch_k, self._index.ntotal)
+
+	def query_many(
+		self, queries: list[VectorStoreQuery]
+	) -> list[VectorStoreQueryResult]:
+		"""
+		Answer several queries with a single search of the index, which
+		scores all their vectors at once.
+		"""
+		searched = [
+			i for i, query in enumerate(queries) if query.query_embedding is not None
+		]
+		results = [
+			VectorStoreQueryResult(nodes=[], similarities=[], ids=[]) for _ in queries
+		]
+		if self._index is None or self._index.ntotal == 0 or not searched:
+			return results
+
+		vectors = np.array(
+			[queries[i].query_embedding for i in searched], dtype="float32"
+		)
+		faiss.normalize_L2(vectors)
+		fetch_k = max(self._fetch_k(queries[i]) for i in searched)
+
+		with self._lock:
+			scores, ids = self._index.search(vectors, fetch_k)
+			rows = self._get_rows(
+				"id",
+				sorted({int(i) for i in ids.flat if i >= 0}),
+				with_vectors=bool(self.compression),
+			)
+
+		# Ids without a row were deleted from an index that can't remove them
+		rows_by_id = {row[0]: row for row in rows}
+		metadata = {row[1]: json.loads(row[3]) for row in rows}
+		for row, i in enumerate(searched):
+			results[i] = self._query_result(
+				queries[i], vectors[row], scores[row], ids[row], rows_by_id, metadata
+			)
+		return results
+
+	def _query_result(
+		self,
+		query: VectorStoreQuery,
+		vector: np.ndarray,
+		scores: np.ndarray,
+		ids: np.ndarray,
+		rows_by_id: dict[int, tuple],
+		metadata: dict[str, dict],
+	) -> VectorStoreQueryResult:
+		candidates = [
+			(float(score), int(faiss_id))
+			for score, faiss_id in zip(scores, ids, strict=True)
+			if int(faiss_id) in rows_by_id
+		]
+		if self.compression and candidates:
+			# Rank the candidates by their exact score instead of the codes'
+			candidate_ids = [faiss_id for _, faiss_id in candidates]
+			exact = _to_vectors([rows_by_id[i][4] for i in candidate_ids]) @ vector
+			candidates = sorted(
+				zip(exact.tolist(), candidate_ids, strict=True),
+				key=lambda c: c[0],
+				reverse=True,
+			)
+
+		filter_fn = _build_metadata_filter_fn(
+			lambda node_id: metadata[node_id], query.filters
+		)
+
+		nodes, similarities, node_ids = [], [], []
+		for score, faiss_id in candidates:
+			_, node_id, ref_doc_id = rows_by_id[faiss_id][:3]
+			if query.node_ids and node_id not in query.node_ids:
+				continue
+			if query.doc_ids and ref_doc_id not in query.doc_ids:
+				continue
+			if not filter_fn(node_id):
+				continue
+
+			nodes.append(metadata_dict_to_node(metadata[node_id]))
+			similarities.append(score)
+			node_ids.append(node_id)
+			if len(nodes) == query.similarity_top_k:
+				break
+
+		return VectorStoreQueryResult(
+			nodes=nodes, similarities=similarities, ids=node_ids
+		)
+
+	async def aquery(
+		self, query: VectorStoreQuery, **kwargs: Any
+	) -> VectorStoreQueryResult:
+		return await asyncio.to_thread(self.query, query, **kwargs)
+
+	async def aquery_many(
+		self, queries: list[VectorStoreQuery]
+	) -> list[VectorStoreQueryResult]:
+		return await asyncio.to_thread(self.query_many, queries)
+
+
+class FaissDB:
+	"""
+	FAISS collection of a project, with the same interface as `ChromaDB`.
+
+	The store used to write the collection is kept open so the deletions
+	and additions of an indexing run are persisted together by `persist()`.
+	"""
+
+	def __init__(
+		self,
+		name: str,
+		index_type: str | None = None,
+		compression: str | None = None,
+	):
+		self.collection_name = name
+		self.index_type = index_type or FAISS_INDEX_TYPE
+		self.compression = compression or FAISS_COMPRESSION
+		self.path = ROOT_PATH + FAISS_DB_PATH + "/" + re.sub(r"[^\w.-]", "_", name)
+		self._vector_store: FaissVectorStore | None = None
+
+	def as_vector_store(self, read_only: bool = False) -> FaissVectorStore:
+		if read_only:
+			return FaissVectorStore(
+				persist_dir=self.path,
+				index_type=self.index_type,
+				compression=self.compression,
+				read_only=True,
+			)
+		if self._vector_store is None:
+			self._vector_store = FaissVectorStore(
+				persist_dir=self.path,
+				index_type=self.index_type,
+				compression=self.compression,
+			)
+		return self._vector_store
+
+	def drop_collection(self):
+		self.close()
+		shutil.rmtree(self.path, ignore_errors=True)
+
+	def delete_files(self, file_paths: list[str]):
+		if not file_paths:
+			return
+		self.as_vector_store().delete_files(file_paths)
+
+	def persist(self):
+		if self._vector_store is not None:
+			self._vector_store.persist()
+
+	def close(self):
+		"""
+		Close the store used for writing. The changes made since the last
+		`persist()` are rolled back.
+		"""
+		if self._vector_store is not None:
+			self._vector_store.close()
+			self._vector_store = None
+
+	def as_vector_store_index(self):
+		vector_store = self.as_vector_store(read_only=True)
+		index = VectorStoreIndex.from_vector_store(vector_store=vector_store)
+		return index
+
+	def as_query_engine(self):
+		index = self.as_vector_store_index()
+		return index.as_query_engine()
+
+	def as_chat_engine(self):
+		index = self.as_vector_store_index()
+		return index.as_chat_engine()
+
+
+__all__ = ["FaissDB", "FaissVectorStore", "build_faiss_index"]
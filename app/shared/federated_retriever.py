@@ -0,0 +1,106 @@
+import asyncio
+
+from llama_index.core import Settings
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.retrievers import BaseRetriever
+from llama_index.core.schema import NodeWithScore, QueryBundle
+
+from app.config import FEDERATED_SHARD_TIMEOUT_SECONDS, FEDERATED_TOP_K
+from app.shared.metrics import FEDERATED_SHARDS, RETRIEVER_SECONDS, timed
+from app.utils import logger
+
+
+class FederatedRetriever(BaseRetriever):
+	"""
+	Search the retrievers of several projects concurrently and merge their
+	results by score. The retrievers have to score on the same scale, e.g.
+	the cosine similarities of one embedding model, so a project without
+	relevant chunks only gets low scores. The query is embedded once for all
+	of them, and a project that fails or doesn't answer within `timeout`
+	seconds is left out, so a query takes as long as the slowest answering
+	project.
+
+	Nodes get the name of their project in the `project` metadata.
+	"""
+
+	def __init__(
+		self,
+		retrievers: dict[str, BaseRetriever],
+		similarity_top_k: int = FEDERATED_TOP_K,
+		timeout: float = FEDERATED_SHARD_TIMEOUT_SECONDS,
+		embed_model: BaseEmbedding | None = None,
+	):
+		self._retrievers = retrievers
+		self.similarity_top_k = similarity_top_k
+		self.timeout = timeout
+		self._embed_model = embed_model or Settings.embed_model
+		super().__init__()
+
+	def _merge(self, results: dict[str, list[NodeWithScore]]) -> list[NodeWithScore]:
+		merged = []
+		for project, nodes in results.items():
+			for node in nodes:
+				node.node.metadata["project"] = project
+				if "project" not in node.node.excluded_embed_metadata_keys:
+					node.node.excluded_embed_metadata_keys.append("project")
+				merged.append(node)
+		merged.sort(key=lambda node: node.score or 0.0, reverse=True)
+		return merged[: self.similarity_top_k]
+
+	def _retrieve(self, query_bundle: QueryBundle) -> list[NodeWithScore]:
+		results = {}
+		for project, retriever in self._retrievers.items():
+			try:
+				with timed(RETRIEVER_SECONDS, retriever="FederatedShard"):
+					results[project] = retriever.retrieve(query_bundle)
+				FEDERATED_SHARDS.labels(outcome="success").inc()
+			except Exception as e:
+				FEDERATED_SHARDS.labels(outcome="error").inc()
+				logger.warning(f"Search of project {project} failed: {e}")
+		return self._merge(results)
+
+	async def _aretrieve_shard(
+		self, project: str, retriever: BaseRetriever, query_bundle: QueryBundle
+	) -> list[NodeWithScore] | None:
+		try:
+			# On a thread, the Chroma store only queries synchronously. A shard
+			# that times out keeps its thread until its query returns
+			with timed(RETRIEVER_SECONDS, retriever="FederatedShard"):
+				nodes = await asyncio.wait_for(
+					asyncio.to_thread(retriever.retrieve, query_bundle), self.timeout
+				)
+		except asyncio.TimeoutError:
+			FEDERATED_SHARDS.labels(outcome="timeout").inc()
+			logger.warning(f"Search of project {project} timed out ({self.timeout}s)")
+			return None
+		except Exception as e:
+			FEDERATED_SHARDS.labels(outcome="error").inc()
+			logger.warning(f"Search of project {project} failed: {e}")
+			return None
+		FEDERATED_SHARDS.labels(outcome="success").inc()
+		return nodes
+
+	async def _aretrieve(self, query_bundle: QueryBundle) -> list[NodeWithScore]:
+		# Every project would embed the same query otherwise
+		if query_bundle.embedding is None and query_bundle.embedding_strs:
+			query_bundle.embedding = (
+				await self._embed_model.aget_agg_embedding_from_queries(
+					query_bundle.embedding_strs
+				)
+			)
+		results = await asyncio.gather(
+			*(
+				self._aretrieve_shard(project, retriever, query_bundle)
+				for project, retriever in self._retrievers.items()
+			)
+		)
+		return self._merge(
+			{
+				project: nodes
+				for project, nodes in zip(self._retrievers, results, strict=True)
+				if nodes is not None
+			}
+		)
+
+
+__all__ = ["FederatedRetriever"]
@@ -0,0 +1,79 @@
+import asyncio
+
+from llama_index.core.retrievers import BaseRetriever
+from llama_index.core.schema import NodeWithScore, QueryBundle
+
+from app.config import RETRIEVER_TOP_K, RRF_K
+from app.shared.federated_retriever import FederatedRetriever
+from app.shared.metrics import RETRIEVER_SECONDS, timed
+
+
+def reciprocal_rank_fusion(
+	results: list[list[NodeWithScore]], k: int = RRF_K, top_k: int = RETRIEVER_TOP_K
+) -> list[NodeWithScore]:
+	"""
+	Merge ranked lists of nodes: each node scores `1 / (k + rank)` in every
+	list it appears in. Nodes are matched by id, as the same chunk can come
+	back from different stores.
+	"""
+	scores: dict[str, float] = {}
+	nodes: dict[str, NodeWithScore] = {}
+	for ranked in results:
+		for rank, node in enumerate(ranked, start=1):
+			node_id = node.node.node_id
+			scores[node_id] = scores.get(node_id, 0.0) + 1 / (k + rank)
+			nodes.setdefault(node_id, node)
+
+	fused = sorted(scores, key=scores.get, reverse=True)[:top_k]
+	return [
+		NodeWithScore(node=nodes[node_id].node, score=scores[node_id])
+		for node_id in fused
+	]
+
+
+class HybridRetriever(BaseRetriever):
+	"""
+	Run several retrievers (dense and lexical) concurrently, each on a
+	thread, and fuse their results with reciprocal rank fusion.
+	"""
+
+	def __init__(
+		self,
+		retrievers: list[BaseRetriever],
+		similarity_top_k: int = RETRIEVER_TOP_K,
+		rrf_k: int = RRF_K,
+	):
+		self._retrievers = retrievers
+		self.similarity_top_k = similarity_top_k
+		self.rrf_k = rrf_k
+		super().__init__()
+
+	def _retrieve(self, query_bundle: QueryBundle) -> list[NodeWithScore]:
+		results = []
+		for retriever in self._retrievers:
+			with timed(RETRIEVER_SECONDS, retriever=type(retriever).__name__):
+				results.append(retriever.retrieve(query_bundle))
+		return reciprocal_rank_fusion(results, self.rrf_k, self.similarity_top_k)
+
+	async def _timed_aretrieve(
+		self, retriever: BaseRetriever, query_bundle: QueryBundle
+	) -> list[NodeWithScore]:
+		# Searches of several projects fan out concurrently on their own
+		if isinstance(retriever, FederatedRetriever):
+			return await retriever.aretrieve(query_bundle)
+		# Most vector stores (Chroma) only query synchronously, their `aquery`
+		# would block the event loop
+		with timed(RETRIEVER_SECONDS, retriever=type(retriever).__name__):
+			return await asyncio.to_thread(retriever.retrieve, query_bundle)
+
+	async def _aretrieve(self, query_bundle: QueryBundle) -> list[NodeWithScore]:
+		results = await asyncio.gather(
+			*(
+				self._timed_aretrieve(retriever, query_bundle)
+				for retriever in self._retrievers
+			)
+		)
+		return reciprocal_rank_fusion(results, self.rrf_k, self.similarity_top_k)
+
+
+__all__ = ["HybridRetriever", "reciprocal_rank_fusion"]
@@ -0,0 +1,315 @@
+import asyncio
+import json
+import re
+import sqlite3
+import threading
+from pathlib import Path
+
+from llama_index.core.retrievers import BaseRetriever
+from llama_index.core.schema import (
+	BaseNode,
+	MetadataMode,
+	NodeWithScore,
+	QueryBundle,
+	TransformComponent,
+)
+from llama_index.core.vector_stores.utils import (
+	metadata_dict_to_node,
+	node_to_metadata_dict,
+)
+from pydantic import PrivateAttr
+
+from app.config import LEXICAL_INDEX_PATH, RETRIEVER_TOP_K, ROOT_PATH
+
+# SQLite limits the number of host parameters of a single statement
+_SQL_BATCH_SIZE = 500
+# Terms of a query looked up in the index, the rest is ignored
+MAX_QUERY_TERMS = 32
+
+_WORD = re.compile(r"[A-Za-z_][A-Za-z0-9_]*|[0-9]+")
+_SUBWORD = re.compile(r"[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|[0-9]+")
+# Words of natural language questions that would match most chunks
+_STOP_WORDS = {
+	"a",
+	"an",
+	"and",
+	"are",
+	"do",
+	"does",
+	"how",
+	"in",
+	"is",
+	"of",
+	"the",
+	"to",
+	"what",
+	"where",
+	"which",
+	"why",
+}
+
+
+def code_tokens(text: str) -> list[str]:
+	"""
+	Split `text` into lowercase words, adding the parts of camelCase and
+	snake_case identifiers after the identifier itself, so that both
+	`getUserName` and `user` match it.
+	"""
+	tokens = []
+	for word in _WORD.findall(text):
+		parts = [
+			subword.lower()
+			for part in word.split("_")
+			for subword in _SUBWORD.findall(part)
+		]
+		tokens.append(word.lower())
+		if len(parts) > 1:
+			tokens.extend(parts)
+	return tokens
+
+
+def to_match_query(text: str) -> str | None:
+	terms = list(
+		dict.fromkeys(token for token in code_tokens(text) if token not in _STOP_WORDS)
+	)[:MAX_QUERY_TERMS]
+	if not terms:
+		return None
+	# Tokens only contain letters, digits and underscores
+	return " OR ".join(f'"{term}"' for term in terms)
+
+
+class LexicalIndex:
+	"""
+	BM25 index of the chunks of a project, in a SQLite FTS5 table next to a
+	copy of the nodes so results don't need the vector store.
+
+	Like the FAISS store, writes are kept in an open transaction until
+	`persist()`. Read-only indexes never create the database and find
+	nothing until the project has been indexed.
+	"""
+
+	def __init__(self, path: str, read_only: bool = False):
+		self.path = path
+		self.read_only = read_only
+		self._lock = threading.Lock()
+		self._conn: sqlite3.Connection | None = None
+
+		if read_only:
+			if Path(path).is_file():
+				self._conn = sqlite3.connect(
+					f"file:{path}?mode=ro", uri=True, check_same_thread=False
+				)
+			return
+
+		Path(path).parent.mkdir(parents=True, exist_ok=True)
+		self._conn = sqlite3.connect(path, check_same_thread=False)
+		self._conn.execute("PRAGMA journal_mode=WAL")
+		self._conn.executescript(
+			"""
+			CREATE TABLE IF NOT EXISTS chunks (
+				id INTEGER PRIMARY KEY AUTOINCREMENT,
+				node_id TEXT NOT NULL UNIQUE,
+				file_path TEXT,
+				tokens TEXT NOT NULL,
+				node TEXT NOT NULL
+			);
+			CREATE INDEX IF NOT EXISTS ix_chunks_file_path ON chunks (file_path);
+			CREATE VIRTUAL TABLE IF NOT EXISTS chunks_fts USING fts5(
+				tokens,
+				content='chunks',
+				content_rowid='id',
+				tokenize="unicode61 tokenchars '_'"
+			);
+			CREATE TRIGGER IF NOT EXISTS chunks_ai AFTER INSERT ON chunks BEGIN
+				INSERT INTO chunks_fts (rowid, tokens) VALUES (new.id, new.tokens);
+			END;
+			CREATE TRIGGER IF NOT EXISTS chunks_ad AFTER DELETE ON chunks BEGIN
+				INSERT INTO chunks_fts (chunks_fts, rowid, tokens)
+				VALUES ('delete', old.id, old.tokens);
+			END;
+			"""
+		)
+		self._conn.commit()
+
+	def _check_writable(self):
+		if self.read_only:
+			raise ValueError("The lexical index is opened read-only.")
+
+	def _delete_where(self, column: str, values: list[str]):
+		for i in range(0, len(values), _SQL_BATCH_SIZE):
+			batch = values[i : i + _SQL_BATCH_SIZE]
+			self._conn.execute(
+				f"DELETE FROM chunks WHERE {column} IN ({','.join('?' * len(batch))})",
+				batch,
+			)
+
+	def add(self, nodes: list[BaseNode]):
+		self._check_writable()
+		rows = []
+		for node in nodes:
+			file_path = node.metadata.get("file_path")
+			text = node.get_content(metadata_mode=MetadataMode.NONE)
+			tokens = code_tokens(
+				f"{Path(file_path).name} {text}" if file_path else text
+			)
+			rows.append(
+				(
+					node.node_id,
+					file_path,
+					" ".join(tokens),
+					json.dumps(node_to_metadata_dict(node, remove_text=False)),
+				)
+			)
+
+		with self._lock:
+			# Nodes added again replace their previous version
+			self._delete_where("node_id", [node.node_id for node in nodes])
+			self._conn.executemany(
+				"INSERT INTO chunks (node_id, file_path, tokens, node) VALUES (?, ?, ?, ?)",
+				rows,
+			)
+
+	def delete_files(self, file_paths: list[str]):
+		"""
+		Delete every chunk that was built from one of `file_paths`.
+		"""
+		self._check_writable()
+		with self._lock:
+			self._delete_where("file_path", file_paths)
+
+	def file_paths(self) -> set[str]:
+		"""
+		Paths of the files that have chunks in the index.
+		"""
+		if self._conn is None:
+			return set()
+		with self._lock:
+			rows = self._conn.execute(
+				"SELECT DISTINCT file_path FROM chunks WHERE file_path IS NOT NULL"
+			).fetchall()
+		return {file_path for (file_path,) in rows}
+
+	def clear(self):
+		self._check_writable()
+		with self._lock:
+			self._conn.execute("DELETE FROM chunks")
+
+	def persist(self):
+		if not self.read_only:
+			with self._lock:
+				self._conn.commit()
+
+	def close(self):
+		if self._conn is not None:
+			self._conn.close()
+			self._conn = None
+
+	def search(self, query: str, top_k: int = RETRIEVER_TOP_K) -> list[NodeWithScore]:
+		match_query = to_match_query(query)
+		if self._conn is None or match_query is None:
+			return []
+
+		with self._lock:
+			rows = self._conn.execute(
+				"SELECT chunks.node, bm25(chunks_fts) AS rank FROM chunks_fts "
+				"JOIN chunks ON chunks.id = chunks_fts.rowid "
+				"WHERE chunks_fts MATCH ? ORDER BY rank LIMIT ?",
+				(match_query, top_k),
+			).fetchall()
+
+		# FTS5 scores are negated BM25 scores, lower is better
+		return [
+			NodeWithScore(node=metadata_dict_to_node(json.loads(node)), score=-rank)
+			for node, rank in rows
+		]
+
+
+def get_lexical_index_path(name: str) -> str:
+	return ROOT_PATH + LEXICAL_INDEX_PATH + "/" + re.sub(r"[^\w.-]", "_", name) + ".db"
+
+
+def get_lexical_index(name: str, read_only: bool = False) -> LexicalIndex:
+	return LexicalIndex(get_lexical_index_path(name), read_only=read_only)
+
+
+_search_indexes: dict[str, LexicalIndex] = {}
+_search_indexes_lock = threading.Lock()
+
+
+def get_search_lexical_index(name: str) -> LexicalIndex:
+	"""
+	Return the read-only index used to query the project `name`. It is
+	opened once and shared by the queries, until `invalidate_lexical_index`
+	is called for the project.
+	"""
+	with _search_indexes_lock:
+		if name not in _search_indexes:
+			_search_indexes[name] = get_lexical_index(name, read_only=True)
+		return _search_indexes[name]
+
+
+def invalidate_lexical_index(name: str):
+	"""
+	Drop the shared read-only index of `name`, after it has been indexed for
+	the first time or deleted. Its connection is closed once no query uses
+	it.
+	"""
+	with _search_indexes_lock:
+		_search_indexes.pop(name, None)
+
+
+def delete_lexical_index(name: str):
+	"""
+	Delete the database of the lexical index of `name`, with its WAL files.
+	"""
+	invalidate_lexical_index(name)
+	path = get_lexical_index_path(name)
+	for suffix in ("", "-wal", "-shm"):
+		Path(path + suffix).unlink(missing_ok=True)
+
+
+class LexicalIndexer(TransformComponent):
+	"""
+	Ingestion pipeline step adding the nodes to a lexical index, and passing
+	them on unchanged.
+	"""
+
+	_index: LexicalIndex = PrivateAttr()
+
+	def __init__(self, index: LexicalIndex, **kwargs):
+		super().__init__(**kwargs)
+		self._index = index
+
+	def __call__(self, nodes: list[BaseNode], **kwargs) -> list[BaseNode]:
+		self._index.add(nodes)
+		return nodes
+
+	async def acall(self, nodes: list[BaseNode], **kwargs) -> list[BaseNode]:
+		await asyncio.to_thread(self._index.add, nodes)
+		return nodes
+
+
+class LexicalRetriever(BaseRetriever):
+	def __init__(self, index: LexicalIndex, similarity_top_k: int = RETRIEVER_TOP_K):
+		self._index = index
+		self.similarity_top_k = similarity_top_k
+		super().__init__()
+
+	def _retrieve(self, query_bundle: QueryBundle) -> list[NodeWithScore]:
+		return self._index.search(query_bundle.query_str, self.similarity_top_k)
+
+	async def _aretrieve(self, query_bundle: QueryBundle) -> list[NodeWithScore]:
+		return await asyncio.to_thread(self._retrieve, query_bundle)
+
+
+__all__ = [
+	"LexicalIndex",
+	"LexicalIndexer",
+	"LexicalRetriever",
+	"code_tokens",
+	"delete_lexical_index",
+	"get_lexical_index",
+	"get_lexical_index_path",
+	"get_search_lexical_index",
+	"invalidate_lexical_index",
+]
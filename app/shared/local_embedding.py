@@ -0,0 +1,204 @@
+import asyncio
+import re
+import threading
+from pathlib import Path
+
+from llama_index.core.base.embeddings.base import BaseEmbedding, Embedding
+from pydantic import Field, PrivateAttr
+
+from app.config import (
+	LOCAL_EMBEDDING_BACKEND,
+	LOCAL_EMBEDDING_BATCH_SIZE,
+	LOCAL_EMBEDDING_DEVICE,
+	LOCAL_EMBEDDING_MODEL,
+	LOCAL_EMBEDDING_QUANTIZE,
+	LOCAL_EMBEDDING_THREADS,
+	LOCAL_MODELS_PATH,
+	ROOT_PATH,
+)
+from app.shared.metrics import EMBEDDING_REQUEST_SECONDS, record_embedding, timed
+from app.utils import logger
+
+# Dynamic int8 quantization of the ONNX export, supported by any x86-64 CPU
+ONNX_QUANTIZATION_CONFIG = "avx2"
+
+
+def _quantized_onnx_path(model_name: str) -> Path:
+	return Path(ROOT_PATH + LOCAL_MODELS_PATH) / re.sub(r"[^\w.-]", "_", model_name)
+
+
+def _load_onnx_model(model_name: str, device: str, threads: int, quantize: bool):
+	import onnxruntime
+	from sentence_transformers import SentenceTransformer
+
+	session_options = onnxruntime.SessionOptions()
+	session_options.intra_op_num_threads = threads
+	model_kwargs = {"session_options": session_options}
+
+	if not quantize:
+		return SentenceTransformer(
+			model_name, device=device, backend="onnx", model_kwargs=model_kwargs
+		)
+
+	from sentence_transformers import export_dynamic_quantized_onnx_model
+
+	# Quantize the ONNX export once and keep it next to the other databases
+	path = _quantized_onnx_path(model_name)
+	file_name = f"onnx/model_qint8_{ONNX_QUANTIZATION_CONFIG}.onnx"
+	if not (path / file_name).is_file():
+		logger.info(f"Quantizing {model_name} to {path}")
+		model = SentenceTransformer(model_name, device=device, backend="onnx")
+		model.save(str(path))
+		export_dynamic_quantized_onnx_model(model, ONNX_QUANTIZATION_CONFIG, str(path))
+
+	return SentenceTransformer(
+		str(path),
+		device=device,
+		backend="onnx",
+		model_kwargs={**model_kwargs, "file_name": file_name},
+	)
+
+
+def _load_torch_model(model_name: str, device: str, threads: int, quantize: bool):
+	import torch
+	from sentence_transformers import SentenceTransformer
+
+	torch.set_num_threads(threads)
+	model = SentenceTransformer(model_name, device=device, backend="torch")
+	if quantize:
+		if device != "cpu":
+			logger.warning("int8 quantization is only supported on CPU, skipping")
+		else:
+			model = torch.quantization.quantize_dynamic(
+				model, {torch.nn.Linear}, dtype=torch.qint8
+			)
+	return model
+
+
+def load_sentence_transformer(
+	model_name: str,
+	backend: str = "torch",
+	device: str = "cpu",
+	threads: int = 1,
+	quantize: bool = False,
+):
+	"""
+	Load a sentence-transformers model with the torch or the ONNX runtime.
+	The ONNX backend needs `optimum[onnxruntime]`; without it the model is
+	loaded with torch.
+	"""
+	if backend == "onnx":
+		try:
+			return _load_onnx_model(model_name, device, threads, quantize)
+		except ImportError as e:
+			logger.warning(f"ONNX backend unavailable ({e}), falling back to torch")
+
+	return _load_torch_model(model_name, device, threads, quantize)
+
+
+class LocalEmbedding(BaseEmbedding):
+	"""
+	Embedding model running in-process with sentence-transformers, so
+	indexing and queries work offline.
+
+	Inference runs on a worker thread for the async methods, and a single
+	batch is encoded at a time: the model already uses `threads` threads.
+	"""
+
+	backend: str = Field(default="torch", description="torch or onnx")
+	device: str = Field(default="cpu")
+	threads: int = Field(default=1, gt=0)
+	quantize: bool = Field(default=False, description="Use int8 weights")
+
+	_model = PrivateAttr()
+	_lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+	_query_prompt: str | None = PrivateAttr(default=None)
+
+	def __init__(
+		self,
+		model_name: str = LOCAL_EMBEDDING_MODEL,
+		backend: str = LOCAL_EMBEDDING_BACKEND,
+		device: str = LOCAL_EMBEDDING_DEVICE,
+		threads: int = LOCAL_EMBEDDING_THREADS,
+		quantize: bool = LOCAL_EMBEDDING_QUANTIZE,
+		embed_batch_size: int = LOCAL_EMBEDDING_BATCH_SIZE,
+		**kwargs,
+	):
+		super().__init__(
+			model_name=model_name,
+			backend=backend,
+			device=device,
+			threads=threads,
+			quantize=quantize,
+			embed_batch_size=embed_batch_size,
+			**kwargs,
+		)
+		self._model = load_sentence_transformer(
+			model_name,
+			backend=backend,
+			device=device,
+			threads=threads,
+			quantize=quantize,
+		)
+		# Retrieval models such as bge or e5 prefix queries with a prompt
+		if "query" in (getattr(self._model, "prompts", None) or {}):
+			self._query_prompt = "query"
+
+	@classmethod
+	def class_name(cls) -> str:
+		return "LocalEmbedding"
+
+	@property
+	def cache_key(self) -> str:
+		"""
+		Key of the embeddings in the embedding cache: the backend and int8
+		quantization change the vectors of the same model. The backend the
+		model was loaded with, ONNX falls back to torch when unavailable.
+		"""
+		backend = getattr(self._model, "backend", self.backend)
+		quantized = self.quantize and (backend == "onnx" or self.device == "cpu")
+		return f"{self.class_name()}:{self.model_name}:{backend}" + (
+			":int8" if quantized else ""
+		)
+
+	def _encode(self, texts: list[str], prompt_name: str | None = None):
+		with self._lock, timed(EMBEDDING_REQUEST_SECONDS, model=self.model_name):
+			embeddings = self._model.encode(
+				texts,
+				batch_size=self.embed_batch_size,
+				prompt_name=prompt_name,
+				normalize_embeddings=True,
+				convert_to_numpy=True,
+				show_progress_bar=False,
+			)
+		record_embedding(self.model_name, len(texts))
+		return embeddings.tolist()
+
+	def _get_text_embeddings(self, texts: list[str]) -> list[Embedding]:
+		return self._encode(texts)
+
+	async def _aget_text_embeddings(self, texts: list[str]) -> list[Embedding]:
+		return await asyncio.to_thread(self._encode, texts)
+
+	def _get_text_embedding(self, text: str) -> Embedding:
+		return self._encode([text])[0]
+
+	async def _aget_text_embedding(self, text: str) -> Embedding:
+		return (await self._aget_text_embeddings([text]))[0]
+
+	def _get_query_embedding(self, query: str) -> Embedding:
+		return self._encode([query], prompt_name=self._query_prompt)[0]
+
+	async def _aget_query_embedding(self, query: str) -> Embedding:
+		embeddings = await asyncio.to_thread(
+			self._encode, [query], prompt_name=self._query_prompt
+		)
+		return embeddings[0]
+
+	async def aget_query_embeddings(self, queries: list[str]) -> list[Embedding]:
+		return await asyncio.to_thread(
+			self._encode, queries, prompt_name=self._query_prompt
+		)
+
+
+__all__ = ["LocalEmbedding", "load_sentence_transformer"]
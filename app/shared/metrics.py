@@ -0,0 +1,418 @@
+import asyncio
+import time
+from collections.abc import Callable
+from contextlib import contextmanager
+from functools import wraps
+from typing import Any
+
+from prometheus_client import (
+	CONTENT_TYPE_LATEST,
+	Counter,
+	Gauge,
+	Histogram,
+	generate_latest,
+)
+
+from app.config import EVENT_LOOP_LAG_INTERVAL_MS, EVENT_LOOP_SLOW_CALLBACK_MS
+from app.utils import logger
+from app.utils.request_context import new_request_id, request_id
+
+# Seconds, from a cached lookup to a slow LLM answer
+LATENCY_BUCKETS = (
+	0.005,
+	0.01,
+	0.025,
+	0.05,
+	0.1,
+	0.25,
+	0.5,
+	1.0,
+	2.5,
+	5.0,
+	10.0,
+	30.0,
+	60.0,
+	120.0,
+)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 2048)
+
+EVENT_LOOP_LAG_SECONDS = Histogram(
+	"stratus_event_loop_lag_seconds",
+	"Delay of the event loop in running a scheduled callback",
+	buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+HTTP_REQUEST_SECONDS = Histogram(
+	"stratus_http_request_duration_seconds",
+	"Time to handle an HTTP request, streamed responses included",
+	["method", "route", "status"],
+	buckets=LATENCY_BUCKETS,
+)
+WORKFLOW_STEP_SECONDS = Histogram(
+	"stratus_workflow_step_duration_seconds",
+	"Time spent in a step of a chat workflow",
+	["workflow", "step", "outcome"],
+	buckets=LATENCY_BUCKETS,
+)
+RETRIEVER_SECONDS = Histogram(
+	"stratus_retriever_duration_seconds",
+	"Time to query one of the retrievers fused by the hybrid retriever",
+	["retriever", "outcome"],
+	buckets=LATENCY_BUCKETS,
+)
+FEDERATED_SHARDS = Counter(
+	"stratus_federated_shards_total",
+	"Project searches of questions over several projects",
+	["outcome"],
+)
+BATCH_ANSWERS = Counter(
+	"stratus_batch_answers_total",
+	"Answers of batch questions, by where they came from",
+	["source"],
+)
+CHAT_FIRST_TOKEN_SECONDS = Histogram(
+	"stratus_chat_first_token_seconds",
+	"Time from a streamed chat request to its first generated token",
+	buckets=LATENCY_BUCKETS,
+)
+ANSWER_CACHE_LOOKUPS = Counter(
+	"stratus_answer_cache_lookups_total",
+	"Answer cache lookups",
+	["result"],
+)
+
+RERANKER_LOAD_SECONDS = Gauge(
+	"stratus_reranker_load_seconds",
+	"Time it took to load the reranker model",
+)
+RERANK_QUEUE_SECONDS = Histogram(
+	"stratus_rerank_queue_seconds",
+	"Time a rerank request waited for its batch to start",
+	buckets=LATENCY_BUCKETS,
+)
+RERANK_BATCH_SECONDS = Histogram(
+	"stratus_rerank_batch_duration_seconds",
+	"Time of a reranker forward pass",
+	["outcome"],
+	buckets=LATENCY_BUCKETS,
+)
+RERANK_BATCH_PAIRS = Histogram(
+	"stratus_rerank_batch_pairs",
+	"(query, chunk) pairs scored by a reranker forward pass",
+	buckets=SIZE_BUCKETS,
+)
+CONTEXT_TOKENS = Counter(
+	"stratus_context_tokens_total",
+	"Tokens of the retrieved chunks and of the packed context sent to the LLM",
+	["kind"],
+)
+
+LLM_REQUEST_SECONDS = Histogram(
+	"stratus_llm_request_duration_seconds",
+	"Time of an LLM call",
+	["model", "outcome"],
+	buckets=LATENCY_BUCKETS,
+)
+LLM_TOKENS = Counter(
+	"stratus_llm_tokens_total",
+	"Tokens sent to and generated by the LLM",
+	["model", "kind"],
+)
+EMBEDDING_REQUEST_SECONDS = Histogram(
+	"stratus_embedding_request_duration_seconds",
+	"Time of an embedding call",
+	["model", "outcome"],
+	buckets=LATENCY_BUCKETS,
+)
+EMBEDDING_TEXTS = Counter(
+	"stratus_embedding_texts_total",
+	"Texts embedded",
+	["model"],
+)
+EMBEDDING_TOKENS = Counter(
+	"stratus_embedding_tokens_total",
+	"Tokens embedded by remote providers",
+	["model"],
+)
+
+INDEX_STAGE_SECONDS = Histogram(
+	"stratus_index_stage_duration_seconds",
+	"Time for a batch of files to go through an indexing stage",
+	["stage"],
+	buckets=LATENCY_BUCKETS,
+)
+INDEX_FILES = Counter(
+	"stratus_index_files_total",
+	"Files that went through an indexing stage",
+	["stage"],
+)
+INDEX_CHUNKS = Counter(
+	"stratus_index_chunks_total",
+	"Chunks produced or embedded by an indexing stage",
+	["stage"],
+)
+INDEX_RUN_SECONDS = Histogram(
+	"stratus_index_run_duration_seconds",
+	"Time of a whole indexing run",
+	["outcome"],
+	buckets=(1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600, 7200),
+)
+
+
+@contextmanager
+def timed(histogram: Histogram, **labels: str):
+	"""
+	Observe the time spent in the block, with an `outcome` label of
+	`success` or `error`.
+	"""
+	started_at = time.perf_counter()
+	outcome = "error"
+	try:
+		yield
+		outcome = "success"
+	finally:
+		histogram.labels(**labels, outcome=outcome).observe(
+			time.perf_counter() - started_at
+		)
+
+
+def instrument_step(func: Callable) -> Callable:
+	"""
+	Time a workflow step, to be applied under `@step`.
+	"""
+
+	@wraps(func)
+	async def wrapper(self, *args, **kwargs):
+		with timed(
+			WORKFLOW_STEP_SECONDS, workflow=type(self).__name__, step=func.__name__
+		):
+			return await func(self, *args, **kwargs)
+
+	return wrapper
+
+
+def record_embedding(model: str, texts: int, tokens: int | None = None):
+	EMBEDDING_TEXTS.labels(model=model).inc(texts)
+	if tokens is not None:
+		EMBEDDING_TOKENS.labels(model=model).inc(tokens)
+
+
+def record_llm_tokens(model: str, prompt_tokens: int, completion_tokens: int):
+	LLM_TOKENS.labels(model=model, kind="prompt").inc(prompt_tokens or 0)
+	LLM_TOKENS.labels(model=model, kind="completion").inc(completion_tokens or 0)
+
+
+def _usage(response: Any) -> tuple[int, int]:
+	"""
+	Prompt and completion tokens of a provider response, as an object or a
+	dict in the OpenAI or the Ollama format.
+	"""
+	usage = getattr(response, "usage", None)
+	if usage is None and isinstance(response, dict):
+		usage = response.get("usage")
+	if usage is None and isinstance(response, dict):
+		return response.get("prompt_eval_count") or 0, response.get("eval_count") or 0
+	if isinstance(usage, dict):
+		return usage.get("prompt_tokens") or 0, usage.get("completion_tokens") or 0
+	return (
+		getattr(usage, "prompt_tokens", 0) or 0,
+		getattr(usage, "completion_tokens", 0) or 0,
+	)
+
+
+def _litellm_handler():
+	from litellm.integrations.custom_logger import CustomLogger
+
+	class LiteLLMMetrics(CustomLogger):
+		"""
+		Time and token counts of the LLM calls made through litellm: the
+		answer program and the streamed answers.
+		"""
+
+		def _observe(self, kwargs, response, start_time, end_time, outcome: str):
+			model = kwargs.get("model") or "unknown"
+			LLM_REQUEST_SECONDS.labels(model=model, outcome=outcome).observe(
+				(end_time - start_time).total_seconds()
+			)
+			if response is not None:
+				record_llm_tokens(model, *_usage(response))
+
+		def log_success_event(self, kwargs, response_obj, start_time, end_time):
+			self._observe(kwargs, response_obj, start_time, end_time, "success")
+
+		def log_failure_event(self, kwargs, response_obj, start_time, end_time):
+			self._observe(kwargs, None, start_time, end_time, "error")
+
+		async def async_log_success_event(
+			self, kwargs, response_obj, start_time, end_time
+		):
+			self._observe(kwargs, response_obj, start_time, end_time, "success")
+
+		async def async_log_failure_event(
+			self, kwargs, response_obj, start_time, end_time
+		):
+			self._observe(kwargs, None, start_time, end_time, "error")
+
+	return LiteLLMMetrics()
+
+
+def _llama_index_handler():
+	from llama_index.core.bridge.pydantic import PrivateAttr
+	from llama_index.core.instrumentation.event_handlers import BaseEventHandler
+	from llama_index.core.instrumentation.events.llm import (
+		LLMChatEndEvent,
+		LLMChatStartEvent,
+		LLMCompletionEndEvent,
+		LLMCompletionStartEvent,
+	)
+
+	class LlamaIndexLLMMetrics(BaseEventHandler):
+		"""
+		Time and token counts of the LLM calls made through llama-index, such
+		as the question generation. Start and end events are paired by span.
+		"""
+
+		_started: dict[str, tuple[float, str]] = PrivateAttr(default_factory=dict)
+
+		@classmethod
+		def class_name(cls) -> str:
+			return "LlamaIndexLLMMetrics"
+
+		def handle(self, event, **kwargs):
+			if isinstance(event, LLMChatStartEvent | LLMCompletionStartEvent):
+				model = (event.model_dict or {}).get("model") or "unknown"
+				self._started[event.span_id] = (event.timestamp.timestamp(), model)
+			elif isinstance(event, LLMChatEndEvent | LLMCompletionEndEvent):
+				started_at, model = self._started.pop(
+					event.span_id, (event.timestamp.timestamp(), "unknown")
+				)
+				LLM_REQUEST_SECONDS.labels(model=model, outcome="success").observe(
+					event.timestamp.timestamp() - started_at
+				)
+				if event.response is not None:
+					extra = event.response.additional_kwargs or {}
+					if "prompt_tokens" in extra:
+						record_llm_tokens(
+							model,
+							extra["prompt_tokens"],
+							extra.get("completion_tokens"),
+						)
+					else:
+						record_llm_tokens(model, *_usage(event.response.raw))
+
+	return LlamaIndexLLMMetrics()
+
+
+_metrics_initialized = False
+
+
+def init_metrics():
+	"""
+	Record the LLM calls made through litellm and llama-index. Calling it
+	again is a no-op, the handlers would count every call twice.
+	"""
+	global _metrics_initialized
+	if _metrics_initialized:
+		return
+	_metrics_initialized = True
+
+	import litellm
+	from llama_index.core.instrumentation import get_dispatcher
+
+	litellm.callbacks = [*litellm.callbacks, _litellm_handler()]
+	get_dispatcher().add_event_handler(_llama_index_handler())
+	logger.debug("Metrics enabled")
+
+
+async def monitor_event_loop(interval_ms: float = EVENT_LOOP_LAG_INTERVAL_MS):
+	"""
+	Sample how late the event loop wakes up from a sleep, which is how long
+	synchronous code blocked it. Runs until cancelled.
+	"""
+	loop = asyncio.get_running_loop()
+	if EVENT_LOOP_SLOW_CALLBACK_MS > 0:
+		# asyncio logs every callback and task step slower than this
+		loop.set_debug(True)
+		loop.slow_callback_duration = EVENT_LOOP_SLOW_CALLBACK_MS / 1000
+	interval = interval_ms / 1000
+	while True:
+		started_at = loop.time()
+		await asyncio.sleep(interval)
+		EVENT_LOOP_LAG_SECONDS.observe(max(loop.time() - started_at - interval, 0.0))
+
+
+def render_metrics() -> tuple[bytes, str]:
+	"""
+	The metrics in the Prometheus text format, with their content type.
+	"""
+	return generate_latest(), CONTENT_TYPE_LATEST
+
+
+class RequestMetricsMiddleware:
+	"""
+	ASGI middleware giving every request an id, from the `X-Request-ID`
+	header or generated, returned in the response headers and prefixed to
+	the logs, and timing the request by route.
+	"""
+
+	def __init__(self, app):
+		self.app = app
+
+	async def __call__(self, scope, receive, send):
+		if scope["type"] not in ("http", "websocket"):
+			await self.app(scope, receive, send)
+			return
+
+		header = dict(scope["headers"]).get(b"x-request-id", b"").decode("latin-1")
+		current = new_request_id(header)
+		token = request_id.set(current)
+		status = 500
+		started_at = time.perf_counter()
+
+		async def send_with_id(message):
+			nonlocal status
+			if message["type"] == "http.response.start":
+				status = message["status"]
+				message["headers"] = [
+					*message.get("headers", []),
+					(b"x-request-id", current.encode("latin-1")),
+				]
+			await send(message)
+
+		try:
+			await self.app(scope, receive, send_with_id)
+		finally:
+			if scope["type"] == "http":
+				route = scope.get("route")
+				HTTP_REQUEST_SECONDS.labels(
+					method=scope["method"],
+					# Templated paths, so ids don't create new series
+					route=getattr(route, "path_format", "unmatched"),
+					status=str(status),
+				).observe(time.perf_counter() - started_at)
+			request_id.reset(token)
+
+
+__all__ = [
+	"ANSWER_CACHE_LOOKUPS",
+	"BATCH_ANSWERS",
+	"CHAT_FIRST_TOKEN_SECONDS",
+	"CONTEXT_TOKENS",
+	"EMBEDDING_REQUEST_SECONDS",
+	"FEDERATED_SHARDS",
+	"INDEX_CHUNKS",
+	"INDEX_FILES",
+	"INDEX_RUN_SECONDS",
+	"INDEX_STAGE_SECONDS",
+	"RERANK_BATCH_PAIRS",
+	"RERANK_BATCH_SECONDS",
+	"RERANK_QUEUE_SECONDS",
+	"RERANKER_LOAD_SECONDS",
+	"RETRIEVER_SECONDS",
+	"RequestMetricsMiddleware",
+	"init_metrics",
+	"instrument_step",
+	"monitor_event_loop",
+	"record_embedding",
+	"render_metrics",
+	"timed",
+]
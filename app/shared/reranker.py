@@ -0,0 +1,270 @@
+import asyncio
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+
+from llama_index.core.schema import MetadataMode, NodeWithScore
+
+from app.config import (
+	RERANKER_BATCH_SIZE,
+	RERANKER_BATCH_WAIT_MS,
+	RERANKER_DEVICE,
+	RERANKER_MAX_LENGTH,
+	RERANKER_MODEL,
+	RERANKER_TOP_N,
+)
+from app.shared.metrics import (
+	RERANK_BATCH_PAIRS,
+	RERANK_BATCH_SECONDS,
+	RERANK_QUEUE_SECONDS,
+	RERANKER_LOAD_SECONDS,
+	timed,
+)
+from app.utils import logger
+
+
+@dataclass
+class _RerankRequest:
+	query: str
+	texts: list[str]
+	future: Future = field(default_factory=Future)
+	submitted_at: float = field(default_factory=time.perf_counter)
+
+
+class Reranker:
+	"""
+	Cross-encoder scoring (query, chunk) pairs on a dedicated worker thread.
+
+	Requests arriving within `batch_wait_ms` of each other are scored
+	together in a single forward pass of up to `batch_size` pairs, so
+	concurrent chats share the model instead of queueing behind each other.
+	"""
+
+	def __init__(
+		self,
+		model_name: str = RERANKER_MODEL,
+		device: str = RERANKER_DEVICE,
+		max_length: int = RERANKER_MAX_LENGTH,
+		batch_size: int = RERANKER_BATCH_SIZE,
+		batch_wait_ms: float = RERANKER_BATCH_WAIT_MS,
+		model=None,
+	):
+		"""
+		`model` replaces the cross-encoder, any object with the `predict`
+		method of `CrossEncoder` will do.
+		"""
+		self.model_name = model_name
+		self.batch_size = max(batch_size, 1)
+		self.batch_wait = batch_wait_ms / 1000
+		if model is None:
+			from sentence_transformers import CrossEncoder
+
+			model = CrossEncoder(model_name, max_length=max_length, device=device)
+		self._model = model
+		self._queue: queue.Queue[_RerankRequest | None] = queue.Queue()
+		# Nothing is queued once closed, the worker would never score it
+		self._closed = False
+		self._closed_lock = threading.Lock()
+		# Request that didn't fit in the previous batch
+		self._carry: _RerankRequest | None = None
+		self._thread = threading.Thread(target=self._run, name="reranker", daemon=True)
+		self._thread.start()
+
+	def _next_batch(self, first: _RerankRequest) -> tuple[list[_RerankRequest], bool]:
+		"""
+		Collect the requests queued within the batching window after `first`.
+		Returns them with whether the reranker was closed meanwhile.
+		"""
+		batch, pairs = [first], len(first.texts)
+		deadline = time.monotonic() + self.batch_wait
+		while pairs < self.batch_size:
+			timeout = deadline - time.monotonic()
+			if timeout <= 0:
+				break
+			try:
+				request = self._queue.get(timeout=timeout)
+			except queue.Empty:
+				break
+			if request is None:
+				return batch, True
+			if pairs + len(request.texts) > self.batch_size:
+				self._carry = request
+				break
+			batch.append(request)
+			pairs += len(request.texts)
+		return batch, False
+
+	def _run(self):
+		closed = False
+		while not closed or self._carry is not None:
+			request, self._carry = self._carry or self._queue.get(), None
+			if request is None:
+				break
+			batch, closed = self._next_batch(request)
+			# Requests cancelled while waiting are not scored
+			batch = [r for r in batch if r.future.set_running_or_notify_cancel()]
+			if not batch:
+				continue
+
+			started_at = time.perf_counter()
+			for r in batch:
+				RERANK_QUEUE_SECONDS.observe(started_at - r.submitted_at)
+			pairs = [(r.query, text) for r in batch for text in r.texts]
+			RERANK_BATCH_PAIRS.observe(len(pairs))
+			try:
+				with timed(RERANK_BATCH_SECONDS):
+					scores = self._model.predict(
+						pairs, batch_size=self.batch_size, show_progress_bar=False
+					)
+			except Exception as e:
+				logger.error(f"Reranking failed: {e}")
+				for r in batch:
+					r.future.set_exception(e)
+				continue
+
+			logger.debug(f"Reranked {len(pairs)} pairs of {len(batch)} requests")
+			offset = 0
+			for r in batch:
+				r.future.set_result(scores[offset : offset + len(r.texts)].tolist())
+				offset += len(r.texts)
+
+	def submit(self, query: str, texts: list[str]) -> Future:
+		"""
+		Queue the scoring of `texts` against `query`, the future resolves to
+		one score per text. It fails if the reranker is closed.
+		"""
+		request = _RerankRequest(query=query, texts=texts)
+		if not texts:
+			request.future.set_result([])
+			return request.future
+		with self._closed_lock:
+			if self._closed:
+				request.future.set_exception(RuntimeError("Reranker is closed"))
+			else:
+				self._queue.put(request)
+		return request.future
+
+	def warm_up(self):
+		"""
+		Run a first batch so the weights and kernels are loaded before the
+		first request.
+		"""
+		self.submit("warm up", ["warm up"] * self.batch_size).result()
+
+	def close(self):
+		"""
+		Score the requests queued so far and stop the worker thread. Blocks
+		until it exits, requests it left behind fail.
+		"""
+		with self._closed_lock:
+			if self._closed:
+				return
+			self._closed = True
+			self._queue.put(None)
+		self._thread.join()
+
+		pending = [self._carry] if self._carry is not None else []
+		self._carry = None
+		while True:
+			try:
+				pending.append(self._queue.get_nowait())
+			except queue.Empty:
+				break
+		for request in pending:
+			if request is not None and request.future.set_running_or_notify_cancel():
+				request.future.set_exception(RuntimeError("Reranker is closed"))
+
+	def _top_nodes(
+		self, nodes: list[NodeWithScore], scores: list[float], top_n: int
+	) -> list[NodeWithScore]:
+		for node, score in zip(nodes, scores, strict=True):
+			node.score = score
+		return sorted(nodes, key=lambda node: node.score, reverse=True)[:top_n]
+
+	def _texts(self, nodes: list[NodeWithScore]) -> list[str]:
+		return [
+			node.node.get_content(metadata_mode=MetadataMode.EMBED) for node in nodes
+		]
+
+	def rerank(
+		self, query: str, nodes: list[NodeWithScore], top_n: int = RERANKER_TOP_N
+	) -> list[NodeWithScore]:
+		scores = self.submit(query, self._texts(nodes)).result()
+		return self._top_nodes(nodes, scores, top_n)
+
+	async def arerank(
+		self, query: str, nodes: list[NodeWithScore], top_n: int = RERANKER_TOP_N
+	) -> list[NodeWithScore]:
+		scores = await asyncio.wrap_future(self.submit(query, self._texts(nodes)))
+		return self._top_nodes(nodes, scores, top_n)
+
+	async def arerank_many(
+		self,
+		requests: list[tuple[str, list[NodeWithScore]]],
+		top_n: int = RERANKER_TOP_N,
+	) -> list[list[NodeWithScore]]:
+		"""
+		Rerank the nodes of several queries. They are queued at once, so the
+		forward passes are full batches instead of waiting for the batching
+		window.
+		"""
+		futures = [self.submit(query, self._texts(nodes)) for query, nodes in requests]
+		scores = await asyncio.gather(*(asyncio.wrap_future(f) for f in futures))
+		return [
+			self._top_nodes(nodes, node_scores, top_n)
+			for (_, nodes), node_scores in zip(requests, scores, strict=True)
+		]
+
+
+_reranker: Reranker | None = None
+_reranker_lock = threading.Lock()
+
+
+def get_reranker() -> Reranker:
+	"""
+	Return the reranker of the process, loading the model on first use.
+	"""
+	global _reranker
+	with _reranker_lock:
+		if _reranker is None:
+			logger.info(f"Loading reranker {RERANKER_MODEL}")
+			started_at = time.perf_counter()
+			_reranker = Reranker()
+			RERANKER_LOAD_SECONDS.set(time.perf_counter() - started_at)
+		return _reranker
+
+
+def warm_up_reranker():
+	started_at = time.perf_counter()
+	get_reranker().warm_up()
+	logger.info(f"Reranker ready in {time.perf_counter() - started_at:.1f}s")
+
+
+def set_reranker(reranker: Reranker):
+	"""
+	Replace the reranker of the process, e.g. with a stub model in benchmarks.
+	"""
+	global _reranker
+	with _reranker_lock:
+		previous, _reranker = _reranker, reranker
+	if previous is not None:
+		previous.close()
+
+
+def shutdown_reranker():
+	global _reranker
+	with _reranker_lock:
+		if _reranker is not None:
+			_reranker.close()
+			_reranker = None
+
+
+__all__ = [
+	"Reranker",
+	"get_reranker",
+	"set_reranker",
+	"shutdown_reranker",
+	"warm_up_reranker",
+]
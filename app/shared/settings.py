@@ -3,8 +3,6 @@ import os
 
 from llama_index.core import Settings
 from llama_index.core.constants import DEFAULT_TEMPERATURE
-from llama_index.embeddings.ollama import OllamaEmbedding
-from llama_index.embeddings.openai import OpenAIEmbedding
 from llama_index.llms.ollama import Ollama
 from llama_index.llms.ollama.base import DEFAULT_CONTEXT_WINDOW, DEFAULT_REQUEST_TIMEOUT
 from llama_index.llms.openai import OpenAI
@@ -13,7 +11,7 @@ from llama_index.llms.openai.base import DEFAULT_OPENAI_MODEL
 from app.config import (
 	CHUNK_OVERLAP,
 	CHUNK_SIZE,
-	EMBEDDING_MODEL,
+	EMBEDDING_PROVIDER,
 	LLM_MAX_TOKENS,
 	LLM_MODEL,
 	LLM_PROVIDER,
@@ -21,6 +19,7 @@ from app.config import (
 	LLM_PROVIDER_BASE_URL,
 	LLM_TEMPERATURE,
 )
+from app.shared.embed_models import load_embedding_model
 
 logger = logging.getLogger("uvicorn")
 
@@ -28,18 +27,21 @@ logger = logging.getLogger("uvicorn")
 def init_settings():
 	logger.info(LLM_PROVIDER)
 	logger.debug(f"LLM: {LLM_MODEL}")
-	logger.debug(f"Embed_model: {EMBEDDING_MODEL}")
 
 	match LLM_PROVIDER:
 		case "openai":
 			logger.info("Loading OpenAI models")
-			llm, embed_model = init_openai()
+			llm = init_openai()
 		case "ollama":
 			logger.info("Loading Ollama models")
-			llm, embed_model = init_ollama()
+			llm = init_ollama()
 		case _:
 			raise ValueError(f"Invalid model provider: {LLM_PROVIDER}")
 
+	logger.info(f"Loading {EMBEDDING_PROVIDER} embedding model")
+	embed_model = load_embedding_model(provider=EMBEDDING_PROVIDER)
+	Settings.embed_model = embed_model
+
 	Settings.chunk_size = int(CHUNK_SIZE or "2048")
 	Settings.chunk_overlap = int(CHUNK_OVERLAP or "48")
 
@@ -53,9 +55,6 @@ def init_ollama():
 		os.getenv("OLLAMA_REQUEST_TIMEOUT", DEFAULT_REQUEST_TIMEOUT)
 	)
 
-	embed_model = OllamaEmbedding(
-		base_url=BASE_URL, model_name=EMBEDDING_MODEL, embed_batch_size=50
-	)
 	llm_model = Ollama(
 		base_url=BASE_URL,
 		model=LLM_MODEL,
@@ -65,9 +64,8 @@ def init_ollama():
 	)
 
 	Settings.llm = llm_model
-	Settings.embed_model = embed_model
 
-	return llm_model, embed_model
+	return llm_model
 
 
 def init_openai():
@@ -75,9 +73,6 @@ def init_openai():
 		os.getenv("OLLAMA_REQUEST_TIMEOUT", DEFAULT_REQUEST_TIMEOUT)
 	)
 
-	embed_model = OpenAIEmbedding(
-		api_key=LLM_PROVIDER_API_KEY, model_name=EMBEDDING_MODEL
-	)
 	llm_model = OpenAI(
 		api_key=LLM_PROVIDER_API_KEY,
 		model=LLM_MODEL or DEFAULT_OPENAI_MODEL,
@@ -88,6 +83,5 @@ def init_openai():
 	)
 
 	Settings.llm = llm_model
-	Settings.embed_model = embed_model
 
-	return llm_model, embed_model
+	return llm_model
@@ -0,0 +1,145 @@
+import threading
+from collections import OrderedDict
+from enum import Enum
+from typing import Protocol
+
+from app.config import VECTOR_INDEX_CACHE_SIZE, VECTOR_STORE_BACKEND
+
+
+class VectorStoreEnum(str, Enum):
+	CHROMA = "chroma"
+	FAISS = "faiss"
+
+
+class VectorIndexTypeEnum(str, Enum):
+	FLAT = "flat"
+	IVF = "ivf"
+	HNSW = "hnsw"
+
+
+class VectorCompressionEnum(str, Enum):
+	INT8 = "int8"
+	PQ = "pq"
+
+
+class VectorCollection(Protocol):
+	"""
+	Interface shared by the vector store backends (`ChromaDB`, `FaissDB`).
+	"""
+
+	collection_name: str
+
+	def as_vector_store(self): ...
+
+	def as_vector_store_index(self): ...
+
+	def drop_collection(self): ...
+
+	def delete_files(self, file_paths: list[str]): ...
+
+	def persist(self): ...
+
+	def close(self): ...
+
+
+def get_vector_db(
+	name: str,
+	vector_store: str | None = None,
+	index_type: str | None = None,
+	compression: str | None = None,
+) -> VectorCollection:
+	"""
+	Open the collection `name` with the given backend, defaulting to
+	`VECTOR_STORE_BACKEND`. `index_type` and `compression` only apply to
+	FAISS.
+	"""
+	backend = vector_store or VECTOR_STORE_BACKEND
+
+	match backend:
+		case VectorStoreEnum.CHROMA:
+			from app.shared.chroma_db import ChromaDB
+
+			return ChromaDB(name)
+		case VectorStoreEnum.FAISS:
+			from app.shared.faiss_db import FaissDB
+
+			return FaissDB(name, index_type=index_type, compression=compression)
+		case _:
+			raise ValueError(f"Invalid vector store: {backend}")
+
+
+def get_project_vector_db(project) -> VectorCollection:
+	"""
+	Open the collection of a project with the backend selected for it.
+	"""
+	return get_vector_db(
+		project.name,
+		vector_store=project.vector_store,
+		index_type=project.vector_index_type,
+		compression=project.vector_compression,
+	)
+
+
+_index_cache: OrderedDict[tuple, object] = OrderedDict()
+_index_cache_lock = threading.Lock()
+# Bumped by `invalidate_vector_index`, an index opened before the bump may
+# be missing the changes of the run that invalidated it
+_index_generations: dict[str, int] = {}
+
+
+def get_project_vector_index(project):
+	"""
+	Return the `VectorStoreIndex` used to query a project. Indexes are opened
+	once and the `VECTOR_INDEX_CACHE_SIZE` most recently used are kept open,
+	until `invalidate_vector_index` is called for the project.
+	"""
+	key = (
+		project.name,
+		project.vector_store,
+		project.vector_index_type,
+		project.vector_compression,
+	)
+	with _index_cache_lock:
+		if key in _index_cache:
+			_index_cache.move_to_end(key)
+			return _index_cache[key]
+		generation = _index_generations.get(project.name, 0)
+
+	# Opened outside the lock, loading a large index can take a while
+	index = get_project_vector_db(project).as_vector_store_index()
+	if VECTOR_INDEX_CACHE_SIZE <= 0:
+		return index
+
+	with _index_cache_lock:
+		if _index_generations.get(project.name, 0) != generation:
+			# Invalidated while opening, the next query opens it again
+			return index
+		index = _index_cache.setdefault(key, index)
+		_index_cache.move_to_end(key)
+		while len(_index_cache) > VECTOR_INDEX_CACHE_SIZE:
+			# Evicted indexes are released once no query uses them
+			_index_cache.popitem(last=False)
+	return index
+
+
+def invalidate_vector_index(name: str):
+	"""
+	Drop the cached indexes of the collection `name`, after it has been
+	re-indexed or deleted.
+	"""
+	with _index_cache_lock:
+		_index_generations[name] = _index_generations.get(name, 0) + 1
+		for key in [key for key in _index_cache if key[0] == name]:
+			del _index_cache[key]
+
+
+__all__ = [
+	"VectorCollection",
+	"VectorCompressionEnum",
+	"VectorIndexTypeEnum",
+	"VectorStoreEnum",
+	"get_project_vector_db",
+	"get_project_vector_index",
+	"get_vector_db",
+	"invalidate_vector_index",
+]
@@ -2,7 +2,10 @@ import logging
 import uuid
 from datetime import datetime, timezone
 
+from .request_context import RequestIdFilter
+
 logger = logging.getLogger("uvicorn")
+logger.addFilter(RequestIdFilter())
 
 
 def generate_uuid() -> uuid.UUID:
@@ -1,8 +1,12 @@
-from pathlib import Path
+from pathlib import Path, PurePosixPath
 
 from git import Repo
-from git.exc import InvalidGitRepositoryError, NoSuchPathError
-from llama_index.core import Document
+from git.exc import (
+	BadName,
+	GitCommandError,
+	InvalidGitRepositoryError,
+	NoSuchPathError,
+)
 from pathspec import PathSpec
 from pathspec.patterns.gitwildmatch import GitWildMatchPattern
 
@@ -21,32 +25,131 @@ def is_git_repo(directory: str):
 		return None
 
 
-def load_gitignore_patterns(directory: str) -> PathSpec:
+def get_head_commit(directory: str) -> str | None:
+	try:
+		return Repo(directory).head.commit.hexsha
+	except (InvalidGitRepositoryError, NoSuchPathError, ValueError):
+		# ValueError is raised for repositories without any commit yet
+		return None
+
+
+def get_changed_files(
+	directory: str, since: str, dirty_files: list[str] | None = None
+) -> tuple[list[str], list[str]]:
+	"""
+	Diff the working tree (including staged, unstaged and untracked files)
+	against the commit `since`.
+
+	`dirty_files` are the files that differed from `since` when it was
+	indexed, as returned by `get_dirty_files` then. They were indexed from
+	the working tree, so they are reported again even when the diff misses
+	them: reverted to `since`, or untracked and deleted since.
+
+	Returns a `(changed, removed)` tuple of paths relative to `directory`.
+	Renames are reported as a removal of the old path and a change of the
+	new one. Raises `ValueError` when `since` is not part of the repository
+	anymore (e.g. history was rewritten), in which case the caller has to
+	fall back to a full rebuild.
+	"""
+	repo = Repo(directory)
+	try:
+		output = repo.git.diff("--name-status", "--no-renames", since, "--")
+	except (BadName, GitCommandError):
+		raise ValueError(f"Commit {since} not found in repository.")
+
+	changed: set[str] = set()
+	removed: set[str] = set()
+	for line in output.splitlines():
+		change_type, _, file_path = line.partition("\t")
+		if not file_path:
+			continue
+		if change_type.startswith("D"):
+			removed.add(file_path)
+		else:
+			changed.add(file_path)
+
+	changed.update(repo.untracked_files)
+	for file_path in dirty_files or []:
+		if file_path not in changed and file_path not in removed:
+			is_file = (Path(directory) / file_path).is_file()
+			(changed if is_file else removed).add(file_path)
+	removed -= changed
+
+	return sorted(changed), sorted(removed)
+
+
+def get_dirty_files(directory: str) -> list[str] | None:
+	"""
+	Files of the working tree that differ from HEAD (modified, deleted and
+	untracked), or `None` when the repository has no commit yet.
+	"""
+	try:
+		changed, removed = get_changed_files(directory, since="HEAD")
+	except ValueError:
+		return None
+	return sorted({*changed, *removed})
+
+
+def load_gitignore_patterns(directory: str, file_name: str = ".gitignore") -> PathSpec:
 	# Path to the .gitignore file
-	gitignore_path = Path(directory) / ".gitignore"
-	if not gitignore_path.exists():
+	gitignore_path = Path(directory) / file_name
+	if not gitignore_path.is_file():
 		# If there’s no .gitignore, create an empty PathSpec (matches nothing)
 		return PathSpec.from_lines(GitWildMatchPattern, [])
 
-	with gitignore_path.open("r") as f:
+	with gitignore_path.open("r", errors="ignore") as f:
 		lines = f.read().splitlines()
 	# PathSpec automatically ignores blank and comment lines
 	return PathSpec.from_lines(GitWildMatchPattern, lines)
 
 
-def exclude_ignored_documents(
-	directory: str, documents: list[Document]
-) -> list[Document]:
+class GitIgnoreMatcher:
 	"""
-	Return documents that are **not** matched by `.gitignore`
-	(i.e., the "included" documents).
+	Match paths of a repository against `.git/info/exclude` and every
+	`.gitignore` between the repository root and the path.
+
+	Deeper `.gitignore` files take precedence over shallower ones, which in
+	turn take precedence over `.git/info/exclude`, as in git itself. The
+	`.gitignore` of a directory is read once, the first time a path below
+	it is matched.
 	"""
-	spec = load_gitignore_patterns(directory)
 
-	included_docs = []
-	for doc in documents:
-		doc_path = str(doc.metadata["file_path"]).replace(directory, "")
-		if not spec.match_file(doc_path):
-			included_docs.append(doc)
+	def __init__(self, directory: str):
+		self.root = Path(directory)
+		self._exclude = load_gitignore_patterns(
+			str(self.root / ".git" / "info"), file_name="exclude"
+		)
+		self._specs: dict[PurePosixPath, PathSpec] = {}
+
+	def _spec_for(self, directory: PurePosixPath) -> PathSpec:
+		if directory not in self._specs:
+			self._specs[directory] = load_gitignore_patterns(str(self.root / directory))
+		return self._specs[directory]
+
+	def is_ignored(self, path: str, is_dir: bool = False) -> bool:
+		"""
+		Check a single path relative to the repository root. Parent
+		directories are not checked; callers walking the tree are expected
+		to prune ignored directories instead.
+		"""
+		file_path = PurePosixPath(path)
+		suffix = "/" if is_dir else ""
+
+		for directory in file_path.parents:
+			relative = file_path.relative_to(directory).as_posix() + suffix
+			result = self._spec_for(directory).check_file(relative)
+			if result.include is not None:
+				return result.include
+
+		return self._exclude.match_file(file_path.as_posix() + suffix)
 
-	return included_docs
+	def is_excluded(self, path: str) -> bool:
+		"""
+		Check a file path relative to the repository root, including every
+		parent directory of it.
+		"""
+		file_path = PurePosixPath(path)
+		for directory in reversed(file_path.parents[:-1]):
+			if self.is_ignored(directory.as_posix(), is_dir=True):
+				return True
+		return self.is_ignored(file_path.as_posix())
@@ -0,0 +1,39 @@
+import logging
+import re
+import uuid
+from contextvars import ContextVar
+
+# Id of the request (or indexing job) being handled, set by the middleware.
+# Asyncio tasks and `asyncio.to_thread` inherit it, so every log line of a
+# request carries it.
+request_id: ContextVar[str | None] = ContextVar("request_id", default=None)
+
+_VALID_REQUEST_ID = re.compile(r"[\w.:-]{1,128}")
+
+
+def new_request_id(header: str | None = None) -> str:
+	"""
+	Use the id sent by the client or the proxy when it is safe to log,
+	otherwise generate one.
+	"""
+	if header and _VALID_REQUEST_ID.fullmatch(header):
+		return header
+	return uuid.uuid4().hex
+
+
+class RequestIdFilter(logging.Filter):
+	"""
+	Prefix log messages with the id of the current request.
+	"""
+
+	def filter(self, record: logging.LogRecord) -> bool:
+		current = request_id.get()
+		record.request_id = current
+		if current and not getattr(record, "_request_id_prefixed", False):
+			record.msg = f"[{current}] {record.getMessage()}"
+			record.args = ()
+			record._request_id_prefixed = True
+		return True
+
+
+__all__ = ["RequestIdFilter", "new_request_id", "request_id"]
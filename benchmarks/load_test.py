@@ -0,0 +1,530 @@
+"""
+Load the HTTP API with concurrent clients and report the throughput, the
+tail latency and the error rate of each endpoint, and how long the event
+loop of the server was blocked meanwhile.
+
+By default the service runs in a child process on a synthetic repository,
+with the stub providers of `benchmarks.stubs`, so runs are offline:
+
+	python -m benchmarks.load_test --concurrency 32 --duration 30
+
+It can also load a running instance, whose providers are then real:
+
+	python -m benchmarks.load_test --url http://localhost:8000 --project-id <id>
+
+The event loop lag comes from the `stratus_event_loop_lag_seconds`
+histogram of `/metrics`, its percentiles are bucket upper bounds.
+"""
+
+import asyncio
+import json
+import os
+import random
+import socket
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+from multiprocessing import get_context
+from pathlib import Path
+from typing import Annotated
+
+import httpx
+import numpy as np
+import typer
+from prometheus_client.parser import text_string_to_metric_families
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from benchmarks.synthetic_repo import DEFAULT_MIX as DEFAULT_LANGUAGES  # noqa: E402
+from benchmarks.synthetic_repo import (  # noqa: E402
+	generate_questions,
+	generate_repository,
+)
+
+ENDPOINTS = ("chat", "project", "generate")
+DEFAULT_MIX = "chat=0.6,project=0.3,generate=0.1"
+LOOP_LAG_METRIC = "stratus_event_loop_lag_seconds"
+# Questions stored for the project, so /generate lists them instead of
+# asking the LLM for new ones
+SEEDED_QUESTIONS = 10
+
+app_cli = typer.Typer()
+
+
+@dataclass
+class Sample:
+	endpoint: str
+	started_at: float
+	latency_ms: float
+	status: int | None = None
+	error: str | None = None
+
+	@property
+	def failed(self) -> bool:
+		return self.error is not None or self.status >= 400
+
+
+def parse_mix(mix: str) -> dict[str, float]:
+	"""
+	Parse `chat=0.6,project=0.4` into the weight of each endpoint.
+	"""
+	weights = {}
+	for part in mix.split(","):
+		endpoint, _, weight = part.partition("=")
+		endpoint = endpoint.strip()
+		if endpoint not in ENDPOINTS:
+			raise ValueError(f"Unsupported endpoint: {endpoint}")
+		weights[endpoint] = float(weight or 1)
+	return weights
+
+
+def _free_port() -> int:
+	with socket.socket() as sock:
+		sock.bind(("127.0.0.1", 0))
+		return sock.getsockname()[1]
+
+
+def _prepare_project(repo_path: str, options: dict):
+	from git import Repo
+
+	from app.database import create_db_and_tables
+	from app.modules.projects import (
+		ProjectSchemas,
+		ProjectService,
+		ProjectStatusEnum,
+		ProjectStatusService,
+	)
+	from app.modules.questions.models import QuestionBase
+	from app.modules.questions.service import QuestionService
+	from benchmarks.pipeline import _index
+
+	create_db_and_tables()
+	project = ProjectService().create_project(
+		ProjectSchemas.ProjectCreate(
+			name="load-test", path=repo_path, vector_store=options["vector_store"]
+		)
+	)
+	asyncio.run(_index(project, repo_path))
+
+	status_service = ProjectStatusService()
+	status = status_service.get_project_status_by_project_id(project.id)
+	status_service.update_project_status(
+		project_status_id=status.id,
+		status=ProjectStatusEnum.SUCCESS,
+		commit_sha=Repo(repo_path).head.commit.hexsha,
+	)
+	question_service = QuestionService()
+	for i, question in enumerate(generate_questions(SEEDED_QUESTIONS, seed=1)):
+		question_service.create_question(
+			project.id, QuestionBase(question=question, level=i % 3 + 1)
+		)
+
+
+def serve(workdir: str, repo_path: str, port: int, options: dict):
+	"""
+	Run the service with the stub providers on an indexed synthetic project,
+	in a child process.
+	"""
+	# The database and the stores are created in the working directory
+	os.chdir(workdir)
+	os.environ.setdefault("ANONYMIZED_TELEMETRY", "False")
+	os.environ.setdefault("RAG_API_KEY", "stub")
+	os.environ["ANSWER_CACHE_ENABLED"] = str(options["answer_cache"]).lower()
+	os.environ["EVENT_LOOP_SLOW_CALLBACK_MS"] = str(options["slow_callback_ms"])
+
+	import uvicorn
+
+	import main
+	from benchmarks.stubs import install_stub_providers
+
+	def init_stub_settings():
+		init_settings()
+		install_stub_providers(
+			embed_dim=options["embed_dim"],
+			embed_latency_ms=options["embed_latency_ms"],
+			rerank_latency_ms=options["rerank_latency_ms"],
+			llm_latency_ms=options["llm_latency_ms"],
+		)
+
+	# The providers are configured when the server starts, the stubs replace
+	# them before the reranker is warmed up
+	init_settings = main.init_settings
+	main.init_settings = init_stub_settings
+	init_stub_settings()
+	_prepare_project(repo_path, options)
+	uvicorn.run(
+		main.app, host="127.0.0.1", port=port, log_level="warning", loop="asyncio"
+	)
+
+
+async def _wait_until_ready(client: httpx.AsyncClient, timeout: float, server=None):
+	deadline = time.perf_counter() + timeout
+	while time.perf_counter() < deadline:
+		if server is not None and not server.is_alive():
+			raise RuntimeError(f"The server exited with code {server.exitcode}")
+		try:
+			if (await client.get("/")).status_code == 200:
+				return
+		except httpx.TransportError:
+			pass
+		await asyncio.sleep(0.5)
+	raise TimeoutError(f"The server was not ready after {timeout:.0f}s")
+
+
+async def _find_project_id(client: httpx.AsyncClient) -> str:
+	response = await client.get("/project/")
+	response.raise_for_status()
+	projects = response.json()["projects"]
+	if not projects:
+		raise RuntimeError("The server has no project, pass --project-id")
+	return projects[0]["id"]
+
+
+def _request(endpoint: str, project_id: str, question: str) -> dict:
+	match endpoint:
+		case "chat":
+			body = {"project_id": project_id, "query": question}
+			return {"method": "POST", "url": "/chat/", "json": body}
+		case "project":
+			return {"method": "GET", "url": "/project/"}
+		case "generate":
+			return {
+				"method": "POST",
+				"url": "/generate",
+				"json": {"project_id": project_id},
+			}
+	raise ValueError(f"Unsupported endpoint: {endpoint}")
+
+
+async def _send(client: httpx.AsyncClient, endpoint: str, request: dict) -> Sample:
+	started_at = time.perf_counter()
+	try:
+		response = await client.request(**request)
+		status, error = response.status_code, None
+	except httpx.HTTPError as e:
+		status, error = None, type(e).__name__
+	latency_ms = (time.perf_counter() - started_at) * 1000
+	return Sample(endpoint, started_at, latency_ms, status, error)
+
+
+async def _client_loop_lag(lags: list[float], interval: float = 0.05):
+	"""
+	Lag of the load generator itself: when it is high, the client is the
+	bottleneck and the measured latencies are inflated.
+	"""
+	loop = asyncio.get_running_loop()
+	while True:
+		started_at = loop.time()
+		await asyncio.sleep(interval)
+		lags.append((loop.time() - started_at - interval) * 1000)
+
+
+async def run_load(
+	client: httpx.AsyncClient,
+	project_id: str,
+	mix: dict[str, float],
+	concurrency: int,
+	duration: float,
+	requests: int | None,
+	questions: list[str],
+	seed: int = 0,
+) -> tuple[list[Sample], float, list[float]]:
+	"""
+	Send requests from `concurrency` clients, each waiting for its response
+	before the next request, until `requests` were sent or for `duration`
+	seconds. Returns the samples, the elapsed seconds and the lags of the
+	client event loop.
+	"""
+	rng = random.Random(seed)
+	endpoints = rng.choices(list(mix), weights=list(mix.values()), k=requests or 1)
+	samples: list[Sample] = []
+	issued = 0
+
+	async def worker():
+		nonlocal issued
+		while True:
+			if requests is not None:
+				if issued >= requests:
+					return
+				endpoint = endpoints[issued]
+			else:
+				if time.perf_counter() >= deadline:
+					return
+				endpoint = rng.choices(list(mix), weights=list(mix.values()))[0]
+			question = questions[issued % len(questions)]
+			issued += 1
+			samples.append(
+				await _send(client, endpoint, _request(endpoint, project_id, question))
+			)
+
+	lags: list[float] = []
+	monitor = asyncio.create_task(_client_loop_lag(lags))
+	started_at = time.perf_counter()
+	deadline = started_at + duration
+	await asyncio.gather(*(worker() for _ in range(concurrency)))
+	elapsed = time.perf_counter() - started_at
+	monitor.cancel()
+	return samples, elapsed, lags
+
+
+def summarize(samples: list[Sample], elapsed: float) -> dict:
+	latencies = [sample.latency_ms for sample in samples]
+	errors = Counter(
+		sample.error or str(sample.status) for sample in samples if sample.failed
+	)
+	summary = {
+		"requests": len(samples),
+		"requests_per_sec": len(samples) / elapsed,
+		"error_rate": sum(errors.values()) / len(samples) if samples else 0.0,
+		"errors": dict(errors),
+	}
+	if latencies:
+		summary.update(
+			mean_ms=float(np.mean(latencies)),
+			p50_ms=float(np.percentile(latencies, 50)),
+			p95_ms=float(np.percentile(latencies, 95)),
+			p99_ms=float(np.percentile(latencies, 99)),
+			max_ms=float(np.max(latencies)),
+		)
+	return summary
+
+
+async def _loop_lag_histogram(client: httpx.AsyncClient) -> dict | None:
+	"""
+	Cumulative bucket counts of the event loop lag histogram of the server,
+	with its sum and count.
+	"""
+	response = await client.get("/metrics")
+	if response.status_code != 200:
+		return None
+	for family in text_string_to_metric_families(response.text):
+		if family.name != LOOP_LAG_METRIC:
+			continue
+		histogram = {"buckets": {}, "sum": 0.0, "count": 0.0}
+		for sample in family.samples:
+			if sample.name.endswith("_bucket"):
+				histogram["buckets"][float(sample.labels["le"])] = sample.value
+			elif sample.name.endswith("_sum"):
+				histogram["sum"] = sample.value
+			elif sample.name.endswith("_count"):
+				histogram["count"] = sample.value
+		return histogram
+	return None
+
+
+def loop_lag_summary(before: dict | None, after: dict | None) -> dict | None:
+	"""
+	Event loop lag of the server during the run, from the difference of two
+	scrapes of its histogram. Percentiles are the upper bound of the bucket
+	they fall in.
+	"""
+	if before is None or after is None:
+		return None
+	count = after["count"] - before["count"]
+	if count <= 0:
+		return None
+	summary = {
+		"samples": int(count),
+		"mean_ms": (after["sum"] - before["sum"]) / count * 1000,
+	}
+	bounds = sorted(after["buckets"])
+	for quantile in (50, 95, 99):
+		for bound in bounds:
+			observed = after["buckets"][bound] - before["buckets"].get(bound, 0.0)
+			if observed >= count * quantile / 100:
+				summary[f"p{quantile}_ms"] = bound * 1000
+				break
+	return summary
+
+
+async def load_server(
+	base_url: str, project_id: str | None, options: dict, server=None
+):
+	limits = httpx.Limits(
+		max_connections=options["concurrency"],
+		max_keepalive_connections=options["concurrency"],
+	)
+	async with httpx.AsyncClient(
+		base_url=base_url, timeout=options["timeout"], limits=limits
+	) as client:
+		await _wait_until_ready(client, options["startup_timeout"], server)
+		project_id = project_id or await _find_project_id(client)
+		mix = parse_mix(options["mix"])
+		questions = generate_questions(max(options["queries"], 1), options["seed"])
+
+		# Open the indexes and fill the connection pool before timing
+		for endpoint in mix:
+			for question in questions[: options["warmup"]]:
+				await _send(client, endpoint, _request(endpoint, project_id, question))
+
+		lag_before = await _loop_lag_histogram(client)
+		samples, elapsed, client_lags = await run_load(
+			client,
+			project_id,
+			mix,
+			options["concurrency"],
+			options["duration"],
+			options["requests"],
+			questions,
+			options["seed"],
+		)
+		lag_after = await _loop_lag_histogram(client)
+
+	by_endpoint = defaultdict(list)
+	for sample in samples:
+		by_endpoint[sample.endpoint].append(sample)
+	return {
+		"seconds": elapsed,
+		"total": summarize(samples, elapsed),
+		"endpoints": {
+			endpoint: summarize(values, elapsed)
+			for endpoint, values in sorted(by_endpoint.items())
+		},
+		"server_loop_lag": loop_lag_summary(lag_before, lag_after),
+		"client_loop_lag_max_ms": max(client_lags, default=0.0),
+	}
+
+
+def _print_results(results: dict):
+	columns = ("p50_ms", "p95_ms", "p99_ms", "max_ms")
+	typer.echo(
+		f"\n{'endpoint':<10}{'requests':>10}{'req/s':>10}{'errors':>8}"
+		+ "".join(f"{column[:-3]:>10}" for column in columns)
+	)
+	rows = [*results["endpoints"].items(), ("total", results["total"])]
+	for name, summary in rows:
+		typer.echo(
+			f"{name:<10}{summary['requests']:>10}{summary['requests_per_sec']:>10.1f}"
+			f"{summary['error_rate']:>8.1%}"
+			+ "".join(f"{summary.get(column, 0.0):>10.1f}" for column in columns)
+		)
+	if results["total"]["errors"]:
+		typer.echo(f"errors: {results['total']['errors']}")
+
+	lag = results["server_loop_lag"]
+	if lag:
+		typer.echo(
+			f"\nserver event loop lag: mean {lag['mean_ms']:.1f} ms, "
+			+ ", ".join(
+				f"p{q} <= {lag[f'p{q}_ms']:.1f} ms"
+				for q in (50, 95, 99)
+				if f"p{q}_ms" in lag
+			)
+		)
+	else:
+		typer.echo("\nserver event loop lag: not reported by /metrics")
+	typer.echo(f"client event loop lag: max {results['client_loop_lag_max_ms']:.1f} ms")
+
+
+@app_cli.command()
+def main(
+	url: Annotated[
+		str | None, typer.Option(help="Load a running instance instead of a stub one")
+	] = None,
+	project_id: Annotated[
+		str | None,
+		typer.Option(help="Project to query, the first one of the server by default"),
+	] = None,
+	concurrency: Annotated[int, typer.Option(help="Concurrent clients")] = 16,
+	duration: Annotated[float, typer.Option(help="Seconds of load")] = 30.0,
+	requests: Annotated[
+		int | None, typer.Option(help="Send this many requests instead of --duration")
+	] = None,
+	mix: Annotated[
+		str, typer.Option(help="Request mix, e.g. chat=0.6,project=0.3,generate=0.1")
+	] = DEFAULT_MIX,
+	queries: Annotated[int, typer.Option(help="Distinct chat questions")] = 200,
+	warmup: Annotated[
+		int, typer.Option(help="Untimed requests per endpoint before the load")
+	] = 3,
+	timeout: Annotated[float, typer.Option(help="Timeout of a request")] = 60.0,
+	files: Annotated[int, typer.Option(help="Files in the synthetic repository")] = 200,
+	languages: Annotated[
+		str, typer.Option(help="Language mix of the synthetic repository")
+	] = DEFAULT_LANGUAGES,
+	vector_store: Annotated[str, typer.Option(help="chroma or faiss")] = "faiss",
+	embed_dim: Annotated[int, typer.Option(help="Dimension of the stub vectors")] = 256,
+	embed_latency_ms: Annotated[
+		float, typer.Option(help="Simulated latency of an embedding request")
+	] = 0.0,
+	rerank_latency_ms: Annotated[
+		float, typer.Option(help="Simulated latency of a rerank batch")
+	] = 0.0,
+	llm_latency_ms: Annotated[
+		float, typer.Option(help="Simulated latency of an LLM call")
+	] = 0.0,
+	answer_cache: Annotated[
+		bool, typer.Option(help="Let the stub server answer from its answer cache")
+	] = False,
+	slow_callback_ms: Annotated[
+		float,
+		typer.Option(help="Make the stub server log callbacks blocking it this long"),
+	] = 0.0,
+	startup_timeout: Annotated[
+		float, typer.Option(help="Seconds to wait for the server")
+	] = 300.0,
+	seed: Annotated[int, typer.Option()] = 0,
+	output: Annotated[
+		Path | None, typer.Option(help="Write the results as JSON")
+	] = None,
+):
+	"""
+	Load /chat/, /project/ and /generate with concurrent clients.
+	"""
+	options = {
+		"concurrency": concurrency,
+		"duration": duration,
+		"requests": requests,
+		"mix": mix,
+		"queries": queries,
+		"warmup": warmup,
+		"timeout": timeout,
+		"startup_timeout": startup_timeout,
+		"seed": seed,
+	}
+	if url:
+		results = asyncio.run(load_server(url.rstrip("/"), project_id, options))
+	else:
+		options |= {
+			"files": files,
+			"languages": languages,
+			"vector_store": vector_store,
+			"embed_dim": embed_dim,
+			"embed_latency_ms": embed_latency_ms,
+			"rerank_latency_ms": rerank_latency_ms,
+			"llm_latency_ms": llm_latency_ms,
+			"answer_cache": answer_cache,
+			"slow_callback_ms": slow_callback_ms,
+		}
+		with tempfile.TemporaryDirectory() as tmp_dir:
+			repo_path = str(Path(tmp_dir) / "repo")
+			counts = generate_repository(Path(repo_path), files, languages, seed=seed)
+			typer.echo(f"Generated {files} files: {counts}")
+			workdir = Path(tmp_dir) / "work"
+			workdir.mkdir()
+
+			port = _free_port()
+			# Not a daemon, as the indexing of the server starts worker processes
+			server = get_context("spawn").Process(
+				target=serve, args=(str(workdir), repo_path, port, options)
+			)
+			server.start()
+			try:
+				results = asyncio.run(
+					load_server(f"http://127.0.0.1:{port}", None, options, server)
+				)
+			finally:
+				server.terminate()
+				server.join(timeout=30)
+
+	_print_results(results)
+	if output:
+		output.write_text(json.dumps({"options": options, **results}, indent=2))
+	if results["total"]["requests"] == 0:
+		raise typer.Exit(code=1)
+
+
+if __name__ == "__main__":
+	app_cli()
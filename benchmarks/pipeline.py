@@ -0,0 +1,331 @@
+"""
+Measure indexing throughput and query latency on a synthetic repository,
+with stub embedding, reranker and LLM providers so runs are offline and
+repeatable.
+
+Reports the files/sec of `load_documents`, the throughput of each stage of
+the ingestion pipeline, the p50/p95/p99 latency of every `RagWorkflow` step
+and of whole queries, and the peak resident memory. Results are written as
+JSON and can be checked against a previous run:
+
+	python -m benchmarks.pipeline --files 2000 --output baseline.json
+	python -m benchmarks.pipeline --files 2000 --baseline baseline.json
+
+The run fails when a throughput drops, or a latency or the memory grows, by
+more than `--threshold` compared with the baseline.
+"""
+
+import asyncio
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path
+from typing import Annotated
+
+import numpy as np
+import typer
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from benchmarks.synthetic_repo import (  # noqa: E402
+	DEFAULT_MIX,
+	generate_questions,
+	generate_repository,
+)
+
+# Latencies this small are noise, their changes are not regressions
+MIN_LATENCY_MS = 1.0
+
+app_cli = typer.Typer()
+
+
+def latency_summary(latencies_ms: list[float]) -> dict:
+	return {
+		"count": len(latencies_ms),
+		"mean_ms": float(np.mean(latencies_ms)),
+		"p50_ms": float(np.percentile(latencies_ms, 50)),
+		"p95_ms": float(np.percentile(latencies_ms, 95)),
+		"p99_ms": float(np.percentile(latencies_ms, 99)),
+	}
+
+
+def _peak_rss_mb(who: int = resource.RUSAGE_SELF) -> float:
+	return resource.getrusage(who).ru_maxrss / 1024
+
+
+async def _index(project, repo_path: str) -> dict:
+	from llama_index.core import Settings
+
+	from app.modules.indices.directory_loader import iter_file_batches
+	from app.modules.indices.ingestion_pipeline import build_ingestion_pipeline
+	from app.modules.indices.workers import ingest_file_batches, shutdown_worker_pools
+	from app.modules.symbols import SymbolService
+	from app.shared.lexical_index import get_lexical_index
+	from app.shared.vector_db import get_project_vector_db, invalidate_vector_index
+
+	vector_db = get_project_vector_db(project)
+	lexical_index = get_lexical_index(project.name)
+	pipeline = build_ingestion_pipeline(
+		collection_name=project.name,
+		embedding_model=Settings.embed_model,
+		vector_db=vector_db,
+		lexical_index=lexical_index,
+	)
+	symbol_service = SymbolService()
+	try:
+		stats = await ingest_file_batches(
+			path=repo_path,
+			file_batches=iter_file_batches(path=repo_path),
+			pipeline=pipeline,
+			on_symbols=lambda symbols: symbol_service.replace_files(
+				project.id, symbols
+			),
+		)
+		vector_db.persist()
+		lexical_index.persist()
+	finally:
+		lexical_index.close()
+		invalidate_vector_index(project.name)
+		shutdown_worker_pools()
+	stats.finished_at = time.perf_counter()
+
+	return {
+		"seconds": stats.seconds,
+		"files_per_sec": stats.files_loaded / stats.seconds,
+		"chunks_per_sec": stats.embed.chunks / stats.seconds,
+		"stages": stats.as_dict(),
+	}
+
+
+async def _query(project, questions: list[str]) -> dict:
+	from llama_index.core.instrumentation import get_dispatcher
+	from llama_index.core.instrumentation.span_handlers import SimpleSpanHandler
+
+	from app.modules.chat.workflow import RagWorkflow
+
+	# Every workflow step runs in a span named after it
+	spans = SimpleSpanHandler()
+	get_dispatcher().add_span_handler(spans)
+
+	latencies = []
+	for question in questions:
+		started_at = time.perf_counter()
+		await RagWorkflow(timeout=120).run(project_id=project.id, query=question)
+		latencies.append((time.perf_counter() - started_at) * 1000)
+
+	steps = defaultdict(list)
+	for span in spans.completed_spans:
+		# Span ids are the qualified name of the function and a uuid
+		name = span.id_.partition("-")[0]
+		if name.startswith(f"{RagWorkflow.__name__}."):
+			steps[name.partition(".")[2]].append(span.duration * 1000)
+	return {
+		"total": latency_summary(latencies),
+		"steps": {step: latency_summary(values) for step, values in steps.items()},
+	}
+
+
+def run_benchmark(workdir: str, repo_path: str, options: dict) -> dict:
+	# The database and the stores are created in the working directory
+	os.chdir(workdir)
+	os.environ.setdefault("ANONYMIZED_TELEMETRY", "False")
+
+	from benchmarks.stubs import install_stub_providers
+
+	install_stub_providers(
+		embed_dim=options["embed_dim"],
+		embed_latency_ms=options["embed_latency_ms"],
+		rerank_latency_ms=options["rerank_latency_ms"],
+		llm_latency_ms=options["llm_latency_ms"],
+	)
+
+	from app.database import create_db_and_tables
+	from app.modules.indices.directory_loader import load_documents
+	from app.modules.projects import ProjectSchemas, ProjectService
+
+	create_db_and_tables()
+	project = ProjectService().create_project(
+		ProjectSchemas.ProjectCreate(
+			name="benchmark",
+			path=repo_path,
+			vector_store=options["vector_store"],
+		)
+	)
+
+	started_at = time.perf_counter()
+	documents = load_documents(repo_path)
+	seconds = time.perf_counter() - started_at
+	files = len({document.metadata.get("file_path") for document in documents})
+	del documents
+
+	async def index_and_query():
+		indexing = await _index(project, repo_path)
+		questions = generate_questions(options["queries"], options["seed"])
+		return indexing, await _query(project, questions)
+
+	indexing, query = asyncio.run(index_and_query())
+	return {
+		"load_documents": {
+			"files": files,
+			"seconds": seconds,
+			"files_per_sec": files / seconds,
+		},
+		"indexing": indexing,
+		"query": query,
+		"peak_rss_mb": _peak_rss_mb(),
+		"workers_peak_rss_mb": _peak_rss_mb(resource.RUSAGE_CHILDREN),
+	}
+
+
+def _flatten(results: dict, prefix: str = "") -> dict[str, float]:
+	flat = {}
+	for key, value in results.items():
+		if isinstance(value, dict):
+			flat.update(_flatten(value, f"{prefix}{key}."))
+		elif isinstance(value, int | float):
+			flat[f"{prefix}{key}"] = float(value)
+	return flat
+
+
+def find_regressions(results: dict, baseline: dict, threshold: float) -> list[str]:
+	"""
+	Metrics worse than the baseline by more than `threshold` (0.2 is 20%):
+	throughputs (`*_per_sec`) that dropped, latencies (`*_ms`) and memory
+	(`*_mb`) that grew.
+	"""
+	current, previous = _flatten(results), _flatten(baseline)
+	regressions = []
+	for name, before in previous.items():
+		after = current.get(name)
+		if after is None or before <= 0:
+			continue
+		if name.endswith("_per_sec"):
+			change = (before - after) / before
+		elif name.endswith("_mb") or (
+			name.endswith("_ms") and max(before, after) >= MIN_LATENCY_MS
+		):
+			change = (after - before) / before
+		else:
+			continue
+		if change > threshold:
+			regressions.append(
+				f"{name}: {before:.2f} -> {after:.2f} ({change:+.0%} worse)"
+			)
+	return regressions
+
+
+def _print_results(results: dict):
+	typer.echo(
+		f"\nload_documents {results['load_documents']['files_per_sec']:>10.1f} files/s"
+	)
+	indexing = results["indexing"]
+	typer.echo(
+		f"indexing       {indexing['files_per_sec']:>10.1f} files/s "
+		f"{indexing['chunks_per_sec']:>10.1f} chunks/s"
+	)
+	for stage in ("discover", "read", "parse", "embed"):
+		stats = indexing["stages"][stage]
+		typer.echo(
+			f"  {stage:<12} {stats['files_per_sec']:>10.1f} files/s "
+			f"{stats['tokens_per_sec']:>10.1f} tokens/s"
+		)
+
+	typer.echo(f"\n{'query':<20}" + "".join(f"{c:>10}" for c in ("p50", "p95", "p99")))
+	query = results["query"]
+	for name, summary in [("total", query["total"]), *query["steps"].items()]:
+		typer.echo(
+			f"{name:<20}"
+			+ "".join(f"{summary[c]:>10.2f}" for c in ("p50_ms", "p95_ms", "p99_ms"))
+		)
+	typer.echo(
+		f"\npeak rss {results['peak_rss_mb']:.0f} MB, "
+		f"parse workers {results['workers_peak_rss_mb']:.0f} MB"
+	)
+
+
+def _run_isolated(fn, *args) -> dict:
+	with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as pool:
+		return pool.submit(fn, *args).result()
+
+
+@app_cli.command()
+def main(
+	files: Annotated[int, typer.Option(help="Files in the synthetic repository")] = 500,
+	languages: Annotated[
+		str, typer.Option(help="Language mix, e.g. python=0.5,go=0.5")
+	] = DEFAULT_MIX,
+	functions: Annotated[int, typer.Option(help="Average functions per file")] = 12,
+	queries: Annotated[int, typer.Option(help="Chat queries to time")] = 50,
+	vector_store: Annotated[str, typer.Option(help="chroma or faiss")] = "faiss",
+	embed_dim: Annotated[int, typer.Option(help="Dimension of the stub vectors")] = 256,
+	embed_latency_ms: Annotated[
+		float, typer.Option(help="Simulated latency of an embedding request")
+	] = 0.0,
+	rerank_latency_ms: Annotated[
+		float, typer.Option(help="Simulated latency of a rerank batch")
+	] = 0.0,
+	llm_latency_ms: Annotated[
+		float, typer.Option(help="Simulated latency of an LLM call")
+	] = 0.0,
+	seed: Annotated[int, typer.Option()] = 0,
+	output: Annotated[
+		Path | None, typer.Option(help="Write the results as JSON")
+	] = None,
+	baseline: Annotated[
+		Path | None, typer.Option(help="Results of a previous run to compare with")
+	] = None,
+	threshold: Annotated[
+		float, typer.Option(help="Tolerated regression against the baseline")
+	] = 0.2,
+):
+	"""
+	Index a synthetic repository and query it, with stub providers.
+	"""
+	options = {
+		"files": files,
+		"languages": languages,
+		"functions": functions,
+		"queries": queries,
+		"vector_store": vector_store,
+		"embed_dim": embed_dim,
+		"embed_latency_ms": embed_latency_ms,
+		"rerank_latency_ms": rerank_latency_ms,
+		"llm_latency_ms": llm_latency_ms,
+		"seed": seed,
+	}
+	with tempfile.TemporaryDirectory() as tmp_dir:
+		repo_path = str(Path(tmp_dir) / "repo")
+		counts = generate_repository(
+			Path(repo_path), files, languages, functions, seed=seed
+		)
+		typer.echo(f"Generated {files} files: {counts}")
+		workdir = Path(tmp_dir) / "work"
+		workdir.mkdir()
+		results = _run_isolated(run_benchmark, str(workdir), repo_path, options)
+
+	_print_results(results)
+	if output:
+		output.write_text(json.dumps({"options": options, **results}, indent=2))
+
+	if baseline:
+		previous = json.loads(baseline.read_text())
+		if previous.get("options") != options:
+			typer.echo("Warning: the baseline was run with other options")
+		previous.pop("options", None)
+		regressions = find_regressions(results, previous, threshold)
+		if regressions:
+			typer.echo(f"\n{len(regressions)} regressions over {threshold:.0%}:")
+			for regression in regressions:
+				typer.echo(f"  {regression}")
+			raise typer.Exit(code=1)
+		typer.echo(f"\nNo regression over {threshold:.0%} against {baseline}")
+
+
+if __name__ == "__main__":
+	app_cli()
@@ -0,0 +1,144 @@
+"""
+Deterministic stand-ins for the embedding model, the reranker model and the
+LLMs, so benchmarks run offline and measure the service rather than the
+providers. Each can simulate a provider latency.
+"""
+
+import asyncio
+import hashlib
+import re
+import time
+
+import dspy
+import numpy as np
+from llama_index.core import Settings
+from llama_index.core.base.embeddings.base import BaseEmbedding, Embedding
+from llama_index.core.llms import MockLLM
+from pydantic import Field
+
+_WORDS = re.compile(r"[A-Za-z]+|\d+")
+_CAMEL_PARTS = re.compile(r"[A-Z]+(?![a-z])|[A-Z]?[a-z]+|\d+")
+
+
+def _tokens(text: str) -> list[str]:
+	return [
+		part.lower()
+		for word in _WORDS.findall(text)
+		for part in _CAMEL_PARTS.findall(word)
+	]
+
+
+class HashEmbedding(BaseEmbedding):
+	"""
+	Hash the words of a text into a normalized bag of words vector. Texts
+	sharing words are close, so retrieval returns sensible chunks.
+	"""
+
+	dim: int = Field(default=256, gt=0)
+	latency_ms: float = Field(default=0.0, ge=0)
+
+	@classmethod
+	def class_name(cls) -> str:
+		return "HashEmbedding"
+
+	def _embed(self, text: str) -> Embedding:
+		vector = np.zeros(self.dim, dtype="float32")
+		for token in _tokens(text):
+			digest = hashlib.blake2b(token.encode(), digest_size=8).digest()
+			vector[int.from_bytes(digest, "little") % self.dim] += 1.0
+		norm = np.linalg.norm(vector)
+		return (vector / norm if norm else vector).tolist()
+
+	def _get_text_embeddings(self, texts: list[str]) -> list[Embedding]:
+		time.sleep(self.latency_ms / 1000)
+		return [self._embed(text) for text in texts]
+
+	async def _aget_text_embeddings(self, texts: list[str]) -> list[Embedding]:
+		# Wait like a remote provider, without blocking the event loop
+		await asyncio.sleep(self.latency_ms / 1000)
+		return [self._embed(text) for text in texts]
+
+	def _get_text_embedding(self, text: str) -> Embedding:
+		return self._get_text_embeddings([text])[0]
+
+	async def _aget_text_embedding(self, text: str) -> Embedding:
+		return (await self._aget_text_embeddings([text]))[0]
+
+	def _get_query_embedding(self, query: str) -> Embedding:
+		return self._get_text_embedding(query)
+
+	async def _aget_query_embedding(self, query: str) -> Embedding:
+		return await self._aget_text_embedding(query)
+
+
+class OverlapScorer:
+	"""
+	Score (query, text) pairs by the share of the query words found in the
+	text, with the `predict` signature of a sentence-transformers
+	`CrossEncoder`.
+	"""
+
+	def __init__(self, latency_ms: float = 0.0):
+		self.latency_ms = latency_ms
+
+	def predict(self, pairs: list[tuple[str, str]], **kwargs) -> np.ndarray:
+		time.sleep(self.latency_ms / 1000)
+		scores = []
+		for query, text in pairs:
+			query_tokens = set(_tokens(query))
+			found = query_tokens.intersection(_tokens(text))
+			scores.append(len(found) / len(query_tokens) if query_tokens else 0.0)
+		return np.asarray(scores, dtype="float32")
+
+
+class StubLM(dspy.LM):
+	"""
+	Answer every prompt with the same fields, in the format of the chat
+	adapter, after `latency_ms`.
+	"""
+
+	def __init__(self, latency_ms: float = 0.0):
+		super().__init__("stub/benchmark", "chat", 0.0, 1000, cache=False)
+		self.latency_ms = latency_ms
+
+	def __call__(self, prompt=None, messages=None, **kwargs) -> list[str]:
+		time.sleep(self.latency_ms / 1000)
+		text = prompt or (messages[-1]["content"] if messages else "")
+		digest = hashlib.blake2b(text.encode(), digest_size=4).hexdigest()
+		return [
+			"[[ ## reasoning ## ]]\n"
+			"The context holds the code the question is about.\n\n"
+			"[[ ## response ## ]]\n"
+			f"Stub answer {digest}.\n\n"
+			"[[ ## completed ## ]]"
+		]
+
+
+def install_stub_providers(
+	embed_dim: int = 256,
+	embed_latency_ms: float = 0.0,
+	rerank_latency_ms: float = 0.0,
+	llm_latency_ms: float = 0.0,
+):
+	"""
+	Replace the providers of the process with the stubs. Must run before
+	the first query, as query indexes keep the embedding model they were
+	opened with.
+	"""
+	from app.modules.chat import set_answer_lm
+	from app.shared.reranker import Reranker, set_reranker
+
+	Settings.embed_model = HashEmbedding(dim=embed_dim, latency_ms=embed_latency_ms)
+	Settings.llm = MockLLM(max_tokens=64)
+	set_answer_lm(StubLM(latency_ms=llm_latency_ms))
+	set_reranker(
+		Reranker(model_name="stub", model=OverlapScorer(latency_ms=rerank_latency_ms))
+	)
+
+
+__all__ = [
+	"HashEmbedding",
+	"OverlapScorer",
+	"StubLM",
+	"install_stub_providers",
+]
@@ -0,0 +1,278 @@
+"""
+Generate source trees of a given size and language mix, the same for a
+given seed, to benchmark indexing and queries without a real project.
+
+Files hold classes and functions named after a small domain vocabulary and
+calling each other, so chunking, symbol extraction and retrieval have
+realistic work to do.
+"""
+
+import random
+from pathlib import Path
+
+import git
+
+EXTENSIONS = {
+	"python": ".py",
+	"typescript": ".ts",
+	"javascript": ".js",
+	"go": ".go",
+	"java": ".java",
+	"rust": ".rs",
+}
+DEFAULT_MIX = "python=0.5,typescript=0.3,go=0.2"
+
+NOUNS = [
+	"account",
+	"invoice",
+	"order",
+	"payment",
+	"session",
+	"token",
+	"user",
+	"report",
+	"cache",
+	"queue",
+	"schedule",
+	"document",
+	"project",
+	"message",
+	"customer",
+	"shipment",
+]
+VERBS = [
+	"load",
+	"save",
+	"validate",
+	"compute",
+	"render",
+	"sync",
+	"merge",
+	"parse",
+	"refresh",
+	"archive",
+	"notify",
+	"export",
+]
+ADJECTIVES = ["pending", "expired", "active", "archived", "failed", "recent"]
+
+
+def parse_mix(mix: str) -> dict[str, float]:
+	"""
+	Parse `python=0.5,go=0.5` into the weight of each language.
+	"""
+	weights = {}
+	for part in mix.split(","):
+		language, _, weight = part.partition("=")
+		language = language.strip()
+		if language not in EXTENSIONS:
+			raise ValueError(f"Unsupported language: {language}")
+		weights[language] = float(weight or 1)
+	return weights
+
+
+def _camel(*words: str) -> str:
+	return "".join(word.capitalize() for word in words)
+
+
+def _snake(*words: str) -> str:
+	return "_".join(words)
+
+
+def _lower_camel(*words: str) -> str:
+	return words[0] + _camel(*words[1:])
+
+
+def _comment(rng: random.Random, noun: str) -> str:
+	verb, adjective = rng.choice(VERBS), rng.choice(ADJECTIVES)
+	return f"{verb.capitalize()} the {adjective} {noun} records and keep the totals in sync"
+
+
+def _python(rng: random.Random, noun: str, functions: int) -> str:
+	names = [_snake(rng.choice(VERBS), noun, str(i)) for i in range(functions)]
+	lines = [f'"""{_comment(rng, noun).capitalize()}."""', "", ""]
+	lines += [f"class {_camel(noun)}Service:", f'\t"""{_comment(rng, noun)}."""', ""]
+	for i, name in enumerate(names):
+		callee = names[i - 1] if i else None
+		lines += [
+			f"\tdef {name}(self, {noun}_id: int, limit: int = {rng.randint(5, 500)}):",
+			f'\t\t"""{_comment(rng, noun)}."""',
+			f"\t\titems = [{noun}_id * step for step in range(limit)]",
+		]
+		if callee:
+			lines += [
+				f"\t\tif {noun}_id % {rng.randint(2, 9)} == 0:",
+				f"\t\t\titems = [self.{callee}({noun}_id, limit // 2)]",
+			]
+		lines += [f"\t\treturn sum(items) % {rng.randint(97, 9973)}", ""]
+	return "\n".join(lines) + "\n"
+
+
+def _typescript(rng: random.Random, noun: str, functions: int, typed: bool) -> str:
+	names = [_lower_camel(rng.choice(VERBS), noun, str(i)) for i in range(functions)]
+	number = ": number" if typed else ""
+	lines = [f"// {_comment(rng, noun)}", f"export class {_camel(noun)}Service {{"]
+	for i, name in enumerate(names):
+		callee = names[i - 1] if i else None
+		lines += [
+			f"  // {_comment(rng, noun)}",
+			f"  {name}(id{number}, limit{number} = {rng.randint(5, 500)}){number} {{",
+			"    let total = 0;",
+			"    for (let step = 0; step < limit; step++) {",
+			"      total += id * step;",
+			"    }",
+		]
+		if callee:
+			lines += [
+				f"    if (id % {rng.randint(2, 9)} === 0) {{",
+				f"      total += this.{callee}(id, Math.floor(limit / 2));",
+				"    }",
+			]
+		lines += [f"    return total % {rng.randint(97, 9973)};", "  }"]
+	lines.append("}")
+	return "\n".join(lines) + "\n"
+
+
+def _go(rng: random.Random, noun: str, functions: int) -> str:
+	names = [_camel(rng.choice(VERBS), noun, str(i)) for i in range(functions)]
+	receiver = _camel(noun) + "Service"
+	lines = ["package main", "", f"// {receiver} {_comment(rng, noun)}"]
+	lines += [f"type {receiver} struct {{", "\tlimit int", "}", ""]
+	for i, name in enumerate(names):
+		callee = names[i - 1] if i else None
+		lines += [
+			f"// {name} {_comment(rng, noun)}",
+			f"func (s *{receiver}) {name}(id int) int {{",
+			"\ttotal := 0",
+			"\tfor step := 0; step < s.limit; step++ {",
+			"\t\ttotal += id * step",
+			"\t}",
+		]
+		if callee:
+			lines += [
+				f"\tif id%{rng.randint(2, 9)} == 0 {{",
+				f"\t\ttotal += s.{callee}(id / 2)",
+				"\t}",
+			]
+		lines += [f"\treturn total % {rng.randint(97, 9973)}", "}", ""]
+	return "\n".join(lines)
+
+
+def _java(rng: random.Random, noun: str, functions: int) -> str:
+	names = [_lower_camel(rng.choice(VERBS), noun, str(i)) for i in range(functions)]
+	lines = [f"// {_comment(rng, noun)}", f"public class {_camel(noun)}Service {{"]
+	for i, name in enumerate(names):
+		callee = names[i - 1] if i else None
+		lines += [
+			f"    // {_comment(rng, noun)}",
+			f"    public int {name}(int id, int limit) {{",
+			"        int total = 0;",
+			"        for (int step = 0; step < limit; step++) {",
+			"            total += id * step;",
+			"        }",
+		]
+		if callee:
+			lines += [
+				f"        if (id % {rng.randint(2, 9)} == 0) {{",
+				f"            total += {callee}(id, limit / 2);",
+				"        }",
+			]
+		lines += [f"        return total % {rng.randint(97, 9973)};", "    }"]
+	lines.append("}")
+	return "\n".join(lines) + "\n"
+
+
+def _rust(rng: random.Random, noun: str, functions: int) -> str:
+	names = [_snake(rng.choice(VERBS), noun, str(i)) for i in range(functions)]
+	receiver = _camel(noun) + "Service"
+	lines = [
+		f"/// {_comment(rng, noun)}",
+		f"pub struct {receiver} {{",
+		"    limit: u64,",
+	]
+	lines += ["}", "", f"impl {receiver} {{"]
+	for i, name in enumerate(names):
+		callee = names[i - 1] if i else None
+		lines += [
+			f"    /// {_comment(rng, noun)}",
+			f"    pub fn {name}(&self, id: u64) -> u64 {{",
+			"        let mut total = 0;",
+			"        for step in 0..self.limit {",
+			"            total += id * step;",
+			"        }",
+		]
+		if callee:
+			lines += [
+				f"        if id % {rng.randint(2, 9)} == 0 {{",
+				f"            total += self.{callee}(id / 2);",
+				"        }",
+			]
+		lines += [f"        total % {rng.randint(97, 9973)}", "    }"]
+	lines.append("}")
+	return "\n".join(lines) + "\n"
+
+
+def generate_source(language: str, rng: random.Random, noun: str, functions: int):
+	match language:
+		case "python":
+			return _python(rng, noun, functions)
+		case "typescript":
+			return _typescript(rng, noun, functions, typed=True)
+		case "javascript":
+			return _typescript(rng, noun, functions, typed=False)
+		case "go":
+			return _go(rng, noun, functions)
+		case "java":
+			return _java(rng, noun, functions)
+		case "rust":
+			return _rust(rng, noun, functions)
+	raise ValueError(f"Unsupported language: {language}")
+
+
+def generate_repository(
+	path: Path,
+	files: int,
+	mix: str = DEFAULT_MIX,
+	functions: int = 12,
+	seed: int = 0,
+	commit: bool = True,
+) -> dict[str, int]:
+	"""
+	Write `files` source files under `path`, spread over nested packages,
+	and commit them when `commit` is set, as projects must be git
+	repositories. Returns the number of files of each language.
+	"""
+	rng = random.Random(seed)
+	weights = parse_mix(mix)
+	languages = rng.choices(list(weights), weights=list(weights.values()), k=files)
+	counts = dict.fromkeys(weights, 0)
+	for i, language in enumerate(languages):
+		noun = rng.choice(NOUNS)
+		directory = path / f"pkg_{i % 16}" / f"{noun}s"
+		directory.mkdir(parents=True, exist_ok=True)
+		source = generate_source(language, rng, noun, rng.randint(1, functions * 2))
+		(directory / f"{noun}_{i}{EXTENSIONS[language]}").write_text(source)
+		counts[language] += 1
+
+	if commit:
+		repo = git.Repo.init(path)
+		repo.git.add(A=True)
+		repo.index.commit(
+			"Synthetic repository",
+			author=git.Actor("benchmark", "benchmark@localhost"),
+			committer=git.Actor("benchmark", "benchmark@localhost"),
+		)
+	return counts
+
+
+def generate_questions(count: int, seed: int = 0) -> list[str]:
+	"""
+	Natural language questions about the generated code, never plain symbol
+	lookups, so every query goes through retrieval and the LLM.
+	"""
+	rng = random.Random(seed)
+	return [
+		f"How does the {rng.choice(NOUNS)} service {rng.choice(VERBS)} "
+		f"{rng.choice(ADJECTIVES)} {rng.choice(NOUNS)}s?"
+		for _ in range(count)
+	]
@@ -0,0 +1,214 @@
+"""
+Compare the query latency, recall and memory of the vector store backends
+on synthetic embeddings.
+
+Every store is built in its own process, then queried from a fresh process
+that opens it read-only, the way the chat endpoints do, so the resident
+memory reported is the one of a serving process. Recall is measured against
+the exact neighbours, i.e. what an uncompressed flat index returns.
+
+Stores are named `chroma` or `faiss-<index type>[-<compression>]`:
+
+	python -m benchmarks.vector_stores --vectors 50000 --dim 1536 \
+		--stores faiss-flat,faiss-flat-int8,faiss-flat-pq,faiss-hnsw-pq
+"""
+
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path
+from typing import Annotated
+
+import numpy as np
+import typer
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+STORES = [
+	"chroma",
+	"faiss-flat",
+	"faiss-ivf",
+	"faiss-hnsw",
+	"faiss-flat-int8",
+	"faiss-flat-pq",
+	"faiss-ivf-pq",
+]
+COLLECTION_NAME = "benchmark"
+ADD_BATCH_SIZE = 1000
+
+app_cli = typer.Typer()
+
+
+def make_vectors(count: int, dim: int, seed: int = 0) -> np.ndarray:
+	"""
+	Normalized vectors drawn around a few hundred centroids, closer to real
+	embeddings than uniform noise.
+	"""
+	rng = np.random.default_rng(seed)
+	centroids = rng.standard_normal((max(count // 100, 1), dim), dtype="float32")
+	vectors = centroids[rng.integers(0, len(centroids), count)]
+	vectors += 0.5 * rng.standard_normal((count, dim), dtype="float32")
+	vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+	return vectors
+
+
+def _rss_mb() -> float:
+	with open("/proc/self/status") as status:
+		for line in status:
+			if line.startswith("VmRSS:"):
+				return int(line.split()[1]) / 1024
+	return 0.0
+
+
+def _open_vector_db(store: str, workdir: str):
+	# The backends resolve their paths from the working directory
+	os.chdir(workdir)
+	from app.shared.vector_db import get_vector_db
+
+	backend, _, index_type = store.partition("-")
+	index_type, _, compression = index_type.partition("-")
+	return get_vector_db(
+		COLLECTION_NAME,
+		vector_store=backend,
+		index_type=index_type or None,
+		compression=compression or None,
+	)
+
+
+def _size_mb(path: Path) -> float:
+	files = [path] if path.is_file() else [f for f in path.rglob("*") if f.is_file()]
+	return sum(f.stat().st_size for f in files) / 2**20
+
+
+def build_store(store: str, workdir: str, data_path: str) -> dict:
+	from llama_index.core.schema import TextNode
+
+	vector_db = _open_vector_db(store, workdir)
+	vectors = np.load(data_path)
+
+	started_at = time.perf_counter()
+	vector_store = vector_db.as_vector_store()
+	for start in range(0, len(vectors), ADD_BATCH_SIZE):
+		vector_store.add(
+			[
+				TextNode(
+					id_=f"node-{i}",
+					text=f"chunk {i}",
+					embedding=vectors[i].tolist(),
+					metadata={"file_path": f"/src/file_{i // 20}.py"},
+				)
+				for i in range(start, min(start + ADD_BATCH_SIZE, len(vectors)))
+			]
+		)
+	vector_db.persist()
+	build_seconds = time.perf_counter() - started_at
+
+	# FAISS keeps the chunks and exact vectors of compressed indexes on disk
+	# next to the index, only the index itself is loaded in memory
+	index_file = Path(workdir).glob("database/faiss/*/index.faiss")
+	index_path = next(index_file, None) or Path(workdir) / "database"
+	return {"build_seconds": build_seconds, "index_mb": _size_mb(index_path)}
+
+
+def query_store(
+	store: str, workdir: str, data_path: str, queries_path: str, top_k: int
+) -> dict:
+	from llama_index.core import MockEmbedding, Settings
+	from llama_index.core.vector_stores.types import VectorStoreQuery
+
+	vector_db = _open_vector_db(store, workdir)
+	queries = np.load(queries_path)
+	# The queries are embedded already, the index only needs an embed model
+	Settings.embed_model = MockEmbedding(embed_dim=queries.shape[1])
+	# Exact neighbours, computed before the baseline so they don't count
+	expected = np.argsort(-(queries @ np.load(data_path).T), axis=1)[:, :top_k]
+
+	baseline = _rss_mb()
+	started_at = time.perf_counter()
+	vector_store = vector_db.as_vector_store_index().vector_store
+	open_seconds = time.perf_counter() - started_at
+
+	latencies, hits = [], 0
+	for query, neighbours in zip(queries, expected, strict=True):
+		started_at = time.perf_counter()
+		result = vector_store.query(
+			VectorStoreQuery(query_embedding=query.tolist(), similarity_top_k=top_k)
+		)
+		latencies.append((time.perf_counter() - started_at) * 1000)
+		found = {int(node_id.removeprefix("node-")) for node_id in result.ids}
+		hits += len(found.intersection(neighbours.tolist()))
+
+	return {
+		"open_seconds": open_seconds,
+		"p50_ms": float(np.percentile(latencies, 50)),
+		"p95_ms": float(np.percentile(latencies, 95)),
+		f"recall@{top_k}": hits / expected.size,
+		"rss_mb": _rss_mb() - baseline,
+		"peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+	}
+
+
+def _run_isolated(fn, *args) -> dict:
+	with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as pool:
+		return pool.submit(fn, *args).result()
+
+
+@app_cli.command()
+def main(
+	vectors: Annotated[int, typer.Option(help="Vectors in the collection")] = 20_000,
+	dim: Annotated[int, typer.Option(help="Dimension of the vectors")] = 384,
+	queries: Annotated[int, typer.Option(help="Queries to time")] = 200,
+	top_k: Annotated[int, typer.Option()] = 10,
+	stores: Annotated[str, typer.Option(help="Comma separated stores")] = ",".join(
+		STORES
+	),
+	rescore: Annotated[
+		int, typer.Option(help="Candidates re-scored per result by compressed indexes")
+	] = 4,
+	output: Annotated[
+		Path | None, typer.Option(help="Write the results as JSON")
+	] = None,
+):
+	"""
+	Build each store with the same vectors and time queries against it.
+	"""
+	# Read by the store processes when they load the configuration
+	os.environ["FAISS_RESCORE_FACTOR"] = str(rescore)
+	results = {}
+	with tempfile.TemporaryDirectory() as tmp_dir:
+		data_path = str(Path(tmp_dir) / "vectors.npy")
+		queries_path = str(Path(tmp_dir) / "queries.npy")
+		np.save(data_path, make_vectors(vectors, dim))
+		np.save(queries_path, make_vectors(queries, dim, seed=1))
+
+		for store in stores.split(","):
+			workdir = str(Path(tmp_dir) / store)
+			os.makedirs(workdir)
+			typer.echo(f"Benchmarking {store}...")
+			results[store] = {
+				**_run_isolated(build_store, store, workdir, data_path),
+				**_run_isolated(
+					query_store, store, workdir, data_path, queries_path, top_k
+				),
+			}
+
+	columns = list(next(iter(results.values())))
+	typer.echo(f"\n{'store':<12}" + "".join(f"{column:>14}" for column in columns))
+	for store, result in results.items():
+		typer.echo(
+			f"{store:<12}" + "".join(f"{result[column]:>14.3f}" for column in columns)
+		)
+
+	if output:
+		output.write_text(
+			json.dumps({"vectors": vectors, "dim": dim, "results": results}, indent=2)
+		)
+
+
+if __name__ == "__main__":
+	app_cli()
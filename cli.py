@@ -2,6 +2,7 @@ import os
 import signal
 import subprocess
 from pathlib import Path
+from typing import Annotated
 
 import typer
 from dotenv import find_dotenv, load_dotenv
@@ -71,5 +72,30 @@ def stop():
 	PID_FILE.unlink(missing_ok=True)
 
 
+@app_cli.command("compile")
+def compile_program(
+	trainset: Annotated[
+		Path,
+		typer.Argument(help="JSON Lines file of context, question and response"),
+	],
+	optimizer: Annotated[str, typer.Option(help="bootstrap or mipro")] = "bootstrap",
+	output: Annotated[
+		Path | None, typer.Option(help="Defaults to where the server loads it")
+	] = None,
+):
+	"""
+	Compile the answer program against labelled examples. Restart the server
+	to use it.
+	"""
+	from app.modules.chat.program import compile_answer_program
+
+	try:
+		path = compile_answer_program(trainset, optimizer=optimizer, output=output)
+	except (OSError, ValueError) as e:
+		typer.secho(str(e), fg=typer.colors.RED)
+		raise typer.Exit(code=1)
+	typer.secho(f"Answer program saved to {path}", fg=typer.colors.GREEN)
+
+
 if __name__ == "__main__":
 	app_cli()
@@ -1,34 +1,61 @@
+import asyncio
 import logging
 from contextlib import asynccontextmanager
 
 import nest_asyncio
 import uvicorn
 from dotenv import find_dotenv, load_dotenv
-from fastapi import FastAPI
+from fastapi import FastAPI, Response
 from fastapi.middleware.cors import CORSMiddleware
 
 import app.config as config
 from app.database import create_db_and_tables
-from app.modules.chat import chat_router
-from app.modules.indices import indices_router
+from app.modules.chat import chat_router, load_answer_program
+from app.modules.indices import (
+	check_parsers,
+	indices_router,
+	job_runner,
+	project_watcher,
+	shutdown_worker_pools,
+)
 from app.modules.projects import project_router
 from app.modules.questions import generate_router
+from app.modules.symbols import symbol_router
+from app.shared.metrics import (
+	RequestMetricsMiddleware,
+	init_metrics,
+	monitor_event_loop,
+	render_metrics,
+)
+from app.shared.reranker import shutdown_reranker, warm_up_reranker
 from app.shared.settings import init_settings
 
-nest_asyncio.apply()
-
 logger = logging.getLogger("uvicorn")
 logger.setLevel(4)
 
 load_dotenv(find_dotenv())
-init_settings()
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
 	logger.debug("[Startup]======================")
+	# Not at import time, the spawned parse workers import this module again
+	nest_asyncio.apply()
+	init_settings()
+	init_metrics()
 	create_db_and_tables()
+	check_parsers()
+	await asyncio.to_thread(warm_up_reranker)
+	load_answer_program()
+	await job_runner.start()
+	await project_watcher.start()
+	loop_monitor = asyncio.create_task(monitor_event_loop())
 	yield
+	loop_monitor.cancel()
+	await project_watcher.stop()
+	await job_runner.stop()
+	shutdown_worker_pools()
+	await asyncio.to_thread(shutdown_reranker)
 	logger.debug("[Shutdown]=====================")
 
 
@@ -38,13 +65,16 @@ app.add_middleware(
 	allow_origins=["*"],
 	allow_methods=["*"],
 	allow_headers=["*"],
+	expose_headers=["X-Request-ID"],
 )
+app.add_middleware(RequestMetricsMiddleware)
 
 
 app.include_router(router=project_router)
 app.include_router(router=indices_router)
 app.include_router(router=chat_router)
 app.include_router(router=generate_router)
+app.include_router(router=symbol_router)
 
 
 @app.get("/")
@@ -52,6 +82,12 @@ def heartbeat():
 	return {"status": "ok"}
 
 
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+	content, content_type = render_metrics()
+	return Response(content=content, media_type=content_type)
+
+
 def server():
 	_host = config.HOST
 	_port = config.PORT
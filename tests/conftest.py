@@ -0,0 +1,72 @@
+import os
+import subprocess
+import tempfile
+from pathlib import Path
+
+import pytest
+
+# The database, the vector stores and the indexes are created in the working
+# directory, the tests run in a scratch one
+os.chdir(tempfile.mkdtemp(prefix="stratus-tests-"))
+
+
+@pytest.fixture(scope="session")
+def _tables():
+	from app.database import create_db_and_tables
+
+	# Registers the models of every table
+	from app.modules.indices.jobs import IndexJob  # noqa: F401
+	from app.modules.projects.models import Project  # noqa: F401
+	from app.modules.symbols.models import Symbol  # noqa: F401
+
+	create_db_and_tables()
+
+
+@pytest.fixture
+def db(_tables):
+	"""
+	The application database, emptied after the test.
+	"""
+	yield
+	from sqlmodel import SQLModel
+
+	from app.database import engine
+
+	with engine.begin() as connection:
+		for table in reversed(SQLModel.metadata.sorted_tables):
+			connection.execute(table.delete())
+
+
+@pytest.fixture
+def project(db, tmp_path):
+	from app.database import Session, engine
+	from app.modules.projects import ProjectSchemas
+	from app.modules.projects.models import Project
+
+	with Session(engine) as session:
+		db_project = Project(path=str(tmp_path), name=tmp_path.name)
+		session.add(db_project)
+		session.commit()
+		session.refresh(db_project)
+		return ProjectSchemas.ProjectRead.model_validate(
+			db_project, from_attributes=True
+		)
+
+
+def git(repo: Path, *args: str) -> str:
+	return subprocess.run(
+		["git", *args], cwd=repo, check=True, capture_output=True, text=True
+	).stdout
+
+
+@pytest.fixture
+def repo(tmp_path) -> Path:
+	"""
+	An empty git repository.
+	"""
+	path = tmp_path / "repo"
+	path.mkdir()
+	git(path, "init", "-q", "-b", "main")
+	git(path, "config", "user.email", "tests@example.com")
+	git(path, "config", "user.name", "Tests")
+	return path
@@ -0,0 +1,77 @@
+from uuid import uuid4
+
+from app.shared.answer_cache import AnswerCache
+
+
+def test_similar_queries_hit():
+	cache = AnswerCache(threshold=0.95)
+	project_id = uuid4()
+	cache.put(project_id, "v1", "how is auth done?", [1.0, 0.0], "With tokens")
+
+	cached = cache.get(project_id, "v1", [0.99, 0.05])
+	assert cached.answer == "With tokens"
+	assert cached.query == "how is auth done?"
+	assert cached.similarity > 0.95
+
+	assert cache.get(project_id, "v1", [0.0, 1.0]) is None
+	assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_answers_belong_to_a_project_and_index_version():
+	cache = AnswerCache()
+	project_id, other_id = uuid4(), uuid4()
+	cache.put(project_id, "v1", "query", [1.0, 0.0], "answer")
+	cache.put(other_id, "v1", "query", [1.0, 0.0], "other answer")
+
+	assert cache.get(other_id, "v1", [1.0, 0.0]).answer == "other answer"
+	# Answers of a previous index are dropped
+	assert cache.get(project_id, "v2", [1.0, 0.0]) is None
+	assert cache.get(project_id, "v1", [1.0, 0.0]) is None
+	assert cache.get(other_id, "v1", [1.0, 0.0]) is not None
+
+
+def test_entries_expire(monkeypatch):
+	cache = AnswerCache(ttl_seconds=60)
+	project_id = uuid4()
+	now = 1_000.0
+	monkeypatch.setattr("app.shared.answer_cache.time.time", lambda: now)
+	cache.put(project_id, "v1", "query", [1.0, 0.0], "answer")
+
+	now += 59
+	assert cache.get(project_id, "v1", [1.0, 0.0]).age_seconds == 59
+	now += 2
+	assert cache.get(project_id, "v1", [1.0, 0.0]) is None
+
+
+def test_least_recently_used_are_evicted():
+	cache = AnswerCache(max_entries=2)
+	project_id = uuid4()
+	cache.put(project_id, "v1", "first", [1.0, 0.0, 0.0], "1")
+	cache.put(project_id, "v1", "second", [0.0, 1.0, 0.0], "2")
+	# Used, so the second is evicted instead
+	cache.get(project_id, "v1", [1.0, 0.0, 0.0])
+	cache.put(project_id, "v1", "third", [0.0, 0.0, 1.0], "3")
+
+	assert cache.get(project_id, "v1", [1.0, 0.0, 0.0]).answer == "1"
+	assert cache.get(project_id, "v1", [0.0, 1.0, 0.0]) is None
+	assert cache.get(project_id, "v1", [0.0, 0.0, 1.0]).answer == "3"
+
+
+def test_disabled():
+	cache = AnswerCache(max_entries=0)
+	project_id = uuid4()
+	cache.put(project_id, "v1", "query", [1.0], "answer")
+
+	assert cache.get(project_id, "v1", [1.0]) is None
+
+
+def test_invalidate():
+	cache = AnswerCache()
+	project_id, other_id = uuid4(), uuid4()
+	cache.put(project_id, "v1", "query", [1.0], "answer")
+	cache.put(other_id, "v1", "query", [1.0], "answer")
+
+	cache.invalidate(project_id)
+
+	assert cache.get(project_id, "v1", [1.0]) is None
+	assert cache.get(other_id, "v1", [1.0]) is not None
@@ -0,0 +1,113 @@
+from llama_index.core.schema import NodeWithScore, TextNode
+
+from app.modules.chat.context import merge_spans, pack_context
+
+
+def chunk(
+	start_line: int | None,
+	end_line: int | None,
+	score: float,
+	file_path: str = "/a.py",
+	text: str | None = None,
+) -> NodeWithScore:
+	if text is None:
+		text = "\n".join(f"line {n}" for n in range(start_line, end_line + 1))
+	metadata = {"file_path": file_path}
+	if start_line is not None:
+		metadata.update(start_line=start_line, end_line=end_line)
+	return NodeWithScore(node=TextNode(text=text, metadata=metadata), score=score)
+
+
+def test_overlapping_and_adjacent_chunks_are_merged():
+	nodes = [
+		chunk(1, 10, 0.2),
+		chunk(5, 15, 0.9),
+		chunk(16, 20, 0.1),
+		chunk(30, 35, 0.5),
+		chunk(1, 10, 0.3, file_path="/b.py"),
+	]
+
+	spans, merged = merge_spans(nodes)
+
+	assert merged == 2
+	assert [(s.file_path, s.start_line, s.end_line) for s in spans] == [
+		("/a.py", 1, 20),
+		("/a.py", 30, 35),
+		("/b.py", 1, 10),
+	]
+	assert spans[0].score == 0.9
+	assert spans[0].chunks == 3
+	assert spans[0].lines == [f"line {n}" for n in range(1, 21)]
+
+
+def test_contained_chunks_are_merged():
+	spans, merged = merge_spans([chunk(1, 20, 0.1), chunk(5, 8, 0.7)])
+
+	assert merged == 1
+	assert (spans[0].start_line, spans[0].end_line, spans[0].score) == (1, 20, 0.7)
+	assert len(spans[0].lines) == 20
+
+
+def test_chunks_without_lines_are_deduplicated():
+	nodes = [
+		chunk(None, None, 0.8, text="a sentence"),
+		chunk(None, None, 0.2, text="a paragraph with a sentence in it"),
+		chunk(None, None, 0.5, text="another paragraph"),
+		# The text doesn't match the line range
+		chunk(1, 5, 0.1, text="one line"),
+	]
+
+	spans, merged = merge_spans(nodes)
+
+	assert merged == 1
+	assert [(s.body, s.score) for s in spans] == [
+		("a paragraph with a sentence in it", 0.8),
+		("another paragraph", 0.5),
+		("one line", 0.1),
+	]
+
+
+def test_project_chunks_are_not_merged_across_projects():
+	first, second = chunk(1, 10, 0.5), chunk(5, 15, 0.4)
+	first.node.metadata["project"] = "api"
+	second.node.metadata["project"] = "web"
+
+	spans, merged = merge_spans([first, second])
+
+	assert merged == 0
+	assert spans[0].header == "# api: /a.py:1-10"
+
+
+def test_pack_within_the_budget():
+	nodes = [chunk(1, 10, 0.2), chunk(5, 15, 0.9), chunk(1, 5, 0.5, file_path="/b.py")]
+
+	context = pack_context(nodes, budget=10_000)
+
+	assert context.text.startswith("# /a.py:1-15\nline 1\n")
+	assert "\n\n# /b.py:1-5\n" in context.text
+	assert context.merged_chunks == 1
+	assert context.dropped_spans == 0
+	assert context.header_tokens > 0
+	# The overlap of the merged chunks is saved, the headers are not
+	assert context.saved_tokens > 0
+	assert context.tokens - context.header_tokens <= context.retrieved_tokens
+
+
+def test_nothing_saved_without_overlap():
+	context = pack_context([chunk(1, 5, 0.5), chunk(1, 5, 0.4, file_path="/b.py")])
+
+	assert context.saved_tokens == 0
+
+
+def test_the_span_crossing_the_budget_is_truncated():
+	nodes = [chunk(1, 200, 0.9), chunk(1, 200, 0.5, file_path="/b.py")]
+
+	context = pack_context(nodes, budget=300)
+
+	assert context.tokens <= 300
+	assert context.dropped_spans == 1
+	[span] = context.spans
+	assert span.file_path == "/a.py"
+	assert span.start_line == 1
+	assert span.end_line == len(span.lines) < 200
+	assert context.saved_tokens > 0
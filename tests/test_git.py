@@ -0,0 +1,91 @@
+import pytest
+
+from app.utils.git import (
+	GitIgnoreMatcher,
+	get_changed_files,
+	get_dirty_files,
+	get_head_commit,
+)
+
+from .conftest import git
+
+
+def commit_files(repo, files: dict[str, str], message: str = "commit") -> str:
+	for file_path, content in files.items():
+		(repo / file_path).parent.mkdir(parents=True, exist_ok=True)
+		(repo / file_path).write_text(content)
+	git(repo, "add", "-A")
+	git(repo, "commit", "-q", "-m", message)
+	return get_head_commit(str(repo))
+
+
+def test_changed_files_since_commit(repo):
+	since = commit_files(repo, {"a.py": "a", "b.py": "b", "c.py": "c"})
+	commit_files(repo, {"a.py": "a2"})
+	git(repo, "rm", "-q", "b.py")
+	git(repo, "commit", "-q", "-m", "remove b")
+	(repo / "c.py").write_text("c2")
+	(repo / "new.py").write_text("new")
+
+	changed, removed = get_changed_files(str(repo), since=since)
+
+	assert changed == ["a.py", "c.py", "new.py"]
+	assert removed == ["b.py"]
+
+
+def test_renames_are_a_removal_and_a_change(repo):
+	since = commit_files(repo, {"old.py": "content"})
+	git(repo, "mv", "old.py", "new.py")
+	git(repo, "commit", "-q", "-m", "rename")
+
+	assert get_changed_files(str(repo), since=since) == (["new.py"], ["old.py"])
+
+
+def test_dirty_files_are_checked_again(repo):
+	since = commit_files(repo, {"a.py": "a"})
+	# Indexed while modified and untracked, then reverted and deleted
+	dirty_files = ["a.py", "scratch.py"]
+
+	changed, removed = get_changed_files(
+		str(repo), since=since, dirty_files=dirty_files
+	)
+
+	assert changed == ["a.py"]
+	assert removed == ["scratch.py"]
+
+
+def test_unknown_commit(repo):
+	commit_files(repo, {"a.py": "a"})
+
+	with pytest.raises(ValueError):
+		get_changed_files(str(repo), since="0" * 40)
+
+
+def test_dirty_files(repo):
+	assert get_dirty_files(str(repo)) is None
+
+	commit_files(repo, {"a.py": "a", "b.py": "b"})
+	(repo / "a.py").write_text("a2")
+	(repo / "b.py").unlink()
+	(repo / "c.py").write_text("c")
+
+	assert get_dirty_files(str(repo)) == ["a.py", "b.py", "c.py"]
+
+
+def test_gitignore_matcher(repo):
+	(repo / ".gitignore").write_text("*.log\nbuild/\n!keep.log\n")
+	(repo / "src").mkdir()
+	(repo / "src" / ".gitignore").write_text("generated.py\n!debug.log\n")
+	(repo / ".git" / "info" / "exclude").write_text("secrets.txt\n")
+	matcher = GitIgnoreMatcher(str(repo))
+
+	assert matcher.is_excluded("app.log")
+	assert not matcher.is_excluded("keep.log")
+	assert matcher.is_excluded("build/main.py")
+	assert matcher.is_excluded("src/build/main.py")
+	assert matcher.is_excluded("src/generated.py")
+	assert not matcher.is_excluded("generated.py")
+	# Deeper files take precedence
+	assert not matcher.is_excluded("src/debug.log")
+	assert matcher.is_excluded("secrets.txt")
+	assert not matcher.is_excluded("src/main.py")
@@ -0,0 +1,127 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from app.database import Session, engine
+from app.modules.indices.jobs import IndexJob, IndexJobService, IndexJobStatusEnum
+from app.modules.projects import ProjectStatusEnum, ProjectStatusService
+from app.modules.projects.models import Project
+
+job_service = IndexJobService()
+
+
+@pytest.fixture
+def other_project(db, tmp_path):
+	with Session(engine) as session:
+		db_project = Project(path=str(tmp_path / "other"), name="other")
+		session.add(db_project)
+		session.commit()
+		return db_project.id
+
+
+def make_runnable(job_id):
+	with Session(engine) as session:
+		job = session.get(IndexJob, job_id)
+		job.run_after = datetime.now(timezone.utc) - timedelta(seconds=1)
+		session.commit()
+
+
+def test_enqueue_merges_into_the_queued_job(project):
+	first = job_service.enqueue(project.id, files=["b.py"])
+	second = job_service.enqueue(project.id, priority=5, files=["a.py"])
+
+	assert second.id == first.id
+	assert second.priority == 5
+	assert second.files == ["a.py", "b.py"]
+	assert not second.full_rebuild
+
+	# A job of every changed file covers the listed ones
+	merged = job_service.enqueue(project.id, full_rebuild=True)
+	assert merged.id == first.id
+	assert merged.full_rebuild
+	assert merged.files is None
+
+
+def test_enqueue_creates_a_queued_status(project):
+	job = job_service.enqueue(project.id)
+
+	status = ProjectStatusService().get_project_status(job.project_status_id)
+	assert status.status == ProjectStatusEnum.QUEUE
+
+
+def test_claim_by_priority_one_job_per_project(project, other_project):
+	low = job_service.enqueue(other_project)
+	high = job_service.enqueue(project.id, priority=1)
+
+	claimed = job_service.claim_next()
+	assert claimed.id == high.id
+	assert claimed.status == IndexJobStatusEnum.RUNNING
+	assert claimed.attempts == 1
+
+	# The project already has a running job
+	job_service.enqueue(project.id, priority=10)
+	assert job_service.claim_next().id == low.id
+	assert job_service.claim_next() is None
+
+
+def test_failed_jobs_are_retried_with_backoff(project):
+	job_service.enqueue(project.id)
+	job = job_service.claim_next()
+
+	failed = job_service.fail(job.id, error="boom")
+	assert failed.status == IndexJobStatusEnum.QUEUED
+	assert failed.error == "boom"
+	# Not before the backoff
+	assert job_service.claim_next() is None
+
+	for attempt in range(2, failed.max_attempts + 1):
+		make_runnable(job.id)
+		job = job_service.claim_next()
+		assert job.attempts == attempt
+		failed = job_service.fail(job.id, error="boom")
+
+	assert failed.status == IndexJobStatusEnum.FAILED
+	assert failed.finished_at is not None
+
+
+def test_failures_that_cant_be_retried(project):
+	job_service.enqueue(project.id)
+	job = job_service.claim_next()
+
+	failed = job_service.fail(job.id, error="not a git repository", retry=False)
+
+	assert failed.status == IndexJobStatusEnum.FAILED
+	assert failed.attempts == 1
+
+
+def test_cancel(project):
+	queued = job_service.enqueue(project.id)
+	cancelled = job_service.cancel(queued.id)
+	assert cancelled.status == IndexJobStatusEnum.CANCELLED
+
+	job_service.enqueue(project.id)
+	running = job_service.claim_next()
+	flagged = job_service.cancel(running.id)
+	assert flagged.status == IndexJobStatusEnum.RUNNING
+	assert flagged.cancel_requested
+	# Flagged jobs are not retried
+	assert job_service.fail(running.id, error="cancelled").status == (
+		IndexJobStatusEnum.FAILED
+	)
+
+	with pytest.raises(ValueError):
+		job_service.cancel(cancelled.id)
+
+
+def test_requeue_interrupted(project, other_project):
+	job_service.enqueue(project.id)
+	job_service.enqueue(other_project)
+	interrupted = job_service.claim_next()
+	cancelled = job_service.claim_next()
+	job_service.cancel(cancelled.id)
+
+	assert job_service.requeue_interrupted() == 2
+
+	assert job_service.get_job(interrupted.id).status == IndexJobStatusEnum.QUEUED
+	assert job_service.get_job(cancelled.id).status == IndexJobStatusEnum.CANCELLED
+	assert job_service.claim_next().id == interrupted.id
@@ -0,0 +1,51 @@
+from app.modules.projects import ProjectStatusEnum, ProjectStatusService
+
+status_service = ProjectStatusService()
+
+
+def finish_run(project_id, status, commit_sha=None, dirty_files=None, rebuild=False):
+	run = status_service.create_project_status(project_id, ProjectStatusEnum.QUEUE)
+	if rebuild:
+		status_service.mark_full_rebuild(run.id)
+	return status_service.update_project_status(
+		run.id, status, commit_sha=commit_sha, dirty_files=dirty_files
+	)
+
+
+def test_never_indexed(project):
+	assert status_service.get_last_indexed_run(project.id) == (None, [])
+	assert status_service.get_index_version(project.id) is None
+
+
+def test_last_successful_run(project):
+	finish_run(project.id, ProjectStatusEnum.SUCCESS, "a" * 40, rebuild=True)
+	finish_run(project.id, ProjectStatusEnum.SUCCESS, "b" * 40, ["dirty.py"])
+	finish_run(project.id, ProjectStatusEnum.FAILED, "c" * 40)
+
+	assert status_service.get_last_indexed_run(project.id) == ("b" * 40, ["dirty.py"])
+
+
+def test_failed_rebuild_forces_a_rebuild(project):
+	finish_run(project.id, ProjectStatusEnum.SUCCESS, "a" * 40)
+	# The collection was dropped before the run failed
+	finish_run(project.id, ProjectStatusEnum.FAILED, rebuild=True)
+
+	assert status_service.get_last_indexed_run(project.id) == (None, [])
+
+	finish_run(project.id, ProjectStatusEnum.SUCCESS, "b" * 40, rebuild=True)
+	assert status_service.get_last_indexed_run(project.id) == ("b" * 40, [])
+
+
+def test_interrupted_rebuild_forces_a_rebuild(project):
+	finish_run(project.id, ProjectStatusEnum.SUCCESS, "a" * 40)
+	finish_run(project.id, ProjectStatusEnum.PROCESSING, rebuild=True)
+
+	assert status_service.get_last_indexed_run(project.id) == (None, [])
+
+
+def test_index_version_changes_with_every_run(project):
+	finish_run(project.id, ProjectStatusEnum.SUCCESS, "a" * 40)
+	version = status_service.get_index_version(project.id)
+	finish_run(project.id, ProjectStatusEnum.SUCCESS, "a" * 40)
+
+	assert status_service.get_index_version(project.id) != version
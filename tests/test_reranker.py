@@ -0,0 +1,131 @@
+import asyncio
+import contextlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+from llama_index.core.schema import NodeWithScore, TextNode
+
+from app.shared.reranker import Reranker
+
+
+class LengthModel:
+	"""
+	Scores a pair by the length of its text, and records the batches.
+	"""
+
+	def __init__(self):
+		self.batches: list[int] = []
+		# Set to hold the worker in the first forward pass
+		self.release = threading.Event()
+		self.release.set()
+		self.started = threading.Event()
+
+	def predict(self, pairs, batch_size, show_progress_bar):
+		self.started.set()
+		self.release.wait()
+		self.batches.append(len(pairs))
+		return np.array([float(len(text)) for _, text in pairs])
+
+
+@pytest.fixture
+def model():
+	return LengthModel()
+
+
+@pytest.fixture
+def reranker(model):
+	reranker = Reranker(model=model, batch_size=8, batch_wait_ms=50)
+	yield reranker
+	model.release.set()
+	reranker.close()
+
+
+def test_scores(reranker):
+	assert reranker.submit("query", ["a", "abc", "ab"]).result() == [1.0, 3.0, 2.0]
+	assert reranker.submit("query", []).result() == []
+
+
+def test_concurrent_requests_share_a_batch(reranker, model):
+	with ThreadPoolExecutor(4) as executor:
+		futures = [
+			executor.submit(lambda: reranker.submit("query", ["a", "b"]).result())
+			for _ in range(4)
+		]
+		assert all(f.result() == [1.0, 1.0] for f in futures)
+
+	assert sum(model.batches) == 8
+	assert len(model.batches) < 4
+
+
+def test_batches_are_capped(reranker, model):
+	model.release.clear()
+	# Holds the worker so the next requests are queued together
+	first = reranker.submit("query", ["a"])
+	model.started.wait()
+	futures = [reranker.submit("query", ["a"] * 3) for _ in range(4)]
+	model.release.set()
+
+	assert first.result() == [1.0]
+	assert all(f.result() == [1.0] * 3 for f in futures)
+	assert model.batches[0] == 1
+	assert all(pairs <= 8 for pairs in model.batches)
+	assert sum(model.batches[1:]) == 12
+
+
+def test_rerank_many(reranker, model):
+	nodes = [
+		NodeWithScore(node=TextNode(text=text), score=0.0)
+		for text in ["a", "abc", "ab"]
+	]
+	other = [NodeWithScore(node=TextNode(text="abcd"), score=0.0)]
+
+	ranked, other_ranked = asyncio.run(
+		reranker.arerank_many([("query", nodes), ("other", other)], top_n=2)
+	)
+
+	assert [n.node.text for n in ranked] == ["abc", "ab"]
+	assert other_ranked[0].score == 4.0
+	assert model.batches == [4]
+
+
+def test_model_errors_fail_the_batch(reranker, model):
+	model.predict = lambda *args, **kwargs: 1 / 0
+
+	with pytest.raises(ZeroDivisionError):
+		reranker.submit("query", ["a"]).result()
+
+
+def test_close_scores_the_queued_requests(reranker, model):
+	model.release.clear()
+	first = reranker.submit("query", ["a"])
+	model.started.wait()
+	queued = reranker.submit("query", ["ab"])
+	closing = threading.Thread(target=reranker.close)
+	closing.start()
+	model.release.set()
+	closing.join(timeout=5)
+
+	assert not closing.is_alive()
+	assert first.result() == [1.0]
+	assert queued.result() == [2.0]
+	with pytest.raises(RuntimeError):
+		reranker.submit("query", ["a"]).result()
+	# Closing twice does nothing
+	reranker.close()
+
+
+def test_requests_racing_close_fail(model):
+	# Closed while requests are submitted: each is either scored or fails,
+	# none is left waiting
+	for _ in range(20):
+		reranker = Reranker(model=model, batch_size=4, batch_wait_ms=1)
+		with ThreadPoolExecutor(4) as executor:
+			futures = [
+				executor.submit(reranker.submit, "query", ["a"]) for _ in range(8)
+			]
+			reranker.close()
+			for future in futures:
+				with contextlib.suppress(RuntimeError):
+					assert future.result().result(timeout=5) == [1.0]
@@ -0,0 +1,122 @@
+import asyncio
+import time
+
+import pytest
+from llama_index.core import MockEmbedding
+from llama_index.core.retrievers import BaseRetriever
+from llama_index.core.schema import NodeWithScore, QueryBundle, TextNode
+
+from app.modules.chat.workflow import get_definition_lookup
+from app.shared.federated_retriever import FederatedRetriever
+from app.shared.hybrid_retriever import HybridRetriever, reciprocal_rank_fusion
+
+
+def node(node_id: str, score: float = 0.0) -> NodeWithScore:
+	return NodeWithScore(node=TextNode(id_=node_id, text=node_id), score=score)
+
+
+def ids(nodes: list[NodeWithScore]) -> list[str]:
+	return [n.node.node_id for n in nodes]
+
+
+class StaticRetriever(BaseRetriever):
+	def __init__(self, nodes: list[NodeWithScore], delay: float = 0.0):
+		self.nodes = nodes
+		self.delay = delay
+		self.queries: list[QueryBundle] = []
+		super().__init__()
+
+	def _retrieve(self, query_bundle: QueryBundle) -> list[NodeWithScore]:
+		self.queries.append(query_bundle)
+		time.sleep(self.delay)
+		return [
+			NodeWithScore(node=n.node.model_copy(), score=n.score) for n in self.nodes
+		]
+
+
+class FailingRetriever(BaseRetriever):
+	def _retrieve(self, query_bundle: QueryBundle) -> list[NodeWithScore]:
+		raise RuntimeError("store unavailable")
+
+
+@pytest.mark.parametrize(
+	("query", "name"),
+	[
+		("where is `UserService` defined?", "UserService"),
+		("Where are app::utils::Config declared", "app.utils.Config"),
+		("definition of get_tokenizer", "get_tokenizer"),
+		("UserService", "UserService"),
+		("`deployment`?", "deployment"),
+		("app.config", "app.config"),
+		("getUser?", "getUser"),
+		("deployment?", None),
+		("Hello", None),
+		("how does indexing work?", None),
+	],
+)
+def test_definition_lookup(query, name):
+	assert get_definition_lookup(query) == name
+
+
+def test_reciprocal_rank_fusion():
+	dense = [node("a"), node("b"), node("c")]
+	lexical = [node("c"), node("d"), node("a")]
+
+	fused = reciprocal_rank_fusion([dense, lexical], k=60, top_k=3)
+
+	assert ids(fused) == ["a", "c", "b"]
+	assert fused[0].score == pytest.approx(1 / 61 + 1 / 63)
+	assert fused[2].score == pytest.approx(1 / 62)
+
+
+def test_hybrid_retriever():
+	retriever = HybridRetriever(
+		[StaticRetriever([node("a"), node("b")]), StaticRetriever([node("b")])],
+		similarity_top_k=5,
+	)
+
+	assert ids(retriever.retrieve("query")) == ["b", "a"]
+	assert ids(asyncio.run(retriever.aretrieve("query"))) == ["b", "a"]
+
+
+def test_federated_merge_by_score():
+	retriever = FederatedRetriever(
+		{
+			"api": StaticRetriever([node("a1", 0.9), node("a2", 0.3)]),
+			"web": StaticRetriever([node("w1", 0.5), node("w2", 0.4)]),
+		},
+		similarity_top_k=3,
+		embed_model=MockEmbedding(embed_dim=8),
+	)
+
+	nodes = retriever.retrieve("query")
+
+	assert ids(nodes) == ["a1", "w1", "w2"]
+	assert [n.node.metadata["project"] for n in nodes] == ["api", "web", "web"]
+	assert "project" in nodes[0].node.excluded_embed_metadata_keys
+
+
+def test_federated_query_is_embedded_once():
+	shards = [StaticRetriever([node("a", 0.5)]), StaticRetriever([node("b", 0.4)])]
+	retriever = FederatedRetriever(
+		{"api": shards[0], "web": shards[1]}, embed_model=MockEmbedding(embed_dim=8)
+	)
+
+	asyncio.run(retriever.aretrieve("query"))
+
+	assert all(shard.queries[0].embedding == [0.5] * 8 for shard in shards)
+
+
+def test_failing_and_slow_projects_are_left_out():
+	retriever = FederatedRetriever(
+		{
+			"api": StaticRetriever([node("a", 0.1)]),
+			"broken": FailingRetriever(),
+			"slow": StaticRetriever([node("s", 0.9)], delay=1.0),
+		},
+		timeout=0.2,
+		embed_model=MockEmbedding(embed_dim=8),
+	)
+
+	assert ids(asyncio.run(retriever.aretrieve("query"))) == ["a"]
+	assert ids(retriever.retrieve("query")) == ["s", "a"]
@@ -0,0 +1,102 @@
+from uuid import uuid4
+
+from app.modules.indices.code_splitter import CodeSymbol
+from app.modules.symbols import SymbolService
+
+symbol_service = SymbolService()
+
+
+def definition(name: str, line: int = 1) -> CodeSymbol:
+	return CodeSymbol(
+		name=name,
+		qualified_name=name,
+		kind="class_definition",
+		language="python",
+		start_line=line,
+		end_line=line + 1,
+	)
+
+
+def call(name: str, scope: str) -> CodeSymbol:
+	return CodeSymbol(
+		name=name,
+		qualified_name=name,
+		kind="reference",
+		language="python",
+		start_line=3,
+		end_line=3,
+		scope=scope,
+	)
+
+
+def definitions(project_id, name: str) -> list[str]:
+	return [d.file_path for d in symbol_service.find_definitions(project_id, name)]
+
+
+def test_staged_symbols_are_hidden_until_the_run_commits(project):
+	symbol_service.replace_files(project.id, {"/a.py": [definition("UserService")]})
+	run_id = uuid4()
+
+	symbol_service.stage_files(
+		project.id,
+		run_id,
+		{"/a.py": [definition("AccountService")], "/b.py": [definition("UserService")]},
+	)
+	assert definitions(project.id, "UserService") == ["/a.py"]
+	assert definitions(project.id, "AccountService") == []
+
+	symbol_service.commit_run(project.id, run_id)
+	assert definitions(project.id, "UserService") == ["/b.py"]
+	assert definitions(project.id, "AccountService") == ["/a.py"]
+
+
+def test_commit_deletes_removed_files(project):
+	symbol_service.replace_files(
+		project.id,
+		{
+			"/a.py": [definition("Kept"), call("helper", "Kept")],
+			"/b.py": [definition("Removed"), call("helper", "Removed")],
+		},
+	)
+
+	symbol_service.commit_run(project.id, uuid4(), removed_files=["/b.py"])
+
+	assert definitions(project.id, "Kept") == ["/a.py"]
+	assert definitions(project.id, "Removed") == []
+	references = symbol_service.get_references(project.id, "helper").references
+	assert [r.scope for r in references] == ["Kept"]
+
+
+def test_commit_of_a_rebuild_clears_the_project(project):
+	symbol_service.replace_files(project.id, {"/a.py": [definition("Old")]})
+	stale_run, run_id = uuid4(), uuid4()
+	symbol_service.stage_files(project.id, stale_run, {"/c.py": [definition("Stale")]})
+	symbol_service.stage_files(project.id, run_id, {"/b.py": [definition("New")]})
+
+	symbol_service.commit_run(project.id, run_id, clear=True)
+
+	assert definitions(project.id, "Old") == []
+	assert definitions(project.id, "New") == ["/b.py"]
+	symbol_service.commit_run(project.id, stale_run)
+	assert definitions(project.id, "Stale") == []
+
+
+def test_discard_staged(project):
+	run_id = uuid4()
+	symbol_service.stage_files(project.id, run_id, {"/a.py": [definition("Failed")]})
+
+	symbol_service.discard_staged(project.id)
+	symbol_service.commit_run(project.id, run_id)
+
+	assert definitions(project.id, "Failed") == []
+
+
+def test_search_skips_staged_symbols(project):
+	symbol_service.replace_files(project.id, {"/a.py": [definition("UserService")]})
+	symbol_service.stage_files(
+		project.id, uuid4(), {"/b.py": [definition("UserServiceFactory")]}
+	)
+
+	symbols = symbol_service.search(project.id, "user serv").symbols
+
+	assert [s.name for s in symbols] == ["UserService"]